@@ -0,0 +1,255 @@
+"""Benchmarks de los caminos críticos sobre libros sintéticos de distintos tamaños.
+
+    python -m benchmarks.run                              # 10k, 100k y 1M filas
+    python -m benchmarks.run --filas 10000 --casos balance
+    python -m benchmarks.run --guardar benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --tolerancia 0.25
+
+Las bases de datos generadas se guardan en benchmarks/.cache y se reutilizan.
+Con --baseline se compara la mediana de cada caso y se sale con código 1 si
+alguno es más lento que la línea base en más de la tolerancia.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from financial_core.aggregation import agrupar_entradas_gastos, datos_grafica_dias
+from financial_core.conversions import ts_now
+from financial_core.forecast import CachePronosticos, holt_winters_predict_next
+from financial_core.maintenance import copia_seguridad, estado
+from financial_core.storage import Storage
+from financial_core.synthetic import generar_libro
+
+CACHE = os.path.join(os.path.dirname(__file__), ".cache")
+TAMANOS = (10_000, 100_000, 1_000_000)
+ANIOS = 5
+MODOS = ("Semana", "Mes", "Año")
+
+
+def libro(filas, semilla, proporcion_fijos, n_conceptos):
+    """Ruta de la base de datos sintética con esos parámetros; la genera si no existe."""
+    anio_inicio = datetime.now().year - ANIOS + 1
+    nombre = f"libro-{filas}-a{ANIOS}-{anio_inicio}-f{proporcion_fijos}-c{n_conceptos}-s{semilla}.db"
+    ruta = os.path.join(CACHE, nombre)
+    if not os.path.exists(ruta):
+        os.makedirs(CACHE, exist_ok=True)
+        tmp = ruta + ".tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        print(f"generando {nombre}…", file=sys.stderr, flush=True)
+        db = Storage(tmp)
+        db.init_schema()
+        generar_libro(db, anios=ANIOS, filas_dia=filas / (ANIOS * 365.25),
+                      proporcion_fijos=proporcion_fijos, n_conceptos=n_conceptos,
+                      semilla=semilla, anio_inicio=anio_inicio)
+        db.con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        db.close()
+        os.replace(tmp, ruta)
+    return ruta
+
+
+def medir(funcion, preparar=None, presupuesto=1.0, max_rep=25):
+    """Tiempos en ms: una pasada de calentamiento y luego hasta agotar el presupuesto."""
+    if preparar:
+        preparar()
+    funcion()
+    tiempos = []
+    inicio = time.perf_counter()
+    while len(tiempos) < max_rep:
+        if preparar:
+            preparar()
+        t0 = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - t0) * 1000)
+        if len(tiempos) >= 3 and time.perf_counter() - inicio > presupuesto:
+            break
+    return {"mediana_ms": round(statistics.median(tiempos), 4),
+            "min_ms": round(min(tiempos), 4), "repeticiones": len(tiempos)}
+
+
+def casos(ruta, tmpdir):
+    """(nombre, funcion, preparar) de cada camino crítico sobre la base de datos ruta."""
+    db = Storage(ruta)
+    db.init_schema()
+    (n,) = db.con.execute("SELECT COUNT(*) FROM movimientos").fetchone()
+    hoy = datetime.now()
+    hace_un_anio = f"{hoy.day:02d}/{hoy.month:02d}/{hoy.year - 1}"
+    manana = hoy.strftime("%d/%m/%Y")
+
+    def abrir():
+        otra = Storage(ruta)
+        otra.init_schema()
+        otra.close()
+    yield "init_db", abrir, None
+
+    # materializar_fijos escribe: se mide sobre una copia con los fijos de los
+    # últimos 12 meses pendientes.
+    copia = os.path.join(tmpdir, "materializar.db")
+    shutil.copy(ruta, copia)
+    escritura = Storage(copia)
+    escritura.init_schema()
+    (max_id,) = escritura.con.execute("SELECT MAX(id) FROM movimientos").fetchone()
+    (max_seq,) = escritura.con.execute("SELECT MAX(seq) FROM cambios").fetchone()
+    y, m = (hoy.year - 1, hoy.month)
+
+    def pendiente():
+        with escritura.con:
+            escritura.con.execute("DELETE FROM movimientos WHERE id > ?", (max_id,))
+            # Sin los borrados registrados: una copia borrada no se vuelve a materializar.
+            escritura.con.execute("DELETE FROM cambios WHERE seq > ?", (max_seq,))
+            escritura.con.execute("UPDATE reglas_fijas SET materializado_hasta=?", (f"{y:04d}-{m:02d}",))
+    yield "materializar_fijos", escritura.materializar_fijos, pendiente
+
+    for tipo in ("Todos", "Gasto"):
+        for concepto in ("", "super"):
+            for rango in ("", "año"):
+                desde, hasta = (hace_un_anio, manana) if rango else ("", "")
+                nombre = f"cargar_movimientos_filtrados[tipo={tipo},concepto={concepto or '-'},rango={rango or '-'}]"
+                yield nombre, (lambda f=(tipo, concepto, desde, hasta): db.cargar_movimientos_filtrados(*f)), None
+
+    yield "calcular_balance", db.calcular_balance, None
+    hace_medio_anio = ts_now() - 182 * 86400
+    yield "balance_en[hace_medio_anio]", lambda: db.balance_en(hace_medio_anio), None
+    for modo in MODOS:
+        yield f"agrupar_entradas_gastos[{modo}]", (lambda modo=modo: agrupar_entradas_gastos(db, modo)), None
+    yield "datos_grafica_dias[todo]", lambda: datos_grafica_dias(db, puntos=1000), None
+
+    todos = ("Todos", "", "", "")
+    yield "listado[primera_pagina]", lambda: (db.contar_movimientos(todos), db.pagina_movimientos(todos, 50)), None
+    yield "listado[salto_a_mitad]", lambda: db.pagina_movimientos(todos, 50, offset=n // 2), None
+    ultima = db.pagina_movimientos(todos, 1, offset=n // 2)
+    if ultima:
+        clave = (ultima[0][5], ultima[0][0])
+        yield "listado[siguiente_pagina_keyset]", lambda: db.pagina_movimientos(todos, 50, despues=clave), None
+    busqueda = ("Todos", "super", "", "")
+    yield "listado[busqueda]", lambda: (db.contar_movimientos(busqueda), db.pagina_movimientos(busqueda, 50)), None
+
+    _, serie = db.monthly_variable_expense_series()
+    serie = [c / 100 for c in serie]
+    yield "holt_winters_predict_next[sin_cache]", lambda: holt_winters_predict_next(serie, 12), None
+    cache = CachePronosticos(os.path.join(tmpdir, "pronosticos.json"))
+    yield "holt_winters_predict_next[cache]", lambda: holt_winters_predict_next(serie, 12, cache=cache), None
+    yield "series_gasto_variable_por_concepto", db.series_gasto_variable_por_concepto, None
+
+    try:
+        from financial_core.columnar import Columnas
+    except ImportError:
+        Columnas = None
+    if Columnas is not None:
+        columnas = Columnas().cargar(db)
+        yield "columnas.cargar", lambda: columnas.cargar(db), None
+        for modo in MODOS:
+            yield f"columnas.agrupar_entradas_gastos[{modo}]", (lambda modo=modo: agrupar_entradas_gastos(columnas, modo)), None
+        yield "columnas.calcular_balance", columnas.calcular_balance, None
+        yield "columnas.balance_en[hace_medio_anio]", lambda: columnas.balance_en(hace_medio_anio), None
+        yield "columnas.datos_grafica_dias[todo]", lambda: datos_grafica_dias(columnas, puntos=1000), None
+        yield "columnas.series_gasto_variable_por_concepto", columnas.series_gasto_variable_por_concepto, None
+
+    # Los mismos listados con los años cerrados archivados en particiones.
+    copia = os.path.join(tmpdir, "archivado.db")
+    shutil.copy(ruta, copia)
+    archivado = Storage(copia)
+    archivado.init_schema()
+    for anio in range(hoy.year - ANIOS + 1, hoy.year):
+        archivado.archivar(anio)
+    ultimo_anio = ("Todos", "", hace_un_anio, manana)
+    yield "archivado.cargar_movimientos_filtrados[rango=año]", lambda: archivado.cargar_movimientos_filtrados(*ultimo_anio), None
+    yield "archivado.listado[primera_pagina]", lambda: (archivado.contar_movimientos(todos), archivado.pagina_movimientos(todos, 50)), None
+    yield "archivado.listado[salto_a_mitad]", lambda: archivado.pagina_movimientos(todos, 50, offset=n // 2), None
+    yield "archivado.listado[busqueda]", lambda: (archivado.contar_movimientos(busqueda), archivado.pagina_movimientos(busqueda, 50)), None
+
+    # Copia en caliente sin pausas: las particiones se enlazan desde la generación anterior.
+    copias = os.path.join(tmpdir, "copias")
+    yield "mantenimiento.copia_seguridad", lambda: copia_seguridad(archivado, copias, 2, pausa_s=0), None
+    yield "mantenimiento.estado", lambda: estado(archivado, copias), None
+
+    archivado.close()
+    escritura.close()
+    db.close()
+
+
+def ejecutar(args):
+    resultados = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for filas in args.filas:
+            ruta = libro(filas, args.semilla, args.fijos, args.conceptos)
+            por_caso = resultados[str(filas)] = {}
+            for nombre, funcion, preparar in casos(ruta, tmpdir):
+                if args.casos and not any(c in nombre for c in args.casos):
+                    continue
+                por_caso[nombre] = r = medir(funcion, preparar, args.presupuesto)
+                print(f"{filas:>9}  {nombre:<70} {r['mediana_ms']:>11.3f} ms", flush=True)
+    return {
+        "meta": {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "plataforma": platform.platform(),
+            "semilla": args.semilla, "fijos": args.fijos, "conceptos": args.conceptos,
+        },
+        "resultados": resultados,
+    }
+
+
+def comparar(actual, base, tolerancia, minimo_ms):
+    """Lista de (filas, caso, ms base, ms actual) que empeoran más que la tolerancia.
+
+    Las diferencias de menos de minimo_ms no cuentan: en casos de microsegundos
+    el ruido supera con facilidad cualquier tolerancia relativa.
+    """
+    peores = []
+    for filas, casos_base in base["resultados"].items():
+        for nombre, r in casos_base.items():
+            nuevo = actual["resultados"].get(filas, {}).get(nombre)
+            if nuevo is None:
+                continue
+            antes, ahora = r["mediana_ms"], nuevo["mediana_ms"]
+            ratio = ahora / antes if antes else 1.0
+            marca = "  REGRESIÓN" if ratio > 1 + tolerancia and ahora - antes > minimo_ms else ""
+            print(f"{filas:>9}  {nombre:<70} {antes:>10.3f} → {ahora:>10.3f} ms  x{ratio:.2f}{marca}")
+            if marca:
+                peores.append((filas, nombre, antes, ahora))
+    return peores
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks.run", description=__doc__.split("\n")[0])
+    parser.add_argument("--filas", type=int, nargs="+", default=list(TAMANOS))
+    parser.add_argument("--casos", nargs="+", help="solo los casos cuyo nombre contenga alguno de estos textos")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--fijos", type=float, default=0.1, help="proporción de filas fijas")
+    parser.add_argument("--conceptos", type=int, default=500, help="conceptos distintos")
+    parser.add_argument("--presupuesto", type=float, default=1.0, help="segundos por caso")
+    parser.add_argument("--salida", help="guarda los resultados en este JSON")
+    parser.add_argument("--guardar", metavar="BASELINE", help="guarda los resultados como línea base")
+    parser.add_argument("--baseline", help="compara con esta línea base")
+    parser.add_argument("--tolerancia", type=float, default=0.25)
+    parser.add_argument("--minimo-ms", type=float, default=0.1,
+                        help="diferencia absoluta mínima para contar como regresión")
+    args = parser.parse_args(argv)
+
+    actual = ejecutar(args)
+    for ruta in filter(None, (args.salida, args.guardar)):
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(actual, f, indent=1, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)
+        peores = comparar(actual, base, args.tolerancia, args.minimo_ms)
+        if peores:
+            print(f"{len(peores)} casos más lentos que la línea base (tolerancia {args.tolerancia:.0%})",
+                  file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,245 +1,143 @@
+import sys
+import time
+
+PERFIL_ARRANQUE = "--profile-startup" in sys.argv
+_T0_ARRANQUE = time.perf_counter()
+_fases_arranque = set()
+
+def marcar_arranque(fase):
+    """Con --profile-startup imprime (una sola vez por fase) el ms desde el arranque."""
+    if PERFIL_ARRANQUE and fase not in _fases_arranque:
+        _fases_arranque.add(fase)
+        ms = (time.perf_counter() - _T0_ARRANQUE) * 1000
+        print(f"[arranque] {ms:8.1f} ms  {fase}", file=sys.stderr, flush=True)
+
+import json
+import math
 import tkinter as tk
-from tkinter import ttk, messagebox
-import sqlite3
+from tkinter import ttk, messagebox, filedialog
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from statsmodels.tsa.holtwinters import ExponentialSmoothing
-from calendar import monthrange
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.figure import Figure
 
-DB_PATH = "movimientos.db"
-APP_ICON = "media/1f4b2.ico"
+from financial_core import (DB_PATH, FORECAST_CACHE_PATH, Storage, CachePronosticos,
+                            a_centimos, de_centimos, iso_to_human, human_to_iso,
+                            parse_date_only, ts_to_dt, formato_eur, datos_grafica,
+                            datos_grafica_dias)
+from financial_core.importer import abrir, formato_por_extension, importar
+from financial_core.instrumentation import METRICAS, PRESUPUESTO_FRAME_MS, medir, medido
+from financial_core.maintenance import Mantenimiento, estado, texto_estado
 
-def iso_now():
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+if "--metricas" in sys.argv:
+    METRICAS.activar()
 
-def iso_to_human(ts_iso: str) -> str:
-    try:
-        dt = datetime.strptime(ts_iso, "%Y-%m-%d %H:%M:%S")
-        return dt.strftime("%d/%m/%Y %H:%M")
-    except Exception:
-        return ts_iso
+# matplotlib y statsmodels tardan en importarse; se cargan la primera vez que
+# hacen falta (ver importar_graficas y financial_core.forecast).
+Figure = None
+FigureCanvasTkAgg = None
+fig = canvas = None
+grafica = None           # GraficaResumen de la vista de resumen
 
-def human_to_iso(ts_human: str) -> str:
-    dt = datetime.strptime(ts_human, "%d/%m/%Y %H:%M")
-    return dt.strftime("%Y-%m-%d %H:%M:00")
+APP_ICON = "media/1f4b2.ico"
 
-def parse_date_only(dmy: str) -> str:
-    return datetime.strptime(dmy, "%d/%m/%Y").strftime("%Y-%m-%d")
+db = None
+# Los crea main(); el resto de funciones de la interfaz los usan como globales.
+ventana = tareas = cache_pronosticos = None
+columnas = None          # financial_core.columnar.Columnas, cuando termina de cargarse
+mantenimiento = None     # copias y compactación cuando la aplicación está ociosa
+current_view = content_frame = None
 
 def init_db():
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS movimientos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            concepto TEXT NOT NULL,
-            periodicidad TEXT NOT NULL,
-            tipo TEXT NOT NULL,              -- 'Gasto' o 'Entrada'
-            cantidad REAL NOT NULL,
-            creado_en TEXT NOT NULL          -- 'YYYY-MM-DD HH:MM:SS'
-        )
-    """)
-    connection.commit()
-    connection.close()
-
-def save_movement(concepto, periodicidad, tipo, cantidad, creado_en=None):
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    if not creado_en:
-        creado_en = iso_now()
-    cur.execute("""
-        INSERT INTO movimientos (concepto, periodicidad, tipo, cantidad, creado_en)
-        VALUES (?, ?, ?, ?, ?)
-    """, (concepto, periodicidad, tipo, float(cantidad), creado_en))
-    con.commit()
-    rowid = cur.lastrowid
-    con.close()
-    return rowid, creado_en
-
-def cargar_movimientos():
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("SELECT id, concepto, periodicidad, tipo, cantidad, creado_en FROM movimientos ORDER BY creado_en ASC, id ASC")
-    rows = cur.fetchall()
-    con.close()
-    return rows
-
-def cargar_movimientos_filtrados(tipo: str, concepto: str, desde: str, hasta: str):
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    where = []
-    params = []
-
-    if tipo != "Todos":
-        where.append("tipo = ?")
-        params.append(tipo)
-
-    if concepto.strip():
-        where.append("LOWER(concepto) LIKE ?")
-        params.append(f"%{concepto.strip().lower()}%")
-
-    if desde.strip():
+    global db
+    if db is None:
+        db = Storage(DB_PATH)
+    db.init_schema()
+
+
+class TareasFondo:
+    """Ejecuta consultas y cálculos pesados fuera del hilo de Tk.
+
+    Cada tarea lleva una clave (p. ej. "grafica"): si se envía otra con la
+    misma clave antes de que termine, el resultado de la anterior se descarta
+    y solo se entrega el último. Los resultados vuelven por una cola que se
+    vacía desde el bucle de Tk con after(), así que los callbacks siempre
+    corren en el hilo de la interfaz.
+    """
+
+    def __init__(self, root, hilos=2, intervalo_ms=16):
+        self.root = root
+        self.intervalo_ms = intervalo_ms
+        self.pool = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="financial_app")
+        self.resultados = queue.Queue()
+        self.activas = {}            # clave -> (generación, evento de cancelación)
+        self._generacion = 0
+        self.al_cambiar_ocupado = None
+        self.root.after(self.intervalo_ms, self._drenar)
+
+    def enviar(self, clave, funcion, al_terminar, al_fallar=None):
+        """Lanza funcion(cancelado) en segundo plano y entrega su resultado a al_terminar.
+
+        cancelado es un threading.Event; las tareas largas pueden consultarlo
+        entre pasos para abandonar trabajo que ya nadie va a mostrar.
+        """
+        self.cancelar(clave)
+        self._generacion += 1
+        gen, cancelado = self._generacion, threading.Event()
+        self.activas[clave] = (gen, cancelado)
+        self._notificar()
+        self.pool.submit(self._ejecutar, clave, gen, cancelado, funcion, al_terminar, al_fallar)
+
+    def cancelar(self, *claves):
+        """Descarta las tareas de esas claves, o todas si no se indica ninguna."""
+        for c in claves or list(self.activas):
+            tarea = self.activas.pop(c, None)
+            if tarea:
+                tarea[1].set()
+        self._notificar()
+
+    @property
+    def ocupado(self):
+        return bool(self.activas)
+
+    def cerrar(self):
+        self.cancelar()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def _ejecutar(self, clave, gen, cancelado, funcion, al_terminar, al_fallar):
+        if cancelado.is_set():
+            return
         try:
-            d = parse_date_only(desde.strip())
-            where.append("creado_en >= ?")
-            params.append(f"{d} 00:00:00")
-        except ValueError:
-            pass
+            with medir(f"fondo.{clave}"):
+                resultado, error = funcion(cancelado), None
+        except Exception as e:
+            resultado, error = None, e
+        self.resultados.put((clave, gen, resultado, error, al_terminar, al_fallar))
 
-    if hasta.strip():
+    def _drenar(self):
         try:
-            h = parse_date_only(hasta.strip())
-            where.append("creado_en <= ?")
-            params.append(f"{h} 23:59:59")
-        except ValueError:
+            while True:
+                clave, gen, resultado, error, al_terminar, al_fallar = self.resultados.get_nowait()
+                tarea = self.activas.get(clave)
+                if tarea is None or tarea[0] != gen or tarea[1].is_set():
+                    continue
+                del self.activas[clave]
+                self._notificar()
+                # Lo que corre aquí bloquea la interfaz: se compara con el presupuesto de un frame.
+                with medir(f"tk.{clave}", PRESUPUESTO_FRAME_MS):
+                    if error is None:
+                        al_terminar(resultado)
+                    elif al_fallar is not None:
+                        al_fallar(error)
+                    else:
+                        self.root.report_callback_exception(type(error), error, error.__traceback__)
+        except queue.Empty:
             pass
+        self.root.after(self.intervalo_ms, self._drenar)
 
-    sql = "SELECT id, concepto, periodicidad, tipo, cantidad, creado_en FROM movimientos"
-    if where:
-        sql += " WHERE " + " AND ".join(where)
-    sql += " ORDER BY creado_en DESC, id DESC"
-
-    cur.execute(sql, params)
-    rows = cur.fetchall()
-    con.close()
-    return rows
-
-def obtener_movimiento_por_id(mid: int):
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("SELECT id, concepto, periodicidad, tipo, cantidad, creado_en FROM movimientos WHERE id=?", (mid,))
-    row = cur.fetchone()
-    con.close()
-    return row
-
-def actualizar_movimiento(mid: int, concepto: str, periodicidad: str, tipo: str, cantidad: float, creado_en: str):
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""
-        UPDATE movimientos
-        SET concepto=?, periodicidad=?, tipo=?, cantidad=?, creado_en=?
-        WHERE id=?
-    """, (concepto, periodicidad, tipo, float(cantidad), creado_en, mid))
-    con.commit()
-    con.close()
-
-def eliminar_movimiento(mid: int):
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("DELETE FROM movimientos WHERE id=?", (mid,))
-    con.commit()
-    con.close()
-
-def calcular_balance():
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""
-        SELECT COALESCE(SUM(
-            CASE WHEN tipo='Entrada' THEN cantidad
-                 WHEN tipo='Gasto'   THEN -cantidad
-                 ELSE 0 END
-        ), 0.0) as balance
-        FROM movimientos
-    """)
-    (balance,) = cur.fetchone()
-    con.close()
-    return float(balance or 0.0)
-
-
-def y_m_list_between(start_dt, end_dt):
-    y, m = start_dt.year, start_dt.month
-    out = []
-    while (y < end_dt.year) or (y == end_dt.year and m <= end_dt.month):
-        out.append((y, m))
-        if m == 12:
-            y += 1; m = 1
-        else:
-            m += 1
-    return out
-
-def monthly_fixed_projection_for_year(target_year: int):
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""SELECT concepto, tipo, cantidad, creado_en
-                   FROM movimientos WHERE periodicidad='Fijo'""")
-    rows = cur.fetchall()
-    con.close()
-
-    fixed = [0.0]*12
-    for concepto, tipo, cantidad, ts in rows:
-        if tipo != "Gasto":
-            continue
-        try:
-            dt0 = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
-        except Exception:
-            try:
-                dt0 = datetime.fromisoformat(ts)
-            except Exception:
-                continue
-
-        if dt0.year > target_year:
-            continue
-
-        start_month = dt0.month if dt0.year == target_year else 1
-        for m in range(start_month, 13):
-            fixed[m-1] += float(cantidad)
-    return fixed
-
-def monthly_variable_expense_series():
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""
-        SELECT cantidad, creado_en FROM movimientos
-        WHERE tipo='Gasto' AND periodicidad!='Fijo'
-        ORDER BY creado_en ASC
-    """)
-    rows = cur.fetchall()
-    con.close()
-
-    agg = {}
-    for cantidad, ts in rows:
-        try:
-            dt = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
-        except Exception:
-            try:
-                dt = datetime.fromisoformat(ts)
-            except Exception:
-                continue
-        key = (dt.year, dt.month)
-        agg[key] = agg.get(key, 0.0) + float(cantidad)
-
-    keys = sorted(agg.keys())
-    values = [agg[k] for k in keys]
-    return keys, values
-
-def rmse_from_residuals(residuals):
-    import numpy as np
-    if len(residuals) == 0:
-        return 0.0
-    return float(np.sqrt(np.mean(np.array(residuals)**2)))
-
-def holt_winters_predict_next(values, horizon=12):
-    import numpy as np
-    values = np.asarray(values, dtype=float)
-    if len(values) < 6:
-        pred = [float(values.mean()) if len(values)>0 else 0.0]*horizon
-        return pred, values, 0.0
-
-    try:
-        model = ExponentialSmoothing(values, trend='add', seasonal='add', seasonal_periods=12)
-        res = model.fit(optimized=True, use_boxcox=False, remove_bias=False)
-        pred = list(map(float, res.forecast(horizon)))
-        fitted = np.asarray(res.fittedvalues, dtype=float)
-        rmse = rmse_from_residuals(values - fitted[:len(values)])
-        return pred, fitted, rmse
-    except Exception:
-        pred = [float(values[-1])] * horizon
-        return pred, values, 0.0
-
-def month_names_es():
-    return ["Enero","Febrero","Marzo","Abril","Mayo","Junio",
-            "Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
+    def _notificar(self):
+        if self.al_cambiar_ocupado is not None:
+            self.al_cambiar_ocupado(self.ocupado)
 
 
 def configurar_estilos(root):
@@ -272,6 +170,7 @@ def configurar_estilos(root):
     style.configure("Card.TFrame", background=COLOR_BG_CARD, relief="flat")
     style.configure("TFrame", background=COLOR_BG_CARD)
     style.configure("Toolbar.TFrame", background="#ECE8F8")
+    style.configure("Toolbar.TLabel", foreground=COLOR_MUTED, background="#ECE8F8")
     style.configure("ToplevelCard.TFrame", background="#FFFFFF", relief="flat")
 
     style.configure("TEntry", padding=4, fieldbackground="#FFFFFF", background="#FFFFFF")
@@ -295,7 +194,7 @@ def abrir_formulario(mov=None):
     concepto_var = tk.StringVar(value=mov[1] if editing else "")
     periodicidad_var = tk.StringVar(value=mov[2] if editing else "Fijo")
     tipo_var = tk.StringVar(value=mov[3] if editing else "Gasto")
-    cantidad_var = tk.StringVar(value=str(mov[4]).replace(".", ",") if editing else "")
+    cantidad_var = tk.StringVar(value=f"{de_centimos(mov[4]):.2f}".replace(".", ",") if editing else "")
     fecha_var = tk.StringVar(value=iso_to_human(mov[5]) if editing else datetime.now().strftime("%d/%m/%Y %H:%M"))
 
     card = ttk.Frame(win, style="ToplevelCard.TFrame")
@@ -330,7 +229,6 @@ def abrir_formulario(mov=None):
     ttk.Radiobutton(frame_tipo, text="Entrada", variable=tipo_var, value="Entrada")\
         .pack(side="left", padx=(12, 0))
 
-
     ttk.Label(card, text="Cantidad:", style="Field.TLabel")\
         .grid(row=5, column=0, sticky="w", **pad)
     monto_frame = ttk.Frame(card)
@@ -362,8 +260,8 @@ def abrir_formulario(mov=None):
             entry_concepto.focus_set()
             return
         try:
-            cantidad = float(cantidad_txt)
-        except ValueError:
+            cantidad = a_centimos(cantidad_txt)
+        except (ValueError, ArithmeticError):
             messagebox.showerror("Cantidad inválida", "Introduce una cantidad numérica (p. ej., 123.45).", parent=win)
             entry_cantidad.focus_set()
             return
@@ -374,34 +272,35 @@ def abrir_formulario(mov=None):
             entry_fecha.focus_set()
             return
 
-        try:
-            if editing:
-                actualizar_movimiento(mov[0], concepto, periodicidad, tipo, cantidad, fecha_iso)
-            else:
-                save_movement(concepto, periodicidad, tipo, cantidad, creado_en=fecha_iso)
-        except Exception as e:
-            messagebox.showerror("Error guardando", f"No se pudo guardar el movimiento.\n\n{e}", parent=win)
-            return
-
-
-        materializar_fijos()
-        if current_view.get() == "Resumen":
-            refrescar_balance_y_grafica()
-        else:
-            refrescar_listado()
-
-        win.destroy()
+        # Guardar y materializar los fijos es una escritura: va en segundo plano.
+        def ejecutar(_cancelado):
+            with db.escritor() as repo:
+                if editing:
+                    repo.actualizar_movimiento(mov[0], concepto, periodicidad, tipo, cantidad, fecha_iso)
+                else:
+                    repo.save_movement(concepto, periodicidad, tipo, cantidad, creado_en=fecha_iso)
+                repo.materializar_fijos()
+
+        def hecho(_r):
+            refrescar_vista(mov[0] if editing else None)
+            if win.winfo_exists():
+                win.destroy()
+
+        def fallo(e):
+            if win.winfo_exists():
+                btn_guardar.state(["!disabled"])
+            messagebox.showerror("Error guardando", f"No se pudo guardar el movimiento.\n\n{e}",
+                                 parent=win if win.winfo_exists() else ventana)
+
+        btn_guardar.state(["disabled"])
+        tareas.enviar("guardar", ejecutar, hecho, fallo)
 
     def cancelar():
         win.destroy()
 
     btn_cancelar = ttk.Button(actions, text="Cancelar", command=cancelar)
     btn_guardar = ttk.Button(actions, text="Guardar", style="Primary.TButton", command=guardar)
-    materializar_fijos()
-    if current_view.get() == "Resumen":
-        refrescar_balance_y_grafica()
-    else:
-        refrescar_listado()
+    materializar_en_fondo()
     btn_cancelar.grid(row=0, column=0, sticky="w", padx=(14, 6), pady=14)
     btn_guardar.grid(row=0, column=1, sticky="e", padx=(6, 14), pady=14)
 
@@ -409,157 +308,739 @@ def abrir_formulario(mov=None):
     win.bind("<Return>", lambda e: guardar())
     win.bind("<Escape>", lambda e: cancelar())
 
-def agrupar_entradas_gastos(movs, modo="Mes"):
+def abrir_edicion_masiva(ids, al_guardar):
+    """Cambia concepto, tipo, periodicidad o fecha de varios movimientos a la vez.
 
-    from collections import defaultdict
-    from datetime import timedelta
+    Los campos vacíos o «(sin cambios)» no se tocan; al_guardar recibe los
+    valores para lanzarlos como una sola operación.
+    """
+    win = tk.Toplevel(ventana)
+    win.title("Editar movimientos")
+    win.geometry("520x340")
+    win.configure(bg="MediumOrchid4")
+    win.resizable(False, False)
+    win.transient(ventana)
+    win.grab_set()
+    try:
+        win.iconbitmap(APP_ICON)
+    except Exception:
+        pass
 
-    def parse_ts(ts):
-        try:
-            return datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
-        except Exception:
-            return datetime.fromisoformat(ts)
+    sin_cambios = "(sin cambios)"
+    concepto_var = tk.StringVar()
+    periodicidad_var = tk.StringVar(value=sin_cambios)
+    tipo_var = tk.StringVar(value=sin_cambios)
+    dias_var = tk.StringVar(value="0")
 
-    ahora = datetime.now()
-    datos = []
-    for _id, _c, _p, tipo, cantidad, ts in movs:
-        try:
-            dt = parse_ts(ts)
-        except Exception:
-            continue
-        datos.append((dt, tipo, float(cantidad)))
-
-    if modo == "Semana":
-        year, week, _ = ahora.isocalendar()
-        lunes = datetime.fromisocalendar(year, week, 1).date()
-        dias = [lunes + timedelta(days=i) for i in range(7)]
-        etiquetas = ["Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom"]
-        e_map = defaultdict(float); g_map = defaultdict(float)
-        for dt, tipo, cant in datos:
-            d = dt.date()
-            if d in dias:
-                (e_map if tipo=="Entrada" else g_map)[d] += cant
-        entradas = [e_map.get(d, 0.0) for d in dias]
-        gastos   = [g_map.get(d, 0.0) for d in dias]
-
-    elif modo == "Año":
-        e_map = defaultdict(float); g_map = defaultdict(float)
-        for dt, tipo, cant in datos:
-            y = dt.year
-            (e_map if tipo=="Entrada" else g_map)[y] += cant
-        years = sorted(set(e_map)|set(g_map))
-        if len(years) > 6: years = years[-6:]
-        etiquetas = [str(y) for y in years]
-        entradas  = [e_map.get(y,0.0) for y in years]
-        gastos    = [g_map.get(y,0.0) for y in years]
+    card = ttk.Frame(win, style="ToplevelCard.TFrame")
+    card.place(relx=0.5, rely=0.5, anchor="center")
+    card.grid_columnconfigure(1, weight=1)
+    pad = {'padx': 14, 'pady': 8}
 
-    else:
-        year = ahora.year
-        etiquetas = ["Enero","Febrero","Marzo","Abril","Mayo","Junio",
-                     "Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
-        e = [0.0]*12; g = [0.0]*12
-        for dt, tipo, cant in datos:
-            if dt.year == year:
-                i = dt.month - 1
-                if tipo == "Entrada": e[i] += cant
-                else: g[i] += cant
-        entradas, gastos = e, g
-
-    return etiquetas, entradas, gastos
-
-def predecir_gasto_mensual(cost_per_month, window=6):
-    prediction = [0.0]*12
-    for i in range(12):
-        past = [cost_per_month[j] for j in range(max(0, i-window), i)]
-        if past:
-            prediction[i] = sum(past)/len(past)
-        else:
-            prediction[i] = 0.0
-    return prediction
+    ttk.Label(card, text=f"Editar {len(ids)} movimientos", style="Title.TLabel")\
+        .grid(row=0, column=0, columnspan=2, sticky="w", padx=14, pady=(14, 4))
+    ttk.Separator(card, orient="horizontal").grid(row=1, column=0, columnspan=2, sticky="ew", padx=14, pady=(0, 6))
 
+    ttk.Label(card, text="Nuevo concepto (vacío = igual):", style="Field.TLabel")\
+        .grid(row=2, column=0, sticky="w", **pad)
+    entry_concepto = ttk.Entry(card, textvariable=concepto_var, width=28)
+    entry_concepto.grid(row=2, column=1, sticky="ew", **pad)
 
-def dibujar_grafica(modo):
-    movs = cargar_movimientos()
-    ax.clear()
+    ttk.Label(card, text="Periodicidad:", style="Field.TLabel")\
+        .grid(row=3, column=0, sticky="w", **pad)
+    ttk.Combobox(card, textvariable=periodicidad_var, state="readonly", width=14,
+                 values=[sin_cambios, "Fijo", "Variable"]).grid(row=3, column=1, sticky="w", **pad)
+
+    ttk.Label(card, text="Tipo:", style="Field.TLabel")\
+        .grid(row=4, column=0, sticky="w", **pad)
+    ttk.Combobox(card, textvariable=tipo_var, state="readonly", width=14,
+                 values=[sin_cambios, "Gasto", "Entrada"]).grid(row=4, column=1, sticky="w", **pad)
+
+    ttk.Label(card, text="Mover la fecha (días, ±):", style="Field.TLabel")\
+        .grid(row=5, column=0, sticky="w", **pad)
+    entry_dias = ttk.Entry(card, textvariable=dias_var, width=8)
+    entry_dias.grid(row=5, column=1, sticky="w", **pad)
+
+    ttk.Separator(card, orient="horizontal").grid(row=6, column=0, columnspan=2, sticky="ew", padx=14, pady=(4, 0))
+
+    actions = ttk.Frame(card, style="ToplevelCard.TFrame")
+    actions.grid(row=7, column=0, columnspan=2, sticky="ew")
+    actions.grid_columnconfigure(0, weight=1)
+
+    def guardar():
+        try:
+            dias = int(dias_var.get().strip() or 0)
+        except ValueError:
+            messagebox.showerror("Días inválidos", "Introduce un número entero de días (p. ej., -30).", parent=win)
+            entry_dias.focus_set()
+            return
+        cambios = {
+            "concepto": concepto_var.get().strip() or None,
+            "periodicidad": None if periodicidad_var.get() == sin_cambios else periodicidad_var.get(),
+            "tipo": None if tipo_var.get() == sin_cambios else tipo_var.get(),
+            "desplazar": dias * 86400,
+        }
+        win.destroy()
+        if any(cambios.values()):
+            al_guardar(cambios)
 
-    COLOR_ENTRADAS = "#2ecc71"
-    COLOR_GASTOS   = "#e74c3c"
-    COLOR_PREV     = "#6c5ce7"
-    COLOR_BANDA    = "#b3a6ff"
+    def cancelar():
+        win.destroy()
 
-    etiquetas, entradas, gastos = agrupar_entradas_gastos(movs, modo=modo)
+    ttk.Button(actions, text="Cancelar", command=cancelar)\
+        .grid(row=0, column=0, sticky="w", padx=(14, 6), pady=14)
+    ttk.Button(actions, text="Aplicar", style="Primary.TButton", command=guardar)\
+        .grid(row=0, column=1, sticky="e", padx=(6, 14), pady=14)
 
-    if not etiquetas:
-        ax.set_title(f"Entradas vs Gastos por {modo.lower()}", color="#333")
+    entry_concepto.focus_set()
+    win.bind("<Return>", lambda e: guardar())
+    win.bind("<Escape>", lambda e: cancelar())
+
+def importar_graficas(_cancelado=None):
+    global Figure, FigureCanvasTkAgg
+    from matplotlib.figure import Figure as _Figure
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg as _FigureCanvasTkAgg
+    Figure, FigureCanvasTkAgg = _Figure, _FigureCanvasTkAgg
+    marcar_arranque("matplotlib importado")
+
+
+COLOR_ENTRADAS = "#2ecc71"
+COLOR_GASTOS   = "#e74c3c"
+COLOR_PREV     = "#6c5ce7"
+COLOR_BANDA    = "#b3a6ff"
+
+
+class VistaGrafica:
+    """Ejes y artistas de un modo de la gráfica del resumen."""
+
+    def __init__(self, ax):
+        self.ax = ax
+        self.ax2 = None            # eje del saldo en el modo Día
+        self.clave = None          # etiquetas con las que se montaron los artistas
+        self.animados = []
+        self.barras_e = self.barras_g = self.linea = self.banda = None
+        self.fondo = None          # píxeles del último dibujado completo, sin los animados
+        self.posicion = None       # posiciones de los ejes tras su tight_layout
+
+    @property
+    def ejes(self):
+        return [self.ax] if self.ax2 is None else [self.ax, self.ax2]
+
+
+class GraficaResumen:
+    """Gráfica del resumen que se actualiza sin rehacerse.
+
+    Cada modo tiene sus propios ejes, creados la primera vez que se muestra;
+    cambiar de modo solo oculta unos y enseña otros. Las barras y líneas son
+    artistas animados: al llegar datos nuevos se cambian sus alturas y
+    vértices y se repintan con blitting sobre el fondo guardado del modo.
+    Ejes, rejilla, leyenda y tight_layout solo se rehacen si cambian las
+    etiquetas, si los datos se salen de la escala o si cambia el tamaño de la
+    ventana.
+
+    En el modo Día la rueda acerca o aleja y arrastrar desplaza el eje de
+    fechas; al_cambiar_rango(desde, hasta) recibe los días visibles para
+    volver a pedir solo ese tramo.
+    """
+
+    def __init__(self, fig, canvas):
+        self.fig, self.canvas = fig, canvas
+        self.vistas = {}
+        self.activa = None
+        self.al_cambiar_rango = None
+        self._arrastre = None
+        canvas.mpl_connect("draw_event", self._al_dibujar)
+        canvas.mpl_connect("resize_event", self._al_redimensionar)
+        canvas.mpl_connect("scroll_event", self._al_rodar)
+        canvas.mpl_connect("button_press_event", self._al_pulsar)
+        canvas.mpl_connect("motion_notify_event", self._al_mover)
+        canvas.mpl_connect("button_release_event", self._al_soltar)
+
+    def pintar(self, datos):
+        modo = datos["modo"]
+        if modo == "Día":
+            clave = ("vacio",) if datos["vacio"] else ()
+        else:
+            clave = tuple(datos["etiquetas"])
+        vista = self.vistas.get(modo)
+        if vista is None:
+            vista = self.vistas[modo] = VistaGrafica(self._nuevos_ejes())
+        if vista is not self.activa:
+            for ax in self.activa.ejes if self.activa is not None else ():
+                ax.set_visible(False)
+            for ax in vista.ejes:
+                ax.set_visible(True)
+            self.activa = vista
+        if vista.clave != clave:
+            if modo == "Día":
+                self._montar_dias(vista, datos["vacio"])
+            else:
+                self._montar(vista, modo, datos["etiquetas"])
+            vista.clave = clave
+        if vista.ax2 is not None:
+            vista.ax2.set_visible(clave == ())
+        if modo == "Día":
+            cambio = not datos["vacio"] and self._actualizar_dias(vista, datos)
+        else:
+            cambio = bool(clave) and self._actualizar(vista, datos)
+        # Con otra escala cambian las etiquetas de los ejes y con ellas los márgenes.
+        if vista.posicion is None or cambio:
+            self._ajustar(vista)
+            vista.fondo = None
+        else:
+            # tight_layout de otro modo mueve todos los ejes de la figura.
+            for ax, posicion in zip(vista.ejes, vista.posicion):
+                ax.set_position(posicion)
+        if vista.fondo is None:
+            self.canvas.draw_idle()
+        else:
+            self.canvas.restore_region(vista.fondo)
+            self._dibujar_animados(vista)
+        marcar_arranque("gráfica dibujada")
+
+    def _nuevos_ejes(self):
+        # Todos en la misma celda para que tight_layout los trate como uno solo.
+        if not self.vistas:
+            self._celda = self.fig.add_gridspec(1, 1)[0]
+        ax = self.fig.add_subplot(self._celda)
+        ax.set_facecolor("#FFFFFF")
+        for spine in ax.spines.values():
+            spine.set_color("#888")
+        return ax
+
+    def _ajustar(self, vista):
+        # tight_layout mide los ejes contra su celda: tienen que partir de ella y no
+        # de la posición que dejó el último ajuste de otro modo.
+        for ax in vista.ejes:
+            ax.set_position(self._celda.get_position(self.fig))
+        self.fig.tight_layout()
+        vista.posicion = [ax.get_position() for ax in vista.ejes]
+
+    def _limpiar(self, vista):
+        for ax in vista.ejes:
+            ax.clear()
+        vista.animados = []
+        vista.linea = vista.banda = None
+        vista.posicion = vista.fondo = None
+        ax = vista.ax
+        ax.tick_params(colors="#333")
         ax.set_ylabel("€", color="#333")
+        ax.grid(axis='y', linestyle='--', alpha=0.35, color="#bbb")
+        return ax
+
+    @staticmethod
+    def _sin_datos(ax, titulo):
+        ax.set_title(titulo, color="#333")
         ax.text(0.5, 0.5, "Sin datos", ha="center", va="center",
                 transform=ax.transAxes, color="#666")
-        ax.grid(axis='y', linestyle='--', alpha=0.35, color="#bbb")
-        fig.tight_layout(); canvas.draw_idle()
+
+    def _montar(self, vista, modo, etiquetas):
+        ax = self._limpiar(vista)
+        if not etiquetas:
+            self._sin_datos(ax, f"Entradas vs Gastos por {modo.lower()}")
+            return
+
+        x = list(range(len(etiquetas)))
+        ceros = [0] * len(x)
+        vista.barras_e = ax.bar(x, ceros, label="Entradas", color=COLOR_ENTRADAS, alpha=0.70,
+                                edgecolor="#1e8449", animated=True)
+        vista.barras_g = ax.bar(x, ceros, label="Gastos", color=COLOR_GASTOS, alpha=0.55,
+                                edgecolor="#943126", animated=True)
+        vista.animados = list(vista.barras_e) + list(vista.barras_g)
+        leyenda = [vista.barras_e, vista.barras_g]
+        if modo == "Mes":
+            (vista.linea,) = ax.plot(x, ceros, marker="o", linewidth=2.0, label="Predicción gasto total",
+                                     color=COLOR_PREV, animated=True)
+            vista.banda = ax.fill_between(x, ceros, ceros, alpha=0.25, color=COLOR_BANDA,
+                                          label="±RMSE", animated=True)
+            vista.animados += [vista.banda, vista.linea]
+            leyenda += [vista.linea, vista.banda]
+
+        subt = ("por mes (año actual)" if modo == "Mes"
+                else "de esta semana" if modo == "Semana"
+                else "por año")
+        ax.set_title(f"Entradas vs Gastos {subt}", color="#333")
+        ax.set_xticks(x)
+        ax.set_xticklabels(etiquetas, rotation=45, ha="right", color="#333")
+        ax.legend(handles=leyenda, facecolor="#FFFFFF", edgecolor="#ddd")
+        ax.axhline(0, linewidth=1, color="#999")
+        ax.set_xlim(-0.6, len(x) - 0.4)
+
+    def _montar_dias(self, vista, vacio):
+        from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
+        if vista.ax2 is None:
+            vista.ax2 = vista.ax.twinx()
+        ax = self._limpiar(vista)
+        if vacio:
+            vista.ax2.set_visible(False)
+            self._sin_datos(ax, "Flujo diario y saldo")
+            return
+        vista.ax2.set_visible(True)
+        ax2 = vista.ax2
+        # clear() deshace lo que twinx() deja preparado.
+        ax2.yaxis.tick_right()
+        ax2.yaxis.set_label_position("right")
+        ax2.patch.set_visible(False)
+        ax2.xaxis.set_visible(False)
+        ax2.tick_params(colors="#333")
+        ax2.set_ylabel("Saldo €", color=COLOR_PREV)
+        # Los días desde 1970 son directamente fechas de matplotlib (su época es 1970-01-01).
+        localizador = AutoDateLocator()
+        ax.xaxis.set_major_locator(localizador)
+        ax.xaxis.set_major_formatter(ConciseDateFormatter(localizador))
+        (vista.entradas,) = ax.plot([], [], linewidth=1.0, color=COLOR_ENTRADAS, label="Entradas", animated=True)
+        (vista.gastos,) = ax.plot([], [], linewidth=1.0, color=COLOR_GASTOS, label="Gastos", animated=True)
+        (vista.saldo,) = ax2.plot([], [], linewidth=1.8, color=COLOR_PREV, label="Saldo", animated=True)
+        vista.animados = [vista.entradas, vista.gastos, vista.saldo]
+        ax.set_title("Flujo diario y saldo", color="#333")
+        ax.legend(handles=vista.animados, loc="upper left", facecolor="#FFFFFF", edgecolor="#ddd")
+        ax.axhline(0, linewidth=1, color="#999")
+
+    def _actualizar(self, vista, datos):
+        """Pone los datos en los artistas; True si hace falta cambiar la escala."""
+        for barra, v in zip(vista.barras_e, datos["entradas"]):
+            barra.set_height(v)
+        for barra, v in zip(vista.barras_g, datos["gastos"]):
+            barra.set_height(v)
+        valores = datos["entradas"] + datos["gastos"]
+
+        if vista.linea is not None:
+            linea = datos["linea"]
+            vista.linea.set_visible(linea is not None)
+            vista.banda.set_visible(False)
+            if linea is not None:
+                vista.linea.set_ydata(linea)
+                valores += linea
+                inicio = datos["start_month_index"]
+                if datos["steps_remaining"] > 0 and datos["rmse"] > 0:
+                    xs = list(range(inicio, 12))
+                    inf, sup = datos["banda_inf"][inicio:], datos["banda_sup"][inicio:]
+                    vista.banda.set_verts([list(zip(xs + xs[::-1], inf + sup[::-1]))])
+                    vista.banda.set_visible(True)
+                    valores += sup
+
+        return self._escala(vista.ax, min(0, min(valores)), max(valores))
+
+    def _actualizar_dias(self, vista, datos):
+        vista.entradas.set_data(*datos["entradas"])
+        vista.gastos.set_data(*datos["gastos"])
+        vista.saldo.set_data(*datos["saldo"])
+        cambio = False
+        limites = (datos["desde"] - 0.5, datos["hasta"] + 0.5)
+        if self._arrastre is None and tuple(vista.ax.get_xlim()) != limites:
+            vista.ax.set_xlim(*limites)
+            cambio = True
+        flujo = datos["entradas"][1] + datos["gastos"][1]
+        cambio |= self._escala(vista.ax, 0, max(flujo))
+        saldo = datos["saldo"][1]
+        cambio |= self._escala(vista.ax2, min(saldo), max(saldo))
+        return cambio
+
+    @staticmethod
+    def _escala(ax, bajo, alto):
+        """Ajusta el eje y con margen si los datos se salen o quedan muy por debajo; True si cambia."""
+        if alto <= bajo:
+            alto = bajo + 1
+        y0, y1 = ax.get_ylim()
+        if bajo < y0 or alto > y1 or alto - bajo < 0.5 * (y1 - y0) or (bajo == 0) != (y0 == 0):
+            margen = 0.1 * (alto - bajo)
+            ax.set_ylim(bajo if bajo == 0 else bajo - margen, alto + margen)
+            return True
+        return False
+
+    # -- zoom y desplazamiento del modo Día ---------------------------------
+
+    def _eje_dias(self, evento):
+        vista = self.vistas.get("Día")
+        if vista is None or vista is not self.activa or vista.clave != ():
+            return None
+        return vista.ax if evento.inaxes in vista.ejes else None
+
+    def _ver(self, ax, x0, x1, avisar):
+        ancho = min(max(x1 - x0, 7), 36525)
+        centro = (x0 + x1) / 2
+        x0, x1 = centro - ancho / 2, centro + ancho / 2
+        ax.set_xlim(x0, x1)
+        self.activa.fondo = None
+        self.canvas.draw_idle()
+        if avisar and self.al_cambiar_rango is not None:
+            self.al_cambiar_rango(math.ceil(x0), math.floor(x1))
+
+    def _al_rodar(self, evento):
+        ax = self._eje_dias(evento)
+        if ax is None or evento.xdata is None:
+            return
+        factor = 0.8 if evento.button == "up" else 1.25
+        x0, x1 = ax.get_xlim()
+        c = evento.xdata
+        self._ver(ax, c - (c - x0) * factor, c + (x1 - c) * factor, True)
+
+    def _al_pulsar(self, evento):
+        ax = self._eje_dias(evento)
+        if ax is not None and evento.button == 1:
+            self._arrastre = (evento.x, ax.get_xlim())
+
+    def _al_mover(self, evento):
+        if self._arrastre is None or evento.x is None:
+            return
+        x_inicio, (x0, x1) = self._arrastre
+        ax = self.activa.ax
+        dx = (evento.x - x_inicio) * (x1 - x0) / ax.bbox.width
+        self._ver(ax, x0 - dx, x1 - dx, False)
+
+    def _al_soltar(self, _evento):
+        if self._arrastre is None:
+            return
+        self._arrastre = None
+        x0, x1 = self.activa.ax.get_xlim()
+        self._ver(self.activa.ax, x0, x1, True)
+
+    # -- dibujado -------------------------------------------------------------
+
+    def _al_redimensionar(self, _evento):
+        for vista in self.vistas.values():
+            vista.fondo = vista.posicion = None
+        if self.activa is not None:
+            self._ajustar(self.activa)
+
+    def _al_dibujar(self, _evento):
+        # Tras un dibujado completo (sin los animados) se guarda el fondo y se pintan encima.
+        if self.activa is None:
+            return
+        self.activa.fondo = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._dibujar_animados(self.activa)
+
+    def _dibujar_animados(self, vista):
+        for artista in vista.animados:
+            if artista.get_visible():
+                artista.axes.draw_artist(artista)
+        self.canvas.blit(self.fig.bbox)
+
+
+@medido("grafica.pintar", PRESUPUESTO_FRAME_MS)
+def pintar_grafica(datos):
+    grafica.pintar(datos)
+
+
+def fuente_totales(repo):
+    # Con la copia en columnas cargada los agregados salen de NumPy; si no, de SQL.
+    if columnas is None:
+        return repo
+    return columnas.al_dia(repo)
+
+
+_ultima_grafica = {"clave": None, "datos": None}
+# Días visibles en el modo Día; None en un extremo es hasta el principio o el final de la historia.
+_rango_dias = {"desde": None, "hasta": None, "espera": None}
+
+def dibujar_grafica(modo):
+    rango = puntos = None
+    if modo == "Día":
+        rango = (_rango_dias["desde"], _rango_dias["hasta"])
+        # Un punto por píxel de ancho: más no se ve y solo cuesta dibujarlo.
+        puntos = canvas.get_tk_widget().winfo_width() if canvas is not None else 1000
+    # Si nada se ha escrito desde la última vez, se repinta sin consultar ni reajustar.
+    clave = (modo, rango, puntos, db.version, datetime.now().strftime("%Y-%m-%d"))
+    if _ultima_grafica["clave"] == clave:
+        tareas.cancelar("grafica")
+        if canvas is not None:
+            pintar_grafica(_ultima_grafica["datos"])
         return
 
-    x = list(range(len(etiquetas)))
-    ax.bar(x, entradas, label="Entradas", color=COLOR_ENTRADAS, alpha=0.70, edgecolor="#1e8449")
-    ax.bar(x, gastos,   label="Gastos",   color=COLOR_GASTOS,   alpha=0.55, edgecolor="#943126")
-
-    if modo == "Mes":
-        ahora = datetime.now()
-        year = ahora.year
-        keys_hist, val_hist = monthly_variable_expense_series()
-        pred_var_12, fitted, rmse = holt_winters_predict_next(val_hist, horizon=12)
-        meses = [(year, m) for m in range(1, 13)]
-        start_month_index = ahora.month - 1
-        steps_remaining = 12 - start_month_index
-        pred_var_al_year = [0.0]*12
-        for i in range(steps_remaining):
-            pred_var_al_year[start_month_index + i] = pred_var_12[i]
-
-
-        proj_fijos = monthly_fixed_projection_for_year(year)
-
-        linea = [0.0]*12
-        for i in range(12):
-            if i < start_month_index:
-                linea[i] = gastos[i]
-            else:
-                linea[i] = pred_var_al_year[i] + proj_fijos[i]
-
-        banda_inf = [None]*12
-        banda_sup = [None]*12
-        for i in range(12):
-            if i >= start_month_index:
-                banda_inf[i] = max(0.0, linea[i] - rmse)
-                banda_sup[i] = linea[i] + rmse
-        ax.plot(x, linea, marker="o", linewidth=2.0, label="Predicción gasto total", color=COLOR_PREV)
-        if steps_remaining > 0 and rmse > 0:
-            xs = x[start_month_index:]
-            ys_low = [banda_inf[i] for i in range(start_month_index, 12)]
-            ys_up  = [banda_sup[i]  for i in range(start_month_index, 12)]
-            ax.fill_between(xs, ys_low, ys_up, alpha=0.25, color=COLOR_BANDA, label="±RMSE")
-
-    subt = ("por mes (año actual)" if modo == "Mes"
-            else "de esta semana" if modo == "Semana"
-            else "por año")
-    ax.set_title(f"Entradas vs Gastos {subt}", color="#333")
-    ax.set_ylabel("€", color="#333")
-    ax.set_xticks(x)
-    ax.set_xticklabels(etiquetas, rotation=45, ha="right", color="#333")
-    ax.grid(axis='y', linestyle='--', alpha=0.35, color="#bbb")
-    ax.legend(facecolor="#FFFFFF", edgecolor="#ddd")
-    ax.axhline(0, linewidth=1, color="#999")
-
-    fig.tight_layout()
-    canvas.draw_idle()
+    def calcular(cancelado):
+        with db.lector() as repo:
+            if modo == "Día":
+                return datos_grafica_dias(fuente_totales(repo), *rango, puntos=max(puntos, 100))
+            return datos_grafica(fuente_totales(repo), modo, cancelado, cache=cache_pronosticos)
+
+    def mostrar(datos):
+        marcar_arranque("datos de la gráfica calculados")
+        _ultima_grafica.update(clave=clave, datos=datos)
+        # Si la figura aún no existe, crear_grafica pintará estos datos.
+        if canvas is not None:
+            pintar_grafica(datos)
+
+    tareas.enviar("grafica", calcular, mostrar)
+
+
+def texto_dia(dia):
+    return "" if dia is None else ts_to_dt(dia * 86400).strftime("%d/%m/%Y")
+
+
+def fijar_rango_dias(desde, hasta, esperar_ms=0):
+    """Cambia los días del modo Día y vuelve a pedir la gráfica (tras esperar_ms sin cambios)."""
+    _rango_dias.update(desde=desde, hasta=hasta)
+    for entry, dia in ((entry_desde, desde), (entry_hasta, hasta)):
+        entry.delete(0, "end")
+        entry.insert(0, texto_dia(dia))
 
+    def pedir():
+        _rango_dias["espera"] = None
+        if current_view.get() == "Resumen" and combo_modo.get() == "Día":
+            dibujar_grafica("Día")
+
+    if _rango_dias["espera"] is not None:
+        ventana.after_cancel(_rango_dias["espera"])
+    _rango_dias["espera"] = ventana.after(esperar_ms, pedir)
 
 
 def refrescar_balance_y_grafica():
-    bal = calcular_balance()
-    balance_str = f"{bal:,.2f} €".replace(",", "X").replace(".", ",").replace("X", ".")
-    balance_val_label.config(text=balance_str)
+    def calcular(_cancelado):
+        with db.lector() as repo:
+            return fuente_totales(repo).calcular_balance()
+
+    def mostrar(balance):
+        bal = de_centimos(balance)
+        balance_str = f"{bal:,.2f} €".replace(",", "X").replace(".", ",").replace("X", ".")
+        balance_val_label.config(text=balance_str)
+        marcar_arranque("balance mostrado")
+
+    tareas.enviar("balance", calcular, mostrar)
     modo = combo_modo.get()
     dibujar_grafica(modo)
 
+class ListadoVirtual:
+    """Treeview que solo contiene las filas visibles del listado.
+
+    Las filas se piden por páginas keyset (creado_en, id) a medida que se
+    desplaza la vista, de modo que memoria y formateo dependen del alto de
+    la ventana y no del número de movimientos. Todas las consultas van en
+    segundo plano con la clave "listado": la última anula a las anteriores.
+    """
+
+    def __init__(self, tree, vsb, formatear):
+        self.tree = tree
+        self.vsb = vsb
+        self.formatear = formatear
+        self.filtros = ("Todos", "", "", "")
+        self.total = 0
+        self.inicio = 0
+        self.filas = []
+        self.visibles = 20
+        self.seleccion = set()
+        self._pintando = False
+        # Consulta en curso ("cargar", "refrescar" o "mover") y, al moverse, el índice pedido.
+        self._pedido = None
+        self._destino = None
+        self._filtros_pedidos = self.filtros
+
+        vsb.configure(command=self._scrollbar)
+        tree.bind("<Configure>", self._al_redimensionar)
+        tree.bind("<<TreeviewSelect>>", self._al_seleccionar)
+        tree.bind("<Button-1>", self._al_pulsar)
+        tree.bind("<MouseWheel>", lambda e: self.desplazar(-3 if e.delta > 0 else 3))
+        tree.bind("<Button-4>", lambda e: self.desplazar(-3))
+        tree.bind("<Button-5>", lambda e: self.desplazar(3))
+        tree.bind("<Up>", lambda e: self._mover_cursor(-1))
+        tree.bind("<Down>", lambda e: self._mover_cursor(1))
+        tree.bind("<Prior>", lambda e: self._mover_cursor(-self.visibles))
+        tree.bind("<Next>", lambda e: self._mover_cursor(self.visibles))
+        tree.bind("<Home>", lambda e: self.ir_a(0))
+        tree.bind("<End>", lambda e: self.ir_a(self.total))
+
+    @staticmethod
+    def _clave(fila):
+        return (fila[5], fila[0])
+
+    def cargar(self, filtros):
+        """Aplica filtros nuevos y vuelve al principio del listado."""
+        visibles = self.visibles
+
+        def consultar(_cancelado):
+            with db.lector() as repo:
+                return repo.contar_movimientos(filtros), repo.pagina_movimientos(filtros, visibles)
+
+        def mostrar(resultado):
+            self._pedido = self._destino = None
+            self.filtros = filtros
+            self.seleccion.clear()
+            self.total, self.filas = resultado
+            self.inicio = 0
+            self._pintar()
+
+        self._pedido, self._destino = "cargar", None
+        self._filtros_pedidos = filtros
+        tareas.enviar("listado", consultar, mostrar)
+
+    def refrescar(self):
+        """Recuenta y vuelve a leer la ventana actual sin moverse de sitio."""
+        if self._pedido == "cargar":
+            # Lo que se está cargando ya sale recontado y con el alto actual.
+            return self.cargar(self._filtros_pedidos)
+        filtros, visibles = self.filtros, self.visibles
+        primera = self._clave(self.filas[0]) if self.filas else None
+
+        def consultar(_cancelado):
+            with db.lector() as repo:
+                total = repo.contar_movimientos(filtros)
+                if primera:
+                    ts, mid = primera
+                    # (ts, mid + 1) hace que la primera fila visible también entre.
+                    filas = repo.pagina_movimientos(filtros, visibles, despues=(ts, mid + 1))
+                else:
+                    filas = repo.pagina_movimientos(filtros, visibles)
+                faltan = visibles - len(filas)
+                if faltan > 0 and (filas or primera):
+                    # Sin filas tras la primera (se han borrado o el filtro ya no llega
+                    # hasta ahí) se rellena con las que la preceden.
+                    tope = self._clave(filas[0]) if filas else primera
+                    filas = repo.pagina_movimientos(filtros, faltan, antes=tope) + filas
+                if not filas and total:
+                    filas = repo.pagina_movimientos(filtros, visibles, offset=max(0, total - visibles))
+                return total, filas
+
+        def mostrar(resultado):
+            self._pedido = self._destino = None
+            self.total, self.filas = resultado
+            self.inicio = max(0, min(self.inicio, self.total - len(self.filas)))
+            self._pintar()
+
+        self._pedido, self._destino = "refrescar", None
+        tareas.enviar("listado", consultar, mostrar)
+
+    def actualizar_fila(self, mid):
+        """Repinta en su sitio una fila editada; solo relee si cambia de posición."""
+        if self._pedido is not None:
+            return self.refrescar()
+        filtros = self.filtros
+
+        def consultar(_cancelado):
+            with db.lector() as repo:
+                nueva = repo.obtener_movimiento_por_id(mid)
+                return nueva, nueva is not None and repo.cumple_filtros(mid, filtros)
+
+        def mostrar(resultado):
+            self._pedido = None
+            nueva, cumple = resultado
+            for i, fila in enumerate(self.filas):
+                if fila[0] == mid:
+                    if cumple and self._clave(nueva) == self._clave(fila):
+                        self.filas[i] = nueva
+                        self.tree.item(str(mid), values=self.formatear(nueva))
+                        return
+                    break
+            self.refrescar()
+
+        self._pedido = "actualizar"
+        tareas.enviar("listado", consultar, mostrar)
+
+    def quitar_fila(self, mid):
+        self.seleccion.discard(mid)
+        self.refrescar()
+
+    def desplazar(self, n, luego=None):
+        # Los pasos que llegan mientras se consulta se suman al destino pendiente.
+        base = self.inicio if self._destino is None else self._destino
+        return self.ir_a(base + n, luego)
+
+    def ir_a(self, indice, luego=None):
+        """Pide la ventana que empieza en indice; luego() se llama cuando ya está pintada."""
+        indice = max(0, min(int(indice), self.total - self.visibles))
+        if (self._pedido == "cargar" or not self.filas
+                or indice == (self.inicio if self._destino is None else self._destino)):
+            if luego is not None and self._pedido is None:
+                luego()
+            return "break"
+        filtros, visibles, filas, inicio = self.filtros, self.visibles, self.filas, self.inicio
+        # Si se anula un refresco pendiente, esta consulta también recuenta.
+        recontar = self._pedido in ("refrescar", "actualizar")
+
+        def consultar(_cancelado):
+            with db.lector() as repo:
+                total = repo.contar_movimientos(filtros) if recontar else None
+                salto = indice - inicio
+                if 0 < salto <= visibles:
+                    nuevas = repo.pagina_movimientos(filtros, salto, despues=self._clave(filas[-1]))
+                    juntas = filas + nuevas
+                    sobran = max(0, len(juntas) - visibles)
+                    return total, inicio + sobran, juntas[sobran:]
+                if -visibles <= salto < 0:
+                    nuevas = repo.pagina_movimientos(filtros, -salto, antes=self._clave(filas[0]))
+                    return total, max(0, inicio - len(nuevas)), (nuevas + filas)[:visibles]
+                return total, indice, repo.pagina_movimientos(filtros, visibles, offset=indice)
+
+        def mostrar(resultado):
+            self._pedido = self._destino = None
+            total, self.inicio, self.filas = resultado
+            if total is not None:
+                self.total = total
+            self._pintar()
+            if luego is not None:
+                luego()
+
+        self._pedido = "refrescar" if recontar else "mover"
+        self._destino = indice
+        tareas.enviar("listado", consultar, mostrar)
+        return "break"
+
+    def _scrollbar(self, accion, cantidad, unidad=None):
+        if accion == "moveto":
+            self.ir_a(float(cantidad) * self.total)
+        elif unidad == "pages":
+            self.desplazar(int(cantidad) * self.visibles)
+        else:
+            self.desplazar(int(cantidad))
+
+    def _mover_cursor(self, delta):
+        items = self.tree.get_children()
+        if not items:
+            return "break"
+        foco = self.tree.focus()
+        j = (items.index(foco) if foco in items else 0) + delta
+        if j < 0 or j >= len(items):
+            antes = self.inicio
+            return self.desplazar(j if j < 0 else j - len(items) + 1,
+                                  luego=lambda: self._enfocar(j - (self.inicio - antes)))
+        self._enfocar(j)
+        return "break"
+
+    def _enfocar(self, j):
+        items = self.tree.get_children()
+        if not items:
+            return
+        j = max(0, min(j, len(items) - 1))
+        self.seleccion.clear()
+        self.tree.focus(items[j])
+        self.tree.selection_set(items[j])
+
+    def _al_redimensionar(self, event):
+        alto_fila = int(ttk.Style(self.tree).lookup("Treeview", "rowheight") or 20)
+        visibles = max(1, (event.height - 24) // alto_fila)
+        if visibles != self.visibles:
+            self.visibles = visibles
+            self.refrescar()
+
+    def _al_pulsar(self, event):
+        # Un clic sin Ctrl ni Mayús también olvida lo marcado fuera de la pantalla.
+        if not event.state & 0x5:
+            self.seleccion.clear()
+
+    def _al_seleccionar(self, _e=None):
+        if self._pintando:
+            return
+        elegidos = {int(i) for i in self.tree.selection()}
+        if str(self.tree.cget("selectmode")) == "browse":
+            self.seleccion = elegidos
+        else:
+            en_pantalla = {fila[0] for fila in self.filas}
+            self.seleccion = (self.seleccion - en_pantalla) | elegidos
+
+    @medido("listado.treeview", PRESUPUESTO_FRAME_MS)
+    def _pintar(self):
+        self._pintando = True
+        try:
+            self.tree.delete(*self.tree.get_children())
+            for fila in self.filas:
+                self.tree.insert("", "end", iid=str(fila[0]), values=self.formatear(fila))
+            marcados = [str(fila[0]) for fila in self.filas if fila[0] in self.seleccion]
+            self.tree.selection_set(marcados)
+        finally:
+            self._pintando = False
+        if self.total:
+            self.vsb.set(self.inicio / self.total, (self.inicio + len(self.filas)) / self.total)
+        else:
+            self.vsb.set(0, 1)
+
 def build_listado(parent):
     toolbar = ttk.Frame(parent, style="Toolbar.TFrame")
     toolbar.grid(row=0, column=0, sticky="ew", pady=(0, 8))
@@ -595,14 +1076,16 @@ def build_listado(parent):
     btn_add.grid(row=0, column=10, padx=(16, 0))
     btn_edit.grid(row=0, column=11, padx=(6, 0))
     btn_del.grid(row=0, column=12, padx=(6, 0))
+    btn_importar = ttk.Button(toolbar, text="Importar…")
+    btn_importar.grid(row=0, column=13, padx=(16, 0))
 
     cols = ("id", "fecha", "concepto", "periodicidad", "tipo", "cantidad")
-    tree = ttk.Treeview(parent, columns=cols, show="headings", selectmode="browse")
+    tree = ttk.Treeview(parent, columns=cols, show="headings", selectmode="extended")
     tree.grid(row=1, column=0, sticky="nsew")  # se escala
 
-    vsb = ttk.Scrollbar(parent, orient="vertical", command=tree.yview)
+    vsb = ttk.Scrollbar(parent, orient="vertical")
     hsb = ttk.Scrollbar(parent, orient="horizontal", command=tree.xview)
-    tree.configure(yscroll=vsb.set, xscroll=hsb.set)
+    tree.configure(xscroll=hsb.set)
     vsb.grid(row=1, column=1, sticky="ns")
     hsb.grid(row=2, column=0, sticky="ew")
 
@@ -620,23 +1103,26 @@ def build_listado(parent):
     tree.column("tipo", width=90, anchor="center")
     tree.column("cantidad", width=110, anchor="e")
 
-    def formato_eur(x: float) -> str:
-        s = f"{x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-        return s
+    def formatear_fila(fila):
+        id_, concepto, periodicidad, tipo, cantidad, ts = fila
+        cant = de_centimos(cantidad if tipo == "Entrada" else -cantidad)
+        return (id_, iso_to_human(ts), concepto, periodicidad, tipo, formato_eur(cant))
+
+    listado = ListadoVirtual(tree, vsb, formatear_fila)
+
+    pendiente = {"after": None, "texto": ""}
 
     def cargar_en_tree():
-        for i in tree.get_children():
-            tree.delete(i)
-        filas = cargar_movimientos_filtrados(
+        if pendiente["after"] is not None:
+            filtro_concepto.after_cancel(pendiente["after"])
+            pendiente["after"] = None
+        pendiente["texto"] = filtro_concepto.get()
+        listado.cargar((
             filtro_tipo.get(),
             filtro_concepto.get(),
             filtro_desde.get(),
             filtro_hasta.get()
-        )
-        for id_, concepto, periodicidad, tipo, cantidad, ts in filas:
-            fecha_fmt = iso_to_human(ts)
-            cant = cantidad if tipo == "Entrada" else -cantidad
-            tree.insert("", "end", iid=str(id_), values=(id_, fecha_fmt, concepto, periodicidad, tipo, formato_eur(cant)))
+        ))
 
     def limpiar_filtros():
         filtro_tipo.set("Todos")
@@ -645,52 +1131,124 @@ def build_listado(parent):
         filtro_hasta.delete(0, "end")
         cargar_en_tree()
 
-    def get_sel_id():
-        sel = tree.selection()
-        if not sel:
-            return None
-        return int(sel[0])
+    def en_bloque(clave, trabajo, titulo):
+        # Una transacción en segundo plano y un único refresco al terminar.
+        def hecho(_n):
+            listado.seleccion.clear()
+            listado.refrescar()
+
+        def fallo(e):
+            messagebox.showerror("Error", f"{titulo}: no se pudo completar.\n\n{e}", parent=parent)
+
+        def ejecutar(_cancelado):
+            with db.escritor() as repo:
+                return trabajo(repo)
+
+        tareas.enviar(clave, ejecutar, hecho, fallo)
 
     def editar_sel(_e=None):
-        mid = get_sel_id()
-        if mid is None:
+        ids = sorted(listado.seleccion)
+        if not ids:
             messagebox.showinfo("Editar", "Selecciona un movimiento primero.", parent=parent)
             return
-        mov = obtener_movimiento_por_id(mid)
-        if mov is None:
-            messagebox.showerror("Error", "No se encontró el movimiento.", parent=parent)
+        if len(ids) > 1:
+            def aplicar(cambios):
+                def trabajo(repo):
+                    n = repo.actualizar_movimientos(ids, **cambios)
+                    if cambios["periodicidad"] == "Fijo":
+                        repo.materializar_fijos()
+                    return n
+                en_bloque("editar_varios", trabajo, "Editar")
+            abrir_edicion_masiva(ids, aplicar)
             return
-        abrir_formulario(mov)
+        con_movimiento(ids[0], abrir_formulario)
+
+    def con_movimiento(mid, seguir):
+        # Se lee en segundo plano (puede ser una fila virtual o estar fuera de la pantalla).
+        def consultar(_cancelado):
+            with db.lector() as repo:
+                return repo.obtener_movimiento_por_id(mid)
+
+        def mostrar(mov):
+            if mov is None:
+                messagebox.showerror("Error", "No se encontró el movimiento.", parent=parent)
+            else:
+                seguir(mov)
+
+        tareas.enviar("movimiento", consultar, mostrar)
 
     def eliminar_sel(_e=None):
-        mid = get_sel_id()
-        if mid is None:
+        ids = sorted(listado.seleccion)
+        if not ids:
             messagebox.showinfo("Eliminar", "Selecciona un movimiento primero.", parent=parent)
             return
-        mov = obtener_movimiento_por_id(mid)
-        if mov is None:
-            messagebox.showerror("Error", "No se encontró el movimiento.", parent=parent)
+        if len(ids) > 1:
+            if messagebox.askyesno("Confirmar eliminación",
+                                   f"¿Seguro que quieres eliminar {len(ids)} movimientos?",
+                                   parent=parent):
+                en_bloque("eliminar_varios", lambda repo: repo.eliminar_movimientos(ids), "Eliminar")
             return
+        con_movimiento(ids[0], confirmar_eliminar)
+
+    def confirmar_eliminar(mov):
+        mid = mov[0]
         concepto_preview = (mov[1] or "")[:30]
         if not messagebox.askyesno("Confirmar eliminación",
                                    f"¿Seguro que quieres eliminar el movimiento #{mid}?\n\n{concepto_preview}",
                                    parent=parent):
             return
-        try:
-            eliminar_movimiento(mid)
-        except Exception as e:
+
+        def fallo(e):
             messagebox.showerror("Error", f"No se pudo eliminar.\n\n{e}", parent=parent)
+
+        def ejecutar(_cancelado):
+            with db.escritor() as repo:
+                repo.eliminar_movimiento(mid)
+
+        tareas.enviar("eliminar", ejecutar, lambda _r: listado.quitar_fila(mid), fallo)
+
+    def importar_fichero():
+        ruta = filedialog.askopenfilename(parent=parent, title="Importar extracto", filetypes=[
+            ("Extractos", "*.csv *.txt *.ofx *.qfx *.xml *.json"), ("Todos", "*.*")])
+        if not ruta:
             return
-        cargar_en_tree()
-        refrescar_balance_y_grafica()
+        origen = formato_por_extension(ruta)
+
+        def trabajo(_cancelado):
+            with db.escritor() as repo, abrir(ruta, origen) as f:
+                return importar(repo, f, origen)
+
+        def hecho(resultado):
+            leidas, insertadas = resultado
+            listado.refrescar()
+            messagebox.showinfo("Importar", f"{insertadas} movimientos importados"
+                                f" ({leidas - insertadas} ya estaban).", parent=parent)
+
+        def fallo(e):
+            messagebox.showerror("Error", f"No se pudo importar.\n\n{e}", parent=parent)
+
+        tareas.enviar("importar", trabajo, hecho, fallo)
 
     btn_aplicar.config(command=cargar_en_tree)
     btn_limpiar.config(command=limpiar_filtros)
     btn_edit.config(command=editar_sel)
     btn_del.config(command=eliminar_sel)
+    btn_importar.config(command=importar_fichero)
     tree.bind("<Double-1>", editar_sel)
     tree.bind("<Delete>", eliminar_sel)
+    def buscar_al_escribir(_e=None):
+        # Espera a que el usuario deje de teclear; cada pulsación anula la búsqueda anterior.
+        if pendiente["after"] is not None:
+            filtro_concepto.after_cancel(pendiente["after"])
+        pendiente["after"] = filtro_concepto.after(250, buscar_ahora)
+
+    def buscar_ahora():
+        pendiente["after"] = None
+        if filtro_concepto.get() != pendiente["texto"]:
+            cargar_en_tree()
+
     filtro_concepto.bind("<Return>", lambda e: cargar_en_tree())
+    filtro_concepto.bind("<KeyRelease>", buscar_al_escribir)
     filtro_desde.bind("<Return>", lambda e: cargar_en_tree())
     filtro_hasta.bind("<Return>", lambda e: cargar_en_tree())
     filtro_tipo.bind("<<ComboboxSelected>>", lambda e: cargar_en_tree())
@@ -701,10 +1259,31 @@ def build_listado(parent):
     parent.grid_columnconfigure(0, weight=1)
 
     parent.tree = tree
-    parent.reload = cargar_en_tree
+    parent.listado = listado
+    parent.reload = listado.refrescar
+
+def refrescar_vista(mid=None):
+    if current_view.get() == "Resumen":
+        refrescar_balance_y_grafica()
+    else:
+        refrescar_listado(mid)
+
+def materializar_en_fondo():
+    """Crea en segundo plano las copias de fijos pendientes y refresca la vista si hay alguna."""
+    def materializar(_cancelado):
+        with db.escritor() as repo:
+            return repo.materializar_fijos()
+
+    def hecho(nuevos):
+        if nuevos:
+            refrescar_vista()
+
+    tareas.enviar("materializar", materializar, hecho)
 
-def refrescar_listado():
-    if content_frame and hasattr(content_frame, "reload"):
+def refrescar_listado(mid=None):
+    if mid is not None and hasattr(content_frame, "listado"):
+        content_frame.listado.actualizar_fila(mid)
+    elif content_frame and hasattr(content_frame, "reload"):
         content_frame.reload()
 
 def clear_content():
@@ -713,6 +1292,7 @@ def clear_content():
 
 def show_resumen():
     current_view.set("Resumen")
+    tareas.cancelar("listado")
     clear_content()
 
     titulo = ttk.Label(content_frame, text="Resumen financiero", style="Title.TLabel")
@@ -728,7 +1308,7 @@ def show_resumen():
     controles.grid(row=3, column=0, sticky="w", pady=(8, 8))
     ttk.Label(controles, text="Agrupar por:").grid(row=0, column=0, sticky="w", padx=(0, 8))
     global combo_modo
-    combo_modo = ttk.Combobox(controles, state="readonly", values=["Semana", "Mes", "Año"], width=10)
+    combo_modo = ttk.Combobox(controles, state="readonly", values=["Semana", "Mes", "Año", "Día"], width=10)
     combo_modo.grid(row=0, column=1, sticky="w")
     combo_modo.set("Mes")
 
@@ -738,129 +1318,231 @@ def show_resumen():
     btn_nuevo = ttk.Button(controles, text="Añadir movimiento", style="Primary.TButton", command=lambda: abrir_formulario(None))
     btn_nuevo.grid(row=0, column=3, padx=(16, 0))
 
-    global fig, ax, canvas
-    fig = Figure(figsize=(7.5, 3.8), dpi=100)
-    fig.patch.set_facecolor("#F5F3FA")
-    ax = fig.add_subplot(111)
-    ax.set_facecolor("#FFFFFF")
-    ax.tick_params(colors="#333")
-    for spine in ax.spines.values():
-        spine.set_color("#888")
+    # Rango del modo Día (vacío: toda la historia); la rueda y el arrastre sobre la gráfica también lo cambian.
+    global entry_desde, entry_hasta
+    rango_frame = ttk.Frame(controles)
+    ttk.Label(rango_frame, text="Desde").pack(side="left")
+    entry_desde = ttk.Entry(rango_frame, width=11)
+    entry_desde.pack(side="left", padx=(4, 8))
+    ttk.Label(rango_frame, text="Hasta").pack(side="left")
+    entry_hasta = ttk.Entry(rango_frame, width=11)
+    entry_hasta.pack(side="left", padx=(4, 8))
+
+    def aplicar_rango(_e=None):
+        try:
+            desde, hasta = (parse_date_only(e.get().strip()) // 86400 if e.get().strip() else None
+                            for e in (entry_desde, entry_hasta))
+        except ValueError:
+            messagebox.showerror("Fecha no válida", "Usa el formato dd/mm/aaaa.")
+            return
+        fijar_rango_dias(desde, hasta)
+
+    ttk.Button(rango_frame, text="Aplicar", command=aplicar_rango).pack(side="left")
+    ttk.Button(rango_frame, text="Todo", command=lambda: fijar_rango_dias(None, None)).pack(side="left", padx=(6, 0))
+    for entry in (entry_desde, entry_hasta):
+        entry.bind("<Return>", aplicar_rango)
+    entry_desde.insert(0, texto_dia(_rango_dias["desde"]))
+    entry_hasta.insert(0, texto_dia(_rango_dias["hasta"]))
+
+    def cambiar_modo(_e=None):
+        if combo_modo.get() == "Día":
+            rango_frame.grid(row=1, column=0, columnspan=4, sticky="w", pady=(8, 0))
+        else:
+            rango_frame.grid_remove()
+        dibujar_grafica(combo_modo.get())
 
-    canvas = FigureCanvasTkAgg(fig, master=content_frame)
-    canvas_widget = canvas.get_tk_widget()
-    canvas_widget.grid(row=4, column=0, columnspan=2, sticky="nsew", pady=(8, 0))
+    global fig, canvas, grafica
+    fig = canvas = grafica = None
+    grafica_frame = ttk.Frame(content_frame)
+    grafica_frame.grid(row=4, column=0, columnspan=2, sticky="nsew", pady=(8, 0))
+    cargando = ttk.Label(grafica_frame, text="Cargando gráfica…", style="Muted.TLabel")
+    cargando.place(relx=0.5, rely=0.5, anchor="center")
 
     content_frame.grid_rowconfigure(4, weight=1)
     content_frame.grid_columnconfigure(0, weight=1)
 
+    def crear_grafica(_=None):
+        global fig, canvas, grafica
+        cargando.destroy()
+        fig = Figure(figsize=(7.5, 3.8), dpi=100)
+        fig.patch.set_facecolor("#F5F3FA")
+
+        canvas = FigureCanvasTkAgg(fig, master=grafica_frame)
+        # draw_idle acaba llamando a canvas.draw(): ahí es donde matplotlib rasteriza.
+        canvas.draw = medido("figura.draw", PRESUPUESTO_FRAME_MS)(canvas.draw)
+        canvas.get_tk_widget().pack(fill="both", expand=True)
+        grafica = GraficaResumen(fig, canvas)
+        grafica.al_cambiar_rango = lambda desde, hasta: fijar_rango_dias(desde, hasta, esperar_ms=150)
+        if "grafica" not in tareas.activas:
+            dibujar_grafica(combo_modo.get())
+
+    # El balance y los datos de la gráfica se piden ya; la figura se crea
+    # cuando matplotlib termina de importarse en segundo plano.
     refrescar_balance_y_grafica()
-    combo_modo.bind("<<ComboboxSelected>>", lambda e: dibujar_grafica(combo_modo.get()))
+    if FigureCanvasTkAgg is None:
+        tareas.enviar("importar_graficas", importar_graficas, crear_grafica)
+    else:
+        crear_grafica()
+    combo_modo.bind("<<ComboboxSelected>>", cambiar_modo)
 
 def show_movimientos():
     current_view.set("Movimientos")
+    tareas.cancelar("balance", "grafica", "importar_graficas")
     clear_content()
     build_listado(content_frame)
 
 
 
-def _month_key(dt):
-    return (dt.year, dt.month)
-
-def _month_first_day(year, month):
-    return datetime(year, month, 1, 0, 0, 1)
-
-def _month_clamp_day(year, month, day):
-    last = monthrange(year, month)[1]
-    return min(day, last)
-
-def materializar_fijos():
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("""SELECT id, concepto, periodicidad, tipo, cantidad, creado_en
-                   FROM movimientos WHERE periodicidad='Fijo' ORDER BY creado_en ASC""")
-    fijos = cur.fetchall()
-
-    if not fijos:
-        con.close()
-        return
-
-    hoy = datetime.now()
-    for (mid, concepto, periodicidad, tipo, cantidad, ts) in fijos:
-        try:
-            dt0 = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
-        except Exception:
-            try:
-                dt0 = datetime.fromisoformat(ts)
-            except Exception:
-                continue
-
-        y, m = dt0.year, dt0.month
-        while (y < hoy.year) or (y == hoy.year and m <= hoy.month):
-            dia = _month_clamp_day(y, m, dt0.day)
-            fecha_obj = datetime(y, m, dia, dt0.hour, dt0.minute, dt0.second)
-
-            mes_ini = datetime(y, m, 1, 0, 0, 0).strftime("%Y-%m-%d %H:%M:%S")
-            mes_fin = datetime(y, m, monthrange(y, m)[1], 23, 59, 59).strftime("%Y-%m-%d %H:%M:%S")
-            cur.execute("""
-                SELECT 1 FROM movimientos
-                WHERE periodicidad='Fijo' AND concepto=? AND tipo=? AND cantidad=?
-                  AND creado_en BETWEEN ? AND ? LIMIT 1
-            """, (concepto, tipo, float(cantidad), mes_ini, mes_fin))
-            existe = cur.fetchone() is not None
-
-            if not existe:
-                cur.execute("""INSERT INTO movimientos
-                               (concepto, periodicidad, tipo, cantidad, creado_en)
-                               VALUES (?, 'Fijo', ?, ?, ?)""",
-                            (concepto, tipo, float(cantidad),
-                             fecha_obj.strftime("%Y-%m-%d %H:%M:%S")))
-            if m == 12:
-                y += 1; m = 1
-            else:
-                m += 1
-
-    con.commit()
-    con.close()
+def abrir_diagnostico(_e=None):
+    """Ventana con el estado de la base de datos, los histogramas de tiempos y las consultas lentas (--metricas)."""
+    win = tk.Toplevel(ventana)
+    win.title("Diagnóstico")
+    win.geometry("980x560")
+    win.transient(ventana)
+    win.grid_rowconfigure(0, weight=1)
+    win.grid_columnconfigure(0, weight=1)
+
+    texto = tk.Text(win, wrap="none", font=("TkFixedFont", 9), bg="#FFFFFF")
+    vsb = ttk.Scrollbar(win, orient="vertical", command=texto.yview)
+    hsb = ttk.Scrollbar(win, orient="horizontal", command=texto.xview)
+    texto.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
+    texto.grid(row=0, column=0, sticky="nsew")
+    vsb.grid(row=0, column=1, sticky="ns")
+    hsb.grid(row=1, column=0, sticky="ew")
+
+    def actualizar():
+        base = estado(db, mantenimiento.directorio if mantenimiento else None)
+        if mantenimiento is not None and mantenimiento.ultimo_error is not None:
+            base["error_mantenimiento"] = mantenimiento.ultimo_error
+        if not METRICAS.activo:
+            contenido = "La medición está desactivada: arranca con --metricas o FINANCIAL_METRICAS=1."
+        else:
+            contenido = METRICAS.texto(max_consultas=50)
+        contenido = f"Base de datos\n{texto_estado(base)}\n\n{contenido}"
+        arriba = texto.yview()[0]
+        texto.configure(state="normal")
+        texto.delete("1.0", "end")
+        texto.insert("1.0", contenido)
+        texto.configure(state="disabled")
+        texto.yview_moveto(arriba)
+
+    def reiniciar():
+        METRICAS.reiniciar()
+        actualizar()
 
+    def guardar():
+        ruta = filedialog.asksaveasfilename(parent=win, defaultextension=".json",
+                                            filetypes=[("JSON", "*.json")])
+        if ruta:
+            with open(ruta, "w", encoding="utf-8") as f:
+                json.dump(METRICAS.volcado(), f, indent=1, ensure_ascii=False)
+
+    acciones = ttk.Frame(win, padding=8)
+    acciones.grid(row=2, column=0, columnspan=2, sticky="ew")
+    ttk.Button(acciones, text="Actualizar", command=actualizar).pack(side="left")
+    ttk.Button(acciones, text="Reiniciar", command=reiniciar).pack(side="left", padx=(6, 0))
+    ttk.Button(acciones, text="Guardar JSON…", command=guardar).pack(side="right")
+
+    def cada_segundo():
+        if win.winfo_exists():
+            actualizar()
+            win.after(1000, cada_segundo)
+
+    cada_segundo()
+    win.bind("<Escape>", lambda e: win.destroy())
+
+
+marcar_arranque("módulos importados")
+
+def main():
+    global ventana, tareas, cache_pronosticos, current_view, content_frame, mantenimiento
+    ventana = tk.Tk()
+    marcar_arranque("Tk creado")
+    ventana.title("financial app")
+    ventana.geometry("1100x680")
+    ventana.minsize(820, 560)
+    try:
+        ventana.iconbitmap(APP_ICON)
+    except Exception:
+        pass
+    ventana.configure(bg="SeaGreen4")
+
+    configurar_estilos(ventana)
+    init_db()
+    marcar_arranque("base de datos lista")
+    tareas = TareasFondo(ventana)
+    cache_pronosticos = CachePronosticos(FORECAST_CACHE_PATH)
+
+    ventana.grid_rowconfigure(0, weight=1)
+    ventana.grid_columnconfigure(0, weight=1)
+
+    card_main = ttk.Frame(ventana, style="Card.TFrame", padding=16)
+    card_main.grid(row=0, column=0, sticky="nsew")
+    card_main.grid_rowconfigure(1, weight=1)
+    card_main.grid_columnconfigure(0, weight=1)
+
+    topbar = ttk.Frame(card_main, style="Toolbar.TFrame", padding=(8, 6))
+    topbar.grid(row=0, column=0, sticky="ew", pady=(0, 10))
+    topbar.grid_columnconfigure(0, weight=1)
+
+    current_view = tk.StringVar(value="Resumen")
+
+    btn_resumen = ttk.Button(topbar, text="Resumen", command=show_resumen)
+    btn_resumen.grid(row=0, column=1, padx=(0, 6))
+    btn_movs = ttk.Button(topbar, text="Movimientos", command=show_movimientos)
+    btn_movs.grid(row=0, column=2, padx=(6, 0))
+    if METRICAS.activo:
+        ttk.Button(topbar, text="Diagnóstico", command=abrir_diagnostico).grid(row=0, column=3, padx=(6, 0))
+    ventana.bind("<F12>", abrir_diagnostico)
+
+    ocupado = ttk.Frame(topbar, style="Toolbar.TFrame")
+    ttk.Label(ocupado, text="Calculando…", style="Toolbar.TLabel").pack(side="left", padx=(0, 6))
+    ocupado_barra = ttk.Progressbar(ocupado, mode="indeterminate", length=90)
+    ocupado_barra.pack(side="left")
+
+    def mostrar_ocupado(activo):
+        if activo:
+            ocupado.grid(row=0, column=0, sticky="w")
+            ocupado_barra.start(15)
+        else:
+            ocupado_barra.stop()
+            ocupado.grid_remove()
 
-ventana = tk.Tk()
-ventana.title("financial app")
-ventana.geometry("1100x680")
-ventana.minsize(820, 560)
-try:
-    ventana.iconbitmap(APP_ICON)
-except Exception:
-    pass
-ventana.configure(bg="SeaGreen4")
+    tareas.al_cambiar_ocupado = mostrar_ocupado
 
-configurar_estilos(ventana)
-init_db()
-materializar_fijos()
+    content_frame = ttk.Frame(card_main, style="Card.TFrame")
+    content_frame.grid(row=1, column=0, sticky="nsew")
 
+    show_resumen()
+    ventana.after_idle(lambda: marcar_arranque("primer frame"))
 
-ventana.grid_rowconfigure(0, weight=1)
-ventana.grid_columnconfigure(0, weight=1)
+    materializar_en_fondo()
 
-card_main = ttk.Frame(ventana, style="Card.TFrame", padding=16)
-card_main.grid(row=0, column=0, sticky="nsew")
-card_main.grid_rowconfigure(1, weight=1)
-card_main.grid_columnconfigure(0, weight=1)
+    def cargar_columnas(_cancelado):
+        from financial_core.columnar import Columnas
+        nuevas = Columnas()
+        db.oyentes.append(nuevas.al_cambiar)
+        with db.lector() as repo:
+            return nuevas.cargar(repo)
 
-topbar = ttk.Frame(card_main, style="Toolbar.TFrame", padding=(8, 6))
-topbar.grid(row=0, column=0, sticky="ew", pady=(0, 10))
-topbar.grid_columnconfigure(0, weight=1)
+    def al_cargar_columnas(nuevas):
+        global columnas
+        columnas = nuevas
 
-current_view = tk.StringVar(value="Resumen")
+    # Sin NumPy la aplicación sigue con los totales de SQL.
+    tareas.enviar("columnas", cargar_columnas, al_cargar_columnas, al_fallar=lambda e: None)
 
-btn_resumen = ttk.Button(topbar, text="Resumen", command=show_resumen)
-btn_resumen.grid(row=0, column=1, padx=(0, 6))
-btn_movs = ttk.Button(topbar, text="Movimientos", command=show_movimientos)
-btn_movs.grid(row=0, column=2, padx=(6, 0))
+    # Copias, compactación y ANALYZE solo tras un rato sin teclas ni clics.
+    mantenimiento = Mantenimiento(db)
+    ventana.bind_all("<Any-KeyPress>", lambda e: mantenimiento.actividad(), add="+")
+    ventana.bind_all("<Any-ButtonPress>", lambda e: mantenimiento.actividad(), add="+")
+    mantenimiento.iniciar()
 
-content_frame = ttk.Frame(card_main, style="Card.TFrame")
-content_frame.grid(row=1, column=0, sticky="nsew")
+    ventana.mainloop()
+    mantenimiento.detener()
+    tareas.cerrar()
+    db.close()
 
-show_resumen()
 
-ventana.mainloop()
+if __name__ == "__main__":
+    main()
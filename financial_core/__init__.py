@@ -0,0 +1,15 @@
+"""Núcleo sin interfaz gráfica: almacenamiento, agregados, fijos y pronósticos.
+
+La aplicación Tk (financial_app.py) y la línea de órdenes (python -m
+financial_core) usan este mismo código.
+"""
+from .conversions import (EPOCH, dt_to_ts, ts_to_dt, ts_now, a_centimos, de_centimos,
+                          iso_to_human, human_to_iso, parse_date_only, formato_eur,
+                          month_names_es, y_m_list_between)
+from .storage import DB_PATH, Repositorio, Storage, consulta_fts
+from .recurrence import (ExpansionVirtual, Regla, ocurrencias_mensuales, ocurrencias_regla,
+                         proyeccion_fijos_anual, proyeccion_reglas_anual)
+from .aggregation import (PERIODOS, agrupar_entradas_gastos, predecir_gasto_mensual,
+                          datos_grafica, datos_grafica_dias, serie_diaria, resumen_por_periodo)
+from .forecast import (FORECAST_CACHE_PATH, CachePronosticos, holt_winters_predict_next,
+                       pronosticar_por_concepto, rmse_from_residuals)
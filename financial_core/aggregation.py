@@ -0,0 +1,190 @@
+"""Totales por periodo y datos de la gráfica del resumen.
+
+Las funciones reciben `repo`: un Repositorio o, con los mismos métodos de
+totales, una financial_core.columnar.Columnas ya puesta al día.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+from .conversions import dt_to_ts, ts_to_dt, de_centimos, month_names_es
+from .forecast import holt_winters_predict_next
+from .instrumentation import medido
+
+# Columna (entradas, gastos) de cada tipo; los demás tipos no suman en ninguna, como en el saldo.
+_COLUMNA = {"Entrada": 0, "Gasto": 1}
+
+@medido("agrupar_entradas_gastos")
+def agrupar_entradas_gastos(repo, modo="Mes"):
+    ahora = datetime.now()
+
+    if modo == "Semana":
+        year, week, _ = ahora.isocalendar()
+        lunes = datetime.fromisocalendar(year, week, 1).date()
+        primero = dt_to_ts(datetime(lunes.year, lunes.month, lunes.day)) // 86400
+        dias = list(range(primero, primero + 7))
+        etiquetas = ["Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom"]
+        e_map = defaultdict(int); g_map = defaultdict(int)
+        for dia, tipo, total in repo.totales_diarios(dias[0], dias[-1]):
+            if tipo in _COLUMNA:
+                (e_map, g_map)[_COLUMNA[tipo]][dia] += total
+        entradas = [e_map.get(d, 0) for d in dias]
+        gastos   = [g_map.get(d, 0) for d in dias]
+
+    elif modo == "Año":
+        e_map = defaultdict(int); g_map = defaultdict(int)
+        for y, tipo, total in repo.totales_anuales():
+            if tipo in _COLUMNA:
+                (e_map, g_map)[_COLUMNA[tipo]][y] += total
+        years = sorted(set(e_map)|set(g_map))
+        if len(years) > 6: years = years[-6:]
+        etiquetas = [str(y) for y in years]
+        entradas  = [e_map.get(y,0) for y in years]
+        gastos    = [g_map.get(y,0) for y in years]
+
+    else:
+        year = ahora.year
+        etiquetas = month_names_es()
+        e = [0]*12; g = [0]*12
+        for mes, tipo, total in repo.totales_mensuales(year):
+            i = mes - 1
+            if tipo == "Entrada": e[i] += total
+            elif tipo == "Gasto": g[i] += total
+        entradas, gastos = e, g
+
+    return etiquetas, entradas, gastos
+
+def predecir_gasto_mensual(cost_per_month, window=6):
+    """Para cada mes, la media de los `window` meses anteriores (0 en el primero)."""
+    import numpy as np
+    valores = np.asarray(cost_per_month[:12], dtype=float)
+    acumulado = np.concatenate(([0.0], np.cumsum(valores)))
+    fin = np.arange(12)
+    inicio = np.maximum(0, fin - window)
+    n = fin - inicio
+    suma = acumulado[fin] - acumulado[inicio]
+    return list(np.divide(suma, n, out=np.zeros(12), where=n > 0))
+
+
+@medido("datos_grafica")
+def datos_grafica(repo, modo, cancelado=None, cache=None):
+    """Calcula (fuera del hilo de Tk) todo lo que necesita pintar_grafica."""
+    etiquetas, entradas, gastos = agrupar_entradas_gastos(modo=modo, repo=repo)
+    datos = {
+        "modo": modo,
+        "etiquetas": etiquetas,
+        "entradas": [de_centimos(c) for c in entradas],
+        "gastos": [de_centimos(c) for c in gastos],
+        "linea": None,
+    }
+    if modo != "Mes" or not etiquetas or (cancelado is not None and cancelado.is_set()):
+        return datos
+
+    gastos = datos["gastos"]
+    ahora = datetime.now()
+    year = ahora.year
+    keys_hist, val_hist = repo.monthly_variable_expense_series()
+    val_hist = [de_centimos(c) for c in val_hist]
+    pred_var_12, fitted, rmse = holt_winters_predict_next(val_hist, horizon=12, cache=cache)
+    start_month_index = ahora.month - 1
+    steps_remaining = 12 - start_month_index
+    pred_var_al_year = [0.0]*12
+    for i in range(steps_remaining):
+        pred_var_al_year[start_month_index + i] = pred_var_12[i]
+
+
+    proj_fijos = [de_centimos(c) for c in repo.monthly_fixed_projection_for_year(year)]
+
+    linea = [0.0]*12
+    for i in range(12):
+        if i < start_month_index:
+            linea[i] = gastos[i]
+        else:
+            linea[i] = pred_var_al_year[i] + proj_fijos[i]
+
+    banda_inf = [None]*12
+    banda_sup = [None]*12
+    for i in range(12):
+        if i >= start_month_index:
+            banda_inf[i] = max(0.0, linea[i] - rmse)
+            banda_sup[i] = linea[i] + rmse
+
+    datos.update(linea=linea, rmse=rmse, start_month_index=start_month_index,
+                 steps_remaining=steps_remaining, banda_inf=banda_inf, banda_sup=banda_sup)
+    return datos
+
+
+def serie_diaria(repo, desde: int, hasta: int):
+    """Días desde..hasta (días desde 1970) con sus entradas, gastos y saldo al cierre.
+
+    Devuelve cuatro arrays de NumPy, uno por día aunque no tenga movimientos;
+    el saldo parte del balance anterior a desde.
+    """
+    import numpy as np
+    dias = np.arange(desde, hasta + 1)
+    entradas = np.zeros(len(dias), dtype=np.int64)
+    gastos = np.zeros(len(dias), dtype=np.int64)
+    for dia, tipo, total in repo.totales_diarios(desde, hasta):
+        if tipo in _COLUMNA:
+            (entradas, gastos)[_COLUMNA[tipo]][dia - desde] += total
+    saldo = repo.saldo_antes_de(desde) + np.cumsum(entradas - gastos)
+    return dias, entradas, gastos, saldo
+
+
+@medido("datos_grafica_dias")
+def datos_grafica_dias(repo, desde=None, hasta=None, puntos=1000):
+    """Flujo diario y saldo entre dos días, reducidos a unos `puntos` por serie.
+
+    Entradas y gastos se reducen con mínimo/máximo (no se pierden los picos)
+    y el saldo con LTTB. Sin rango se usa toda la historia.
+    """
+    from .downsample import lttb, min_max
+    datos = {"modo": "Día", "etiquetas": None}
+    if desde is None or hasta is None:
+        rango = repo.rango_dias()
+        if rango is None:
+            return dict(datos, vacio=True)
+        desde = rango[0] if desde is None else desde
+        hasta = rango[1] if hasta is None else hasta
+    dias, entradas, gastos, saldo = serie_diaria(repo, desde, hasta)
+    datos.update(desde=desde, hasta=hasta, vacio=False)
+    for nombre, serie in (("entradas", entradas), ("gastos", gastos)):
+        i = min_max(serie, puntos)
+        datos[nombre] = (dias[i].tolist(), (serie[i] / 100).tolist())
+    i = lttb(dias, saldo, puntos)
+    datos["saldo"] = (dias[i].tolist(), (saldo[i] / 100).tolist())
+    return datos
+
+
+PERIODOS = ("dia", "semana", "mes", "año")
+
+def resumen_por_periodo(repo, periodo, desde: int, hasta: int):
+    """Entradas y gastos (céntimos) por periodo entre los ts desde y hasta.
+
+    Devuelve [(etiqueta, entradas, gastos)] en orden, solo para los periodos
+    con movimientos. Día y semana salen de daily_totals; mes y año, de
+    monthly_totals.
+    """
+    if periodo not in PERIODOS:
+        raise ValueError(f"Periodo desconocido: {periodo}")
+    acumulado = defaultdict(lambda: [0, 0])
+
+    if periodo in ("dia", "semana"):
+        for dia, tipo, total in repo.totales_diarios(desde // 86400, hasta // 86400):
+            if tipo not in _COLUMNA:
+                continue
+            d = ts_to_dt(dia * 86400).date()
+            if periodo == "dia":
+                clave = d.isoformat()
+            else:
+                y, w, _ = d.isocalendar()
+                clave = f"{y:04d}-W{w:02d}"
+            acumulado[clave][_COLUMNA[tipo]] += total
+    else:
+        d0, d1 = ts_to_dt(desde), ts_to_dt(hasta)
+        for y, m, tipo, total in repo.totales_mensuales_rango((d0.year, d0.month), (d1.year, d1.month)):
+            if tipo not in _COLUMNA:
+                continue
+            clave = f"{y:04d}-{m:02d}" if periodo == "mes" else f"{y:04d}"
+            acumulado[clave][_COLUMNA[tipo]] += total
+
+    return [(clave, e, g) for clave, (e, g) in sorted(acumulado.items())]
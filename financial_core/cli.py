@@ -0,0 +1,336 @@
+"""Línea de órdenes sin interfaz gráfica: python -m financial_core --help
+
+Las fechas se escriben y se leen en ISO 8601 (hora local) y las cantidades en
+euros; dentro se usan los mismos segundos Unix y céntimos que la aplicación.
+"""
+import argparse
+import json
+import sys
+from datetime import datetime
+
+from .aggregation import PERIODOS, resumen_por_periodo
+from .conversions import a_centimos, dt_to_ts, ts_to_dt, de_centimos, _mes_siguiente
+from .exporter import (COLUMNAS_MOVIMIENTO, FORMATOS, escribir_filas, exportar_movimientos,
+                       fecha_iso, filas_legibles)
+from .exporter import formato_por_extension as formato_exportacion
+from .forecast import (FORECAST_CACHE_PATH, CachePronosticos, holt_winters_predict_next,
+                       pronosticar_por_concepto)
+from .instrumentation import METRICAS
+from .maintenance import GENERACIONES, TAREAS, Mantenimiento, directorio_copias, estado
+from .importer import CAMPOS, abrir, importar, leer_fecha
+from .importer import formato_por_extension as formato_importacion
+from .storage import DB_PATH, Storage
+from .synthetic import generar_libro
+from .sync import COLUMNAS as COLUMNAS_SYNC
+from .sync import nombre_nodo, sincronizar_ruta
+
+TIPOS = ("Entrada", "Gasto")
+COLUMNAS_RESUMEN = ["periodo", "entradas", "gastos", "neto"]
+
+
+def fecha_filtro(texto):
+    """Fecha ISO de la línea de órdenes al formato dd/mm/aaaa de los filtros."""
+    if not texto:
+        return ""
+    return datetime.fromisoformat(texto).strftime("%d/%m/%Y")
+
+
+def _filtros(args):
+    return (args.tipo, args.concepto or "", fecha_filtro(args.desde), fecha_filtro(args.hasta))
+
+
+def cmd_balance(db, args, salida):
+    if not args.fecha:
+        balance = db.calcular_balance()
+    elif "T" in args.fecha or " " in args.fecha:
+        balance = db.balance_en(dt_to_ts(datetime.fromisoformat(args.fecha)))
+    else:
+        # Solo el día: saldo al cierre de ese día.
+        balance = db.balance_en(dt_to_ts(datetime.fromisoformat(args.fecha)) + 86399)
+    escribir_filas([(de_centimos(balance),)], ["balance"], args.format, salida)
+
+def cmd_list(db, args, salida):
+    lotes = db.iterar_movimientos(_filtros(args), descendente=True, limite=args.limit)
+    escribir_filas(filas_legibles(lotes), COLUMNAS_MOVIMIENTO, args.format, salida)
+
+def cmd_export(db, args, salida):
+    formato = args.como or formato_exportacion(args.fichero)
+    if args.resumen:
+        if formato == "npy":
+            raise ValueError("Los resúmenes se exportan en csv, jsonl o json")
+        filas = list(filas_resumen(db, args.resumen, args.desde, args.hasta))
+        with open(args.fichero, "w", encoding="utf-8", newline="") as f:
+            escribir_filas(filas, COLUMNAS_RESUMEN, formato, f)
+        n = len(filas)
+    else:
+        n = exportar_movimientos(db, _filtros(args), args.fichero, formato)
+    escribir_filas([(n,)], ["exportados"], args.format, salida)
+
+def cmd_import(db, args, salida):
+    mapeo = {}
+    for par in args.map:
+        campo, _, columna = par.partition("=")
+        if campo not in CAMPOS or not columna:
+            raise ValueError(f"--map espera campo=columna con campo en {', '.join(CAMPOS)}: {par!r}")
+        mapeo[campo] = columna
+    origen = args.origen or formato_importacion(args.fichero)
+
+    def progreso(leidas, insertadas):
+        print(f"\r{leidas} leídos, {insertadas} nuevos", end="", file=sys.stderr, flush=True)
+
+    with abrir(args.fichero, origen, args.encoding) as f:
+        leidas, insertadas = importar(db, f, origen, mapeo, args.delimiter, args.lote,
+                                      progreso if sys.stderr.isatty() else None)
+    if sys.stderr.isatty():
+        print(file=sys.stderr)
+    escribir_filas([(leidas, insertadas, leidas - insertadas)], ["leidos", "importados", "duplicados"],
+             args.format, salida)
+
+def filas_resumen(db, periodo, desde, hasta):
+    hoy = datetime.now()
+    desde = leer_fecha(desde) if desde else dt_to_ts(datetime(hoy.year, 1, 1))
+    hasta = leer_fecha(hasta) if hasta else dt_to_ts(datetime(hoy.year, 12, 31))
+    for p, e, g in resumen_por_periodo(db, periodo, desde, hasta):
+        yield p, de_centimos(e), de_centimos(g), de_centimos(e - g)
+
+def cmd_summary(db, args, salida):
+    escribir_filas(filas_resumen(db, args.period, args.desde, args.hasta), COLUMNAS_RESUMEN,
+             args.format, salida)
+
+def cmd_forecast(db, args, salida):
+    keys, valores = db.monthly_variable_expense_series()
+    valores = [de_centimos(c) for c in valores]
+    cache = CachePronosticos(args.cache) if args.cache else None
+    pred, _, rmse = holt_winters_predict_next(valores, horizon=args.horizon, cache=cache)
+    y, m = keys[-1] if keys else (datetime.now().year, datetime.now().month)
+    meses = []
+    for _ in pred:
+        y, m = _mes_siguiente(y, m)
+        meses.append(f"{y:04d}-{m:02d}")
+    if not args.por_concepto:
+        filas = [(mes, round(v, 2), round(rmse, 2)) for mes, v in zip(meses, pred)]
+        escribir_filas(filas, ["mes", "gasto_variable", "rmse"], args.format, salida)
+        return
+    _, series = db.series_gasto_variable_por_concepto()
+    series = {c: [de_centimos(v) for v in serie] for c, serie in series.items()}
+    conceptos = pronosticar_por_concepto(series, horizon=args.horizon, total=pred,
+                                         procesos=args.procesos, limite_s=args.limite)
+    filas = [(concepto, mes, round(v, 2), round(p["rmse"], 2), p["metodo"])
+             for concepto, p in sorted(conceptos.items())
+             for mes, v in zip(meses, p["pred"])]
+    escribir_filas(filas, ["concepto", "mes", "gasto_variable", "rmse", "metodo"],
+                   args.format, salida)
+
+def cmd_generate(db, args, salida):
+    # Con la --db por defecto sería el libro de verdad, y lo generado no se puede separar después.
+    if not args.force and db.contar_movimientos(("Todos", "", "", "")):
+        raise ValueError(f"{args.db} ya tiene movimientos; genera en otra --db o usa --force")
+    n = generar_libro(db, anios=args.anios, filas_dia=args.filas_dia, proporcion_fijos=args.fijos,
+                      n_conceptos=args.conceptos, semilla=args.semilla, anio_inicio=args.desde_anio)
+    escribir_filas([(n,)], ["generados"], args.format, salida)
+
+def cmd_materialize(db, args, salida):
+    escribir_filas([(db.materializar_fijos(),)], ["creados"], args.format, salida)
+
+def cmd_archive(db, args, salida):
+    anios = set(args.anios)
+    if args.hasta is not None and args.restaurar:
+        anios.update(anio for anio in db.particiones() if anio <= args.hasta)
+    elif args.hasta is not None:
+        rango = db.rango_dias()
+        if rango:
+            anios.update(range(ts_to_dt(rango[0] * 86400).year, args.hasta + 1))
+    movidos = {}
+    for anio in sorted(anios):
+        movidos[anio] = db.restaurar_archivado(anio) if args.restaurar else db.archivar(anio)
+    archivados = dict(db.resumen_particiones())
+    filas = [(anio, movidos.get(anio, 0), archivados.get(anio, 0))
+             for anio in sorted(archivados.keys() | movidos.keys())]
+    escribir_filas(filas, ["anio", "movidos", "archivados"], args.format, salida)
+
+def cmd_maintain(db, args, salida):
+    desconocidas = set(args.tareas) - set(TAREAS)
+    if desconocidas:
+        raise ValueError("Tarea desconocida: %s (hay %s)" % (", ".join(sorted(desconocidas)), ", ".join(TAREAS)))
+    directorio = args.copias or directorio_copias(db.path)
+    if not args.estado:
+        mantenimiento = Mantenimiento(db, directorio, conservar=args.generaciones)
+        mantenimiento.ejecutar(args.tareas or TAREAS)
+    datos = estado(db, directorio, detallado=True)
+    escribir_filas(list(datos.items()), ["clave", "valor"], args.format, salida)
+
+def cmd_sync(db, args, salida):
+    if args.nuevo_nodo:
+        db.renovar_nodo()
+    if args.destino:
+        escribir_filas(sincronizar_ruta(db, args.destino), COLUMNAS_SYNC, args.format, salida)
+        return
+    filas = [(nombre_nodo(db.nodo()), None, None)]
+    filas += [(nombre_nodo(nodo), recibido, fecha_iso(ts)) for nodo, recibido, ts in db.pares()]
+    escribir_filas(filas, ["nodo", "recibido", "sincronizado_en"], args.format, salida)
+
+def _mes(texto):
+    y, _, m = texto.partition("-")
+    if not (y.isdigit() and m.isdigit() and 1 <= int(m) <= 12):
+        raise ValueError(f"Mes no válido (AAAA-MM): {texto!r}")
+    return int(y), int(m)
+
+def _euros(texto):
+    try:
+        return a_centimos(texto)
+    except ArithmeticError:
+        raise ValueError(f"Cantidad no válida: {texto!r}") from None
+
+def cmd_rules(db, args, salida):
+    if args.id is None and (args.cantidad or args.saltar or args.fijar or args.quitar or args.fin):
+        raise ValueError("Indica la regla que se cambia")
+    if args.modo:
+        db.modo_fijos(args.modo == "virtual")
+    for par in args.cantidad:
+        mes, _, cantidad = par.partition("=")
+        db.cambiar_cantidad_regla(args.id, _mes(mes), _euros(cantidad) if cantidad else None)
+    for mes in args.saltar:
+        db.excepcion_regla(args.id, _mes(mes), saltar=True)
+    for par in args.fijar:
+        mes, _, cantidad = par.partition("=")
+        db.excepcion_regla(args.id, _mes(mes), cantidad=_euros(cantidad))
+    for mes in args.quitar:
+        db.excepcion_regla(args.id, _mes(mes))
+    if args.fin:
+        db.terminar_regla(args.id, None if args.fin == "-" else
+                          dt_to_ts(datetime.fromisoformat(args.fin)) + (0 if "T" in args.fin else 86399))
+    filas = []
+    for r in db.reglas("1" if args.id is None else "id=?", () if args.id is None else (args.id,)):
+        fin = fecha_iso(r.fin) if r.fin is not None else ""
+        excepciones = " ".join(f"{mes // 12:04d}-{mes % 12 + 1:02d}" + ("" if c is None else f"={de_centimos(c)}")
+                               for mes, (c, _) in sorted(r.excepciones.items()))
+        cambios = " ".join(f"{d // 12:04d}-{d % 12 + 1:02d}={de_centimos(c)}" for d, c in r.importes)
+        filas.append((r.id, r.concepto, r.tipo, de_centimos(r.cantidad), fecha_iso(r.inicio), fin,
+                      "virtual" if r.virtual else "copias", cambios, excepciones))
+    escribir_filas(filas, ["id", "concepto", "tipo", "cantidad", "inicio", "fin", "modo", "cambios",
+                           "excepciones"], args.format, salida)
+
+
+def construir_parser():
+    parser = argparse.ArgumentParser(prog="financial_core",
+                                     description="Consultas y tareas por lotes sobre movimientos.db")
+    parser.add_argument("--db", default=DB_PATH, help="base de datos (por defecto %(default)s)")
+    parser.add_argument("--format", choices=("json", "jsonl", "csv"), default="json",
+                        help="formato de la salida por pantalla")
+    parser.add_argument("--stats", action="store_true",
+                        help="mide tiempos y consultas y al terminar los muestra en stderr")
+    parser.add_argument("--stats-json", metavar="FICHERO",
+                        help="como --stats, pero guarda las estadísticas en FICHERO")
+    parser.add_argument("--sql-lento", type=float, metavar="MS",
+                        help="umbral del registro de consultas lentas (por defecto %g ms)"
+                             % METRICAS.umbral_ms)
+    sub = parser.add_subparsers(dest="orden", required=True)
+
+    def con_filtros(p):
+        p.add_argument("--tipo", choices=("Todos",) + TIPOS, default="Todos")
+        p.add_argument("--concepto")
+        p.add_argument("--desde", help="AAAA-MM-DD")
+        p.add_argument("--hasta", help="AAAA-MM-DD")
+        return p
+
+    p = sub.add_parser("balance", help="saldo actual o en una fecha")
+    p.add_argument("--fecha", help="AAAA-MM-DD (al cierre del día) o AAAA-MM-DDTHH:MM")
+    p.set_defaults(func=cmd_balance)
+    p = con_filtros(sub.add_parser("list", help="movimientos, más recientes primero"))
+    p.add_argument("--limit", type=int)
+    p.set_defaults(func=cmd_list)
+    p = sub.add_parser("summary", help="entradas y gastos por periodo")
+    p.add_argument("--period", choices=PERIODOS, default="mes")
+    p.add_argument("--desde", help="AAAA-MM-DD (por defecto, 1 de enero)")
+    p.add_argument("--hasta", help="AAAA-MM-DD (por defecto, 31 de diciembre)")
+    p.set_defaults(func=cmd_summary)
+    p = sub.add_parser("forecast", help="pronóstico del gasto variable mensual")
+    p.add_argument("--horizon", type=int, default=12)
+    p.add_argument("--cache", default=FORECAST_CACHE_PATH,
+                   help="caché de pronósticos ('' para no usarla)")
+    p.add_argument("--por-concepto", action="store_true",
+                   help="un pronóstico por concepto, ajustado para que sumen el total")
+    p.add_argument("--procesos", type=int, help="procesos para los ajustes (por defecto, uno por núcleo)")
+    p.add_argument("--limite", type=float, default=30.0, metavar="S",
+                   help="segundos como mucho por ajuste antes de usar el último valor")
+    p.set_defaults(func=cmd_forecast)
+    p = sub.add_parser("generate", help="añade un libro sintético determinista (para pruebas)")
+    p.add_argument("--force", action="store_true",
+                   help="genera aunque la base de datos ya tenga movimientos")
+    p.add_argument("--anios", type=int, default=5)
+    p.add_argument("--filas-dia", type=float, default=10.0)
+    p.add_argument("--fijos", type=float, default=0.1, help="proporción de filas fijas")
+    p.add_argument("--conceptos", type=int, default=200)
+    p.add_argument("--semilla", type=int, default=1)
+    p.add_argument("--desde-anio", type=int, default=datetime.now().year - 4)
+    p.set_defaults(func=cmd_generate)
+    sub.add_parser("materialize", help="crea las copias pendientes de los fijos"
+                   ).set_defaults(func=cmd_materialize)
+    p = sub.add_parser("archive", help="lleva años cerrados a particiones aparte (sin años, las lista)")
+    p.add_argument("anios", type=int, nargs="*", metavar="AÑO")
+    p.add_argument("--hasta", type=int, metavar="AÑO", help="archiva todos los años hasta AÑO, incluido")
+    p.add_argument("--restaurar", action="store_true",
+                   help="devuelve los años indicados a la base de datos principal")
+    p.set_defaults(func=cmd_archive)
+    p = sub.add_parser("maintain", help="copia de seguridad, compactación y estadísticas de la base de datos")
+    p.add_argument("tareas", nargs="*", metavar="TAREA",
+                   help="%s (por defecto, todas)" % ", ".join(TAREAS))
+    p.add_argument("--copias", metavar="DIR", help="directorio de las copias (por defecto, copias/ junto a la base)")
+    p.add_argument("--generaciones", type=int, default=GENERACIONES, help="copias que se conservan")
+    p.add_argument("--estado", action="store_true", help="solo muestra el estado, sin hacer nada")
+    p.set_defaults(func=cmd_maintain)
+    p = sub.add_parser("sync", help="intercambia los cambios con otra base de datos o un directorio compartido"
+                                    " (sin destino, muestra este nodo y los equipos vistos)")
+    p.add_argument("destino", nargs="?", help="fichero .db del otro equipo o directorio compartido")
+    p.add_argument("--nuevo-nodo", action="store_true",
+                   help="da a esta base de datos un nodo nuevo (tras copiar el fichero de otro equipo)")
+    p.set_defaults(func=cmd_sync)
+    p = sub.add_parser("rules", help="reglas de los fijos: listado, modo virtual y excepciones")
+    p.add_argument("id", type=int, nargs="?", help="regla a cambiar (o la única que se lista)")
+    p.add_argument("--modo", choices=("virtual", "copias"),
+                   help="virtual: sin copias, los meses se calculan al consultar; copias: materializadas")
+    p.add_argument("--fin", help="AAAA-MM-DD (último día con movimiento) o '-' para quitarlo")
+    p.add_argument("--cantidad", action="append", default=[], metavar="AAAA-MM=EUROS",
+                   help="cantidad desde ese mes (vacía para quitar el cambio)")
+    p.add_argument("--saltar", action="append", default=[], metavar="AAAA-MM", help="ese mes no hay movimiento")
+    p.add_argument("--fijar", action="append", default=[], metavar="AAAA-MM=EUROS",
+                   help="otra cantidad solo ese mes")
+    p.add_argument("--quitar", action="append", default=[], metavar="AAAA-MM", help="quita la excepción del mes")
+    p.set_defaults(func=cmd_rules)
+    p = sub.add_parser("import", help="importa extractos CSV, OFX o CAMT.053 (o un export propio)")
+    p.add_argument("fichero")
+    p.add_argument("--origen", choices=("csv", "json", "ofx", "camt"),
+                   help="formato del fichero (por defecto, según la extensión)")
+    p.add_argument("--map", action="append", default=[], metavar="CAMPO=COLUMNA",
+                   help="columna del CSV para un campo (%s)" % ", ".join(CAMPOS))
+    p.add_argument("--delimiter", help="separador del CSV (por defecto se detecta)")
+    p.add_argument("--encoding", default="utf-8-sig")
+    p.add_argument("--lote", type=int, default=5000, help="filas por executemany")
+    p.set_defaults(func=cmd_import)
+    p = con_filtros(sub.add_parser("export", help="exporta movimientos (o un resumen) a fichero"))
+    p.add_argument("fichero", help="fichero .csv/.jsonl/.json o directorio para las columnas .npy")
+    p.add_argument("--como", choices=FORMATOS, help="formato (por defecto, según la extensión)")
+    p.add_argument("--resumen", choices=PERIODOS, help="exporta el resumen por periodo")
+    p.set_defaults(func=cmd_export)
+    return parser
+
+
+def main(argv=None):
+    args = construir_parser().parse_args(argv)
+    if args.stats or args.stats_json:
+        METRICAS.activar(args.sql_lento)
+    db = Storage(args.db)
+    try:
+        db.init_schema()
+        args.func(db, args, sys.stdout)
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+        if args.stats:
+            print(METRICAS.texto(), file=sys.stderr)
+        if args.stats_json:
+            with open(args.stats_json, "w", encoding="utf-8") as f:
+                json.dump(METRICAS.volcado(), f, indent=1, ensure_ascii=False)
+    return 0
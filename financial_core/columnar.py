@@ -0,0 +1,356 @@
+"""Copia en memoria de los movimientos en columnas NumPy para los agregados.
+
+Columnas ofrece las mismas consultas de totales que Repositorio
+(totales_diarios, totales_mensuales, monthly_variable_expense_series, ...),
+así que agrupar_entradas_gastos, datos_grafica o resumen_por_periodo aceptan
+cualquiera de los dos. Se carga una vez y se pone al día con los avisos de
+escritura de Storage: las filas nuevas se leen por id y las modificadas o
+borradas se reciben en el aviso. Los movimientos virtuales de las reglas
+sin copias (ver recurrence.ExpansionVirtual) se cargan como filas con id
+negativo y se sustituyen cuando cambia su expansión. Los años archivados se
+leen de sus particiones al cargar; como no cambian, no hace falta volver a
+mirarlos.
+"""
+import threading
+
+import numpy as np
+
+from .instrumentation import medido
+from .recurrence import proyeccion_reglas_anual
+
+TIPOS = ("Entrada", "Gasto")
+PERIODICIDADES = ("Fijo", "Variable")
+# Código de tipo de las filas que no son ni Entrada ni Gasto: como en SQL,
+# no suman en el saldo ni en los totales, pero cuentan como días con datos.
+OTRO_TIPO = len(TIPOS)
+_CODIGO_TIPO = {t: i for i, t in enumerate(TIPOS)}
+_SIGNO_TIPO = np.array([1, -1, 0], dtype=np.int64)
+
+_SQL_FILAS = "SELECT id, creado_en, cantidad, tipo, periodicidad, concepto FROM movimientos"
+_SQL_FILAS_DE = "SELECT id, creado_en, cantidad, tipo, periodicidad, concepto FROM {}.movimientos"
+
+
+def meses_desde_1970(ts):
+    """Índice de mes (año*12 + mes - 1 - 1970*12) de cada ts."""
+    return ts.astype("datetime64[s]").astype("datetime64[M]").astype(np.int32)
+
+
+class Columnas:
+    CAMPOS = {
+        "id": np.int64, "ts": np.int64, "cantidad": np.int64, "tipo": np.uint8,
+        "periodicidad": np.uint8, "concepto": np.int32, "dia": np.int32, "mes": np.int32,
+    }
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.n = 0
+        self.cargada = False
+        for campo, dtype in self.CAMPOS.items():
+            setattr(self, campo, np.empty(0, dtype=dtype))
+        self.vocabulario = []
+        self._codigos = {}
+        self._cambiados = set()
+        self._eliminados = set()
+        self._reglas = []
+        self._expansion = None
+        self._cubos = {}
+
+    # -- carga y cambios ---------------------------------------------------
+
+    @medido("columnas.cargar")
+    def cargar(self, repo, tam=20000):
+        """Lee todos los movimientos de la conexión de repo."""
+        with self._lock:
+            self.n = 0
+            self._cambiados.clear()
+            self._eliminados.clear()
+            self._expansion = None
+            self._leer(repo.con.execute(_SQL_FILAS + " ORDER BY id"), tam)
+            anios = repo.particiones()
+            for anio in anios:
+                with repo.particion(anio) as (con, esquema):
+                    self._leer(con.execute(_SQL_FILAS_DE.format(esquema) + " ORDER BY id"), tam)
+            if anios:
+                self._ordenar()
+            self.al_dia(repo)
+            self.cargada = True
+        return self
+
+    def _leer(self, cur, tam):
+        while True:
+            filas = cur.fetchmany(tam)
+            if not filas:
+                break
+            self._anadir(filas)
+
+    def al_cambiar(self, cambiados=(), eliminados=()):
+        """Oyente de Storage: apunta los cambios para aplicarlos en al_dia()."""
+        # Los virtuales (id < 0) se rehacen enteros al cambiar su expansión.
+        with self._lock:
+            self._cambiados.update(i for i in cambiados if i >= 0)
+            self._eliminados.update(i for i in eliminados if i >= 0)
+
+    @medido("columnas.al_dia")
+    def al_dia(self, repo):
+        """Aplica los cambios pendientes leyendo de repo y devuelve self."""
+        with self._lock:
+            if self._eliminados:
+                self._quitar(np.fromiter(self._eliminados, dtype=np.int64))
+                self._cambiados -= self._eliminados
+                self._eliminados.clear()
+            if self._cambiados:
+                ids = sorted(self._cambiados)
+                self._cambiados.clear()
+                filas = []
+                for i in range(0, len(ids), 500):
+                    trozo = ids[i:i + 500]
+                    filas += repo.con.execute(
+                        _SQL_FILAS + f" WHERE id IN ({','.join('?' * len(trozo))})", trozo).fetchall()
+                vivos = {f[0] for f in filas}
+                self._quitar(np.array([i for i in ids if i not in vivos], dtype=np.int64))
+                self._reemplazar(filas)
+            ultimo = int(self.id[self.n - 1]) if self.n else 0
+            nuevas = repo.con.execute(_SQL_FILAS + " WHERE id > ? ORDER BY id", (max(ultimo, 0),)).fetchall()
+            if nuevas:
+                self._anadir(nuevas)
+            reglas, expansion = repo.recurrencia()
+            if expansion is not self._expansion:
+                self._poner_virtuales(expansion.filas)
+                self._reglas = [r for r in reglas if r.tipo == "Gasto"]
+                self._expansion = expansion
+        return self
+
+    def _poner_virtuales(self, filas):
+        """Sustituye los movimientos virtuales (ids negativos, al principio) por filas.
+
+        filas vienen en el orden de Repositorio.SQL_COLUMNAS.
+        """
+        self._quitar(self.id[:int(np.searchsorted(self.id[:self.n], 0))].copy())
+        if not filas:
+            return
+        self._anadir([(f[0], f[5], f[4], f[3], f[2], f[1]) for f in filas])
+        # Con los ids negativos delante, id sigue ordenado para _posiciones.
+        self._ordenar()
+
+    def _ordenar(self):
+        orden = np.argsort(self.id[:self.n], kind="stable")
+        for campo in self.CAMPOS:
+            col = getattr(self, campo)
+            col[:self.n] = col[:self.n][orden]
+
+    def _codigo(self, concepto):
+        codigo = self._codigos.get(concepto)
+        if codigo is None:
+            codigo = self._codigos[concepto] = len(self.vocabulario)
+            self.vocabulario.append(concepto)
+        return codigo
+
+    def _columnas_de(self, filas):
+        ids, tss, cants, tipos, pers, conceptos = zip(*filas)
+        ts = np.array(tss, dtype=np.int64)
+        return {
+            "id": np.array(ids, dtype=np.int64),
+            "ts": ts,
+            "cantidad": np.array(cants, dtype=np.int64),
+            "tipo": np.array([_CODIGO_TIPO.get(t, OTRO_TIPO) for t in tipos], dtype=np.uint8),
+            # Variable es todo lo que no es Fijo, como periodicidad!='Fijo' en SQL.
+            "periodicidad": np.array([p != "Fijo" for p in pers], dtype=np.uint8),
+            "concepto": np.array([self._codigo(c) for c in conceptos], dtype=np.int32),
+            "dia": (ts // 86400).astype(np.int32),
+            "mes": meses_desde_1970(ts),
+        }
+
+    def _anadir(self, filas):
+        nuevas = self._columnas_de(filas)
+        fin = self.n + len(filas)
+        if fin > len(self.id):
+            capacidad = max(fin, 2 * len(self.id), 1024)
+            for campo in self.CAMPOS:
+                viejo = getattr(self, campo)
+                col = np.empty(capacidad, dtype=viejo.dtype)
+                col[:self.n] = viejo[:self.n]
+                setattr(self, campo, col)
+        for campo, valores in nuevas.items():
+            getattr(self, campo)[self.n:fin] = valores
+        self._acumular(np.arange(self.n, fin), 1)
+        self.n = fin
+
+    def _posiciones(self, ids):
+        """Posiciones de los ids (ordenados) y máscara de cuáles están cargados."""
+        pos = np.searchsorted(self.id[:self.n], ids)
+        dentro = pos < self.n
+        dentro[dentro] = self.id[pos[dentro]] == ids[dentro]
+        return pos, dentro
+
+    def _quitar(self, ids):
+        if not len(ids) or not self.n:
+            return
+        pos, dentro = self._posiciones(np.sort(ids))
+        if not dentro.any():
+            return
+        self._acumular(pos[dentro], -1)
+        quedan = np.ones(self.n, dtype=bool)
+        quedan[pos[dentro]] = False
+        m = int(quedan.sum())
+        for campo in self.CAMPOS:
+            col = getattr(self, campo)
+            col[:m] = col[:self.n][quedan]
+        self.n = m
+
+    def _reemplazar(self, filas):
+        # Las que aún no están cargadas llegarán como nuevas (id > último).
+        if not filas:
+            return
+        filas.sort()
+        nuevas = self._columnas_de(filas)
+        pos, dentro = self._posiciones(nuevas["id"])
+        self._acumular(pos[dentro], -1)
+        for campo, valores in nuevas.items():
+            getattr(self, campo)[pos[dentro]] = valores[dentro]
+        self._acumular(pos[dentro], 1)
+
+    def _acumular(self, pos, signo):
+        """Suma (o resta) las filas de esas posiciones a los cubos ya calculados."""
+        if not len(pos):
+            return
+        for campo, (g0, totales, cuentas) in list(self._cubos.items()):
+            g = getattr(self, campo)[pos].astype(np.int64) - g0
+            if g.min() < 0 or g.max() >= len(totales):
+                del self._cubos[campo]       # fuera del rango: se recalcula entero
+                continue
+            indice = (g, self.tipo[pos], self.periodicidad[pos])
+            np.add.at(totales, indice, signo * self.cantidad[pos])
+            np.add.at(cuentas, indice, signo)
+
+    # -- agregados (mismo formato que Repositorio) -------------------------
+
+    def _cubo(self, campo):
+        """(g0, totales, cuentas) por (día o mes, tipo, periodicidad), de g0 en adelante.
+
+        Se calcula con dos bincount sobre todas las filas y se guarda hasta el
+        siguiente cambio; las consultas solo recortan y suman este cubo.
+        """
+        cubo = self._cubos.get(campo)
+        if cubo is None:
+            grupo = getattr(self, campo)[:self.n]
+            if not self.n:
+                cubo = (0, np.zeros((0, OTRO_TIPO + 1, 2), dtype=np.int64),
+                        np.zeros((0, OTRO_TIPO + 1, 2), dtype=np.int64))
+            else:
+                g0 = int(grupo.min())
+                ng = int(grupo.max()) - g0 + 1
+                celdas = (OTRO_TIPO + 1) * 2
+                clave = (grupo.astype(np.int64) - g0) * celdas
+                clave += self.tipo[:self.n] * 2
+                clave += self.periodicidad[:self.n]
+                totales = np.bincount(clave, weights=self.cantidad[:self.n], minlength=celdas * ng)
+                cuentas = np.bincount(clave, minlength=celdas * ng)
+                cubo = (g0, np.rint(totales).astype(np.int64).reshape(ng, OTRO_TIPO + 1, 2),
+                        cuentas.reshape(ng, OTRO_TIPO + 1, 2))
+            self._cubos[campo] = cubo
+        return cubo
+
+    def _recorte(self, campo, desde, hasta):
+        """Totales y cuentas por (grupo, tipo de TIPOS) de los grupos desde..hasta que existen."""
+        g0, totales, cuentas = self._cubo(campo)
+        i, j = max(desde - g0, 0), max(min(hasta - g0 + 1, len(totales)), 0)
+        return g0 + i, totales[i:j, :OTRO_TIPO].sum(axis=2), cuentas[i:j, :OTRO_TIPO].sum(axis=2)
+
+    @staticmethod
+    def _filas(g0, totales, cuentas, etiqueta):
+        return [(*etiqueta(g0 + int(g)), TIPOS[t], int(totales[g, t]))
+                for g, t in zip(*np.nonzero(cuentas))]
+
+    @staticmethod
+    def _anio_mes(m):
+        return 1970 + m // 12, m % 12 + 1
+
+    def calcular_balance(self):
+        with self._lock:
+            _, totales, _ = self._cubo("mes")
+            entradas, gastos = totales[:, :OTRO_TIPO].sum(axis=(0, 2))
+        return int(entradas - gastos)
+
+    def totales_diarios(self, desde: int, hasta: int):
+        with self._lock:
+            g0, totales, cuentas = self._recorte("dia", desde, hasta)
+        return self._filas(g0, totales, cuentas, lambda g: (g,))
+
+    def saldo_antes_de(self, dia: int):
+        with self._lock:
+            _, totales, _ = self._recorte("dia", -2**31, dia - 1)
+        entradas, gastos = totales.sum(axis=0) if len(totales) else (0, 0)
+        return int(entradas - gastos)
+
+    def balance_en(self, ts: int):
+        dia = ts // 86400
+        with self._lock:
+            n = self.n
+            hoy = (self.dia[:n] == dia) & (self.ts[:n] <= ts)
+            signo = _SIGNO_TIPO[self.tipo[:n][hoy]]
+            neto = int((signo * self.cantidad[:n][hoy]).sum())
+        return self.saldo_antes_de(dia) + neto
+
+    def rango_dias(self):
+        with self._lock:
+            if not self.n:
+                return None
+            g0, totales, cuentas = self._cubo("dia")
+        presentes = np.nonzero(cuentas.sum(axis=(1, 2)))[0]
+        if not len(presentes):
+            return None
+        return g0 + int(presentes[0]), g0 + int(presentes[-1])
+
+    def totales_mensuales_rango(self, desde, hasta):
+        m0 = (desde[0] - 1970) * 12 + desde[1] - 1
+        m1 = (hasta[0] - 1970) * 12 + hasta[1] - 1
+        with self._lock:
+            g0, totales, cuentas = self._recorte("mes", m0, m1)
+        return self._filas(g0, totales, cuentas, self._anio_mes)
+
+    def totales_mensuales(self, anio: int):
+        return [(m, t, v) for _, m, t, v in self.totales_mensuales_rango((anio, 1), (anio, 12))]
+
+    def totales_anuales(self):
+        with self._lock:
+            g0, totales, cuentas = self._recorte("mes", -2**31, 2**31)
+        if not len(cuentas):
+            return []
+        anio = (g0 + np.arange(len(cuentas))) // 12
+        anio -= anio[0]
+        por_anio = np.zeros((anio[-1] + 1, 2), dtype=np.int64)
+        cuentas_anio = np.zeros_like(por_anio)
+        np.add.at(por_anio, anio, totales)
+        np.add.at(cuentas_anio, anio, cuentas)
+        return self._filas(g0 // 12, por_anio, cuentas_anio, lambda a: (1970 + a,))
+
+    def monthly_variable_expense_series(self):
+        with self._lock:
+            g0, totales, cuentas = self._cubo("mes")
+        gasto_variable = totales[:, 1, 1]
+        presentes = np.nonzero(cuentas[:, 1, 1])[0]
+        keys = [self._anio_mes(g0 + int(g)) for g in presentes]
+        return keys, [int(gasto_variable[g]) for g in presentes]
+
+    def series_gasto_variable_por_concepto(self):
+        keys, _ = self.monthly_variable_expense_series()
+        if not keys:
+            return keys, {}
+        meses = np.array([(y - 1970) * 12 + m - 1 for y, m in keys])
+        with self._lock:
+            n = self.n
+            variable = (self.tipo[:n] == 1) & (self.periodicidad[:n] == 1)
+            codigo = self.concepto[:n][variable].astype(np.int64)
+            columna = np.searchsorted(meses, self.mes[:n][variable])
+            cantidad = self.cantidad[:n][variable]
+            vocabulario = list(self.vocabulario)
+        presentes, codigo = np.unique(codigo, return_inverse=True)
+        tabla = np.bincount(codigo * len(meses) + columna, weights=cantidad,
+                            minlength=len(presentes) * len(meses))
+        tabla = np.rint(tabla).astype(np.int64).reshape(len(presentes), len(meses))
+        return keys, {vocabulario[c]: fila.tolist() for c, fila in zip(presentes, tabla)}
+
+    def monthly_fixed_projection_for_year(self, target_year: int):
+        with self._lock:
+            reglas = self._reglas
+        return proyeccion_reglas_anual(reglas, target_year)
@@ -0,0 +1,69 @@
+"""Conversión de fechas y cantidades entre el formato de la base de datos y el del usuario."""
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from calendar import monthrange, timegm
+
+# Las fechas se guardan como segundos Unix de la hora local "de pared" (sin zona
+# horaria), así strftime(..., 'unixepoch') en SQLite da el mismo día que ve el
+# usuario. Las cantidades se guardan en céntimos enteros.
+EPOCH = datetime(1970, 1, 1)
+
+def dt_to_ts(dt) -> int:
+    return timegm(dt.timetuple())
+
+def ts_to_dt(ts: int):
+    return EPOCH + timedelta(seconds=ts)
+
+def ts_now() -> int:
+    return dt_to_ts(datetime.now())
+
+def a_centimos(cantidad) -> int:
+    return int(Decimal(str(cantidad)).scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def de_centimos(centimos) -> float:
+    return centimos / 100
+
+def iso_to_human(ts: int) -> str:
+    try:
+        return ts_to_dt(ts).strftime("%d/%m/%Y %H:%M")
+    except (TypeError, OverflowError):
+        return str(ts)
+
+def human_to_iso(ts_human: str) -> int:
+    return dt_to_ts(datetime.strptime(ts_human, "%d/%m/%Y %H:%M"))
+
+def parse_date_only(dmy: str) -> int:
+    return dt_to_ts(datetime.strptime(dmy, "%d/%m/%Y"))
+
+def _mes_siguiente(y, m):
+    return (y + 1, 1) if m == 12 else (y, m + 1)
+
+def _month_key(dt):
+    return (dt.year, dt.month)
+
+def _month_first_day(year, month):
+    return datetime(year, month, 1, 0, 0, 1)
+
+def _month_clamp_day(year, month, day):
+    last = monthrange(year, month)[1]
+    return min(day, last)
+
+def y_m_list_between(start_dt, end_dt):
+    y, m = start_dt.year, start_dt.month
+    out = []
+    while (y < end_dt.year) or (y == end_dt.year and m <= end_dt.month):
+        out.append((y, m))
+        if m == 12:
+            y += 1; m = 1
+        else:
+            m += 1
+    return out
+
+def month_names_es():
+    return ["Enero","Febrero","Marzo","Abril","Mayo","Junio",
+            "Julio","Agosto","Septiembre","Octubre","Noviembre","Diciembre"]
+
+
+def formato_eur(x: float) -> str:
+    s = f"{x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return s
@@ -0,0 +1,56 @@
+"""Reducción de series largas al número de puntos que caben en pantalla.
+
+Ambas funciones devuelven los índices de los puntos que se conservan, en
+orden, siempre con el primero y el último.
+"""
+import numpy as np
+
+
+def lttb(x, y, n):
+    """Largest-Triangle-Three-Buckets: n puntos que conservan la forma de la línea.
+
+    Cada cubo aporta el punto que forma el triángulo de mayor área con el
+    elegido en el cubo anterior y la media del siguiente.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    total = len(x)
+    if n >= total or n < 3:
+        return np.arange(total)
+    bordes = np.linspace(1, total - 1, n - 1).astype(np.int64)
+    elegidos = np.empty(n, dtype=np.int64)
+    elegidos[0], elegidos[-1] = 0, total - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = bordes[i], max(bordes[i + 1], bordes[i] + 1)
+        if i + 2 < len(bordes):
+            sig = slice(hi, max(bordes[i + 2], hi + 1))
+            cx, cy = x[sig].mean(), y[sig].mean()
+        else:
+            cx, cy = x[-1], y[-1]
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(area.argmax())
+        elegidos[i + 1] = a
+    return elegidos
+
+
+def min_max(y, n):
+    """Mínimo y máximo de cada uno de n/2 cubos, en su orden: mantiene los picos."""
+    y = np.asarray(y)
+    total = len(y)
+    cubos = n // 2
+    if total <= n or cubos < 1:
+        return np.arange(total)
+    bordes = np.linspace(0, total, cubos + 1).astype(np.int64)
+    # reduceat sobre el inicio de cada cubo da los extremos de todos a la vez.
+    inicio = bordes[:-1]
+    pos = np.arange(total)
+    cubo = np.repeat(np.arange(cubos), np.diff(bordes))
+    minimos = np.minimum.reduceat(y, inicio)
+    maximos = np.maximum.reduceat(y, inicio)
+    # Primera posición de cada extremo dentro de su cubo.
+    es_min = y == minimos[cubo]
+    es_max = y == maximos[cubo]
+    i_min = np.minimum.reduceat(np.where(es_min, pos, total), inicio)
+    i_max = np.minimum.reduceat(np.where(es_max, pos, total), inicio)
+    return np.unique(np.concatenate(([0, total - 1], i_min, i_max)))
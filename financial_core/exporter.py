@@ -0,0 +1,127 @@
+"""Exportación en streaming de movimientos y resúmenes.
+
+Los formatos de filas (CSV, JSON Lines y JSON) se escriben a medida que llegan
+los lotes del cursor. El formato columnar guarda un .npy por columna en un
+directorio, escrito con memmap, para cargarlo después con numpy.load(mmap_mode="r").
+La memoria usada no depende del número de movimientos exportados.
+"""
+import csv
+import json
+import os
+
+from .conversions import ts_to_dt, de_centimos
+
+COLUMNAS_MOVIMIENTO = ["id", "fecha", "concepto", "periodicidad", "tipo", "cantidad"]
+FORMATOS = ("csv", "jsonl", "json", "npy")
+
+TIPOS = ("Entrada", "Gasto")
+PERIODICIDADES = ("Fijo", "Variable")
+
+
+def formato_por_extension(ruta: str) -> str:
+    """Formato según la extensión; las columnas .npy van a un directorio (.npy, sin extensión o ya existente)."""
+    directorio = ruta.endswith(("/", "\\")) or os.path.isdir(ruta)
+    extension = os.path.splitext(ruta.rstrip("/\\"))[1].lower()
+    if extension in (".jsonl", ".json", ".csv") and not directorio:
+        return extension[1:]
+    if extension in ("", ".npy") or directorio:
+        return "npy"
+    raise ValueError(f"No se sabe exportar a {extension}: usa .csv, .jsonl, .json o un directorio .npy")
+
+
+def fecha_iso(ts: int) -> str:
+    return ts_to_dt(ts).isoformat(timespec="seconds")
+
+def filas_legibles(lotes):
+    """Movimientos de la base de datos con la fecha en ISO y la cantidad en euros."""
+    for lote in lotes:
+        for mid, concepto, periodicidad, tipo, cantidad, ts in lote:
+            yield mid, fecha_iso(ts), concepto, periodicidad, tipo, de_centimos(cantidad)
+
+
+def escribir_filas(filas, columnas, formato, salida):
+    """Escribe las filas (tuplas en el orden de columnas) a medida que llegan."""
+    if formato == "csv":
+        w = csv.writer(salida, lineterminator="\n")
+        w.writerow(columnas)
+        w.writerows(filas)
+    elif formato == "jsonl":
+        for fila in filas:
+            salida.write(json.dumps(dict(zip(columnas, fila)), ensure_ascii=False))
+            salida.write("\n")
+    elif formato == "json":
+        salida.write("[")
+        for i, fila in enumerate(filas):
+            salida.write(",\n " if i else "\n ")
+            json.dump(dict(zip(columnas, fila)), salida, ensure_ascii=False)
+        salida.write("\n]\n")
+    else:
+        raise ValueError(f"Formato de filas desconocido: {formato}")
+
+
+def escribir_columnas(lotes, total, directorio):
+    """Guarda los movimientos como columnas .npy (enteros tal cual están en la base de datos).
+
+    id.npy, creado_en.npy y cantidad.npy son int64 (segundos Unix y céntimos);
+    tipo.npy y periodicidad.npy son uint8 con el índice en meta.json (los valores
+    que no son de TIPOS o PERIODICIDADES, p. ej. de una importación, se añaden
+    detrás); concepto.npy es int32 con el índice en el vocabulario de meta.json.
+    `total` es el número de filas que van a llegar; devuelve las escritas.
+    """
+    import numpy as np
+    from numpy.lib.format import open_memmap
+
+    os.makedirs(directorio, exist_ok=True)
+    tipos = {
+        "id": np.int64, "creado_en": np.int64, "cantidad": np.int64,
+        "tipo": np.uint8, "periodicidad": np.uint8, "concepto": np.int32,
+    }
+    cols = {nombre: open_memmap(os.path.join(directorio, nombre + ".npy"), mode="w+",
+                                dtype=dtype, shape=(total,))
+            for nombre, dtype in tipos.items()}
+    vocabulario = {}
+    codigo_tipo = {t: i for i, t in enumerate(TIPOS)}
+    codigo_per = {p: i for i, p in enumerate(PERIODICIDADES)}
+
+    n = 0
+    for lote in lotes:
+        lote = lote[:total - n]
+        if not lote:
+            break
+        fin = n + len(lote)
+        ids, conceptos, pers, tips, cants, tss = zip(*lote)
+        cols["id"][n:fin] = ids
+        cols["creado_en"][n:fin] = tss
+        cols["cantidad"][n:fin] = cants
+        cols["tipo"][n:fin] = [codigo_tipo.setdefault(t, len(codigo_tipo)) for t in tips]
+        cols["periodicidad"][n:fin] = [codigo_per.setdefault(p, len(codigo_per)) for p in pers]
+        cols["concepto"][n:fin] = [vocabulario.setdefault(c, len(vocabulario)) for c in conceptos]
+        n = fin
+
+    for col in cols.values():
+        col.flush()
+    del cols
+    with open(os.path.join(directorio, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"filas": n, "tipo": list(codigo_tipo), "periodicidad": list(codigo_per),
+                   "concepto": list(vocabulario)}, f, ensure_ascii=False)
+    return n
+
+
+def exportar_movimientos(repo, filtros, ruta, formato=None, tam=5000):
+    """Exporta los movimientos filtrados, en orden cronológico; devuelve cuántos."""
+    formato = formato or formato_por_extension(ruta)
+    with repo.instantanea():
+        if formato == "npy":
+            total = repo.contar_movimientos(filtros)
+            return escribir_columnas(repo.iterar_movimientos(filtros, tam=tam), total, ruta)
+        n = 0
+
+        def contando(filas):
+            nonlocal n
+            for n, fila in enumerate(filas, 1):
+                yield fila
+
+        with open(ruta, "w", encoding="utf-8", newline="") as f:
+            escribir_filas(contando(filas_legibles(repo.iterar_movimientos(filtros, tam=tam))),
+                           COLUMNAS_MOVIMIENTO, formato, f)
+        return n
@@ -0,0 +1,296 @@
+"""Pronóstico Holt-Winters de la serie mensual de gastos variables."""
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from .instrumentation import medir
+
+FORECAST_CACHE_PATH = "pronosticos.json"
+
+def rmse_from_residuals(residuals):
+    import numpy as np
+    if len(residuals) == 0:
+        return 0.0
+    return float(np.sqrt(np.mean(np.array(residuals)**2)))
+
+class CachePronosticos:
+    """Pronósticos Holt-Winters ya calculados, guardados en disco entre sesiones.
+
+    La clave es un hash de la serie y el horizonte. Se guardan como mucho
+    `capacidad` entradas y se expulsa la usada hace más tiempo (LRU). Si la
+    serie solo difiere de una guardada en el último mes, sus parámetros sirven
+    de punto de partida para el nuevo ajuste.
+    """
+
+    def __init__(self, path=FORECAST_CACHE_PATH, capacidad=32):
+        self.path = path
+        self.capacidad = capacidad
+        self.entradas = OrderedDict()
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                for clave, entrada in json.load(f):
+                    self.entradas[clave] = entrada
+        except (OSError, ValueError, TypeError):
+            pass
+
+    @staticmethod
+    def clave(values, horizon):
+        datos = json.dumps([horizon, [round(float(v), 2) for v in values]])
+        return hashlib.sha1(datos.encode("utf-8")).hexdigest()
+
+    def obtener(self, values, horizon):
+        clave = self.clave(values, horizon)
+        with self._lock:
+            entrada = self.entradas.get(clave)
+            if entrada is None:
+                return None
+            self.entradas.move_to_end(clave)
+        return entrada["pred"], entrada["fitted"], entrada["rmse"]
+
+    def parametros_previos(self, values, horizon):
+        """Parámetros de un ajuste cuya serie coincide salvo en el último mes."""
+        if len(values) < 2:
+            return None
+        previa = self.clave(values[:-1], horizon)
+        with self._lock:
+            for clave, entrada in reversed(self.entradas.items()):
+                if clave == previa or entrada.get("prefijo") == previa:
+                    return entrada.get("params")
+        return None
+
+    def guardar(self, values, horizon, pred, fitted, rmse, params):
+        entrada = {
+            "pred": list(pred),
+            "fitted": [float(v) for v in fitted],
+            "rmse": rmse,
+            "params": params,
+            "prefijo": self.clave(values[:-1], horizon) if len(values) > 1 else None,
+        }
+        with self._lock:
+            self.entradas[self.clave(values, horizon)] = entrada
+            while len(self.entradas) > self.capacidad:
+                self.entradas.popitem(last=False)
+            datos = list(self.entradas.items())
+        # Un fichero temporal propio por escritura: dos guardados a la vez (hilos
+        # o la aplicación y la CLI) no se mezclan y el último os.replace gana.
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)),
+                                       prefix=os.path.basename(self.path) + ".", suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(datos, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
+def _ajustar_holt_winters(values, horizon, start_params=None):
+    import numpy as np
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+    values = np.asarray(values, dtype=float)
+    if len(values) < 6:
+        pred = [float(values.mean()) if len(values)>0 else 0.0]*horizon
+        return pred, values, 0.0, None
+
+    try:
+        model = ExponentialSmoothing(values, trend='add', seasonal='add', seasonal_periods=12,
+                                     use_boxcox=False)
+        if start_params is not None:
+            # Arranque en caliente: sin la búsqueda en rejilla inicial.
+            res = model.fit(optimized=True, remove_bias=False,
+                            start_params=np.asarray(start_params), use_brute=False)
+        else:
+            res = model.fit(optimized=True, remove_bias=False)
+        pred = list(map(float, res.forecast(horizon)))
+        fitted = np.asarray(res.fittedvalues, dtype=float)
+        rmse = rmse_from_residuals(values - fitted[:len(values)])
+        p = res.params
+        # Orden que espera start_params: alpha, beta, gamma, l0, b0, s0..s11.
+        params = [float(p["smoothing_level"]), float(p["smoothing_trend"]),
+                  float(p["smoothing_seasonal"]), float(p["initial_level"]),
+                  float(p["initial_trend"])] + [float(s) for s in p["initial_seasons"]]
+        return pred, fitted, rmse, params
+    except Exception:
+        if start_params is not None:
+            return _ajustar_holt_winters(values, horizon)
+        pred = [float(values[-1])] * horizon
+        return pred, values, 0.0, None
+
+def holt_winters_predict_next(values, horizon=12, cache=None):
+    if cache is not None:
+        guardado = cache.obtener(values, horizon)
+        if guardado is not None:
+            return guardado
+        inicio = cache.parametros_previos(values, horizon)
+    else:
+        inicio = None
+    with medir("holt_winters.ajuste"):
+        pred, fitted, rmse, params = _ajustar_holt_winters(values, horizon, inicio)
+    if cache is not None:
+        cache.guardar(values, horizon, pred, fitted, rmse, params)
+    return pred, fitted, rmse
+
+
+def _ajustar_serie(values, horizon):
+    """Ajuste de una serie en un proceso del pool: (pred, rmse, método)."""
+    pred, _, rmse, params = _ajustar_holt_winters(values, horizon)
+    return pred, rmse, "holt_winters" if params is not None else "ultimo"
+
+def _sin_modelo(values, horizon):
+    """Las series que no necesitan Holt-Winters: constantes, o con menos de 6 meses con gasto."""
+    import numpy as np
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return [0.0] * horizon, 0.0, "media"
+    if np.count_nonzero(values) < 6:
+        return [float(values.mean())] * horizon, 0.0, "media"
+    if np.all(values == values[0]):
+        return [float(values[0])] * horizon, 0.0, "constante"
+    return None
+
+def pronosticar_por_concepto(series, horizon=12, total=None, procesos=None, limite_s=30.0,
+                             cancelado=None):
+    """Holt-Winters de cada serie de {concepto: valores mensuales}, repartido en procesos.
+
+    Cada serie empieza en su primer mes con gasto. Las que no necesitan modelo
+    se resuelven aquí y el resto se reparten entre `procesos` procesos (por
+    defecto uno por núcleo). Si un ajuste falla o pasa de limite_s segundos
+    desde que empezó, la serie se queda con su último valor, como en
+    holt_winters_predict_next. Con `total` (el pronóstico del total) los
+    pronósticos se escalan mes a mes para que sumen lo mismo que él.
+
+    Devuelve {concepto: {"pred", "sin_reconciliar", "rmse", "metodo"}}.
+    """
+    import numpy as np
+    resultado = {}
+    ajustes = {}
+    for concepto, values in series.items():
+        values = list(values)
+        primero = next((i for i, v in enumerate(values) if v), len(values))
+        values = values[primero:]
+        simple = _sin_modelo(values, horizon)
+        if simple is None:
+            ajustes[concepto] = values
+        else:
+            resultado[concepto] = simple
+
+    procesos = min(procesos or os.cpu_count() or 1, len(ajustes))
+    with medir("pronostico_conceptos.ajustes"):
+        if procesos <= 1:
+            for concepto, values in ajustes.items():
+                resultado[concepto] = _ajustar_serie(values, horizon)
+        elif ajustes:
+            resultado.update(_ajustar_en_procesos(ajustes, horizon, procesos, limite_s, cancelado))
+
+    nombres = list(series)
+    matriz = np.array([np.maximum(resultado[c][0], 0.0) for c in nombres]).reshape(len(nombres), horizon)
+    if total is not None and len(nombres):
+        total = np.maximum(np.asarray(total[:horizon], dtype=float), 0.0)
+        suma = matriz.sum(axis=0)
+        # Un mes en que todos pronostican 0 se reparte según el último año observado.
+        reciente = np.array([sum(list(series[c])[-12:]) for c in nombres], dtype=float)
+        if reciente.sum() <= 0:
+            reciente = np.ones(len(nombres))
+        reparto = np.where(suma > 0, matriz / np.where(suma > 0, suma, 1.0),
+                           (reciente / reciente.sum())[:, None])
+        reconciliado = reparto * total
+    else:
+        reconciliado = matriz
+    return {c: {"pred": reconciliado[i].tolist(), "sin_reconciliar": list(resultado[c][0]),
+                "rmse": resultado[c][1], "metodo": resultado[c][2]}
+            for i, c in enumerate(nombres)}
+
+def _trabajador(conexion):
+    """Proceso de _ajustar_en_procesos: ajusta cada serie que le llega hasta recibir None."""
+    while True:
+        tarea = conexion.recv()
+        if tarea is None:
+            return
+        try:
+            conexion.send(_ajustar_serie(*tarea))
+        except Exception:
+            conexion.send(None)
+
+def _ajustar_en_procesos(ajustes, horizon, procesos, limite_s, cancelado):
+    # spawn: la aplicación tiene hilos y Tk, que no sobreviven bien a un fork.
+    contexto = multiprocessing.get_context("spawn")
+    cola = list(ajustes)[::-1]
+    libres = []
+    ocupados = {}       # conexión -> (proceso, concepto, enviado en)
+    resultado = {}
+
+    def ultimo(concepto, metodo):
+        resultado[concepto] = [float(ajustes[concepto][-1])] * horizon, 0.0, metodo
+
+    def arrancar():
+        propia, suya = contexto.Pipe()
+        proceso = contexto.Process(target=_trabajador, args=(suya,), daemon=True)
+        proceso.start()
+        suya.close()
+        libres.append((proceso, propia))
+
+    def matar(proceso, conexion):
+        proceso.kill()
+        proceso.join()
+        conexion.close()
+
+    for _ in range(procesos):
+        arrancar()
+    try:
+        while (cola or ocupados) and not (cancelado is not None and cancelado.is_set()):
+            while libres and cola:
+                proceso, conexion = libres.pop()
+                concepto = cola.pop()
+                conexion.send((ajustes[concepto], horizon))
+                ocupados[conexion] = proceso, concepto, time.monotonic()
+            for conexion in multiprocessing.connection.wait(list(ocupados), timeout=0.05):
+                proceso, concepto, _ = ocupados.pop(conexion)
+                try:
+                    salida = conexion.recv()
+                except (EOFError, OSError):
+                    matar(proceso, conexion)
+                    arrancar()
+                    salida = None
+                else:
+                    libres.append((proceso, conexion))
+                if salida is None:
+                    ultimo(concepto, "ultimo")
+                else:
+                    resultado[concepto] = salida
+            # Un ajuste no se puede interrumpir: el que pasa del plazo se lleva
+            # su proceso por delante y otro ocupa su sitio, sin pasar de `procesos`.
+            ahora = time.monotonic()
+            for conexion, (proceso, concepto, enviado) in list(ocupados.items()):
+                if ahora - enviado > limite_s:
+                    del ocupados[conexion]
+                    matar(proceso, conexion)
+                    ultimo(concepto, "tiempo")
+                    arrancar()
+    finally:
+        for proceso, conexion in libres:
+            try:
+                conexion.send(None)
+            except OSError:
+                pass
+        for conexion, (proceso, _, _) in ocupados.items():
+            proceso.kill()
+        for proceso, conexion in libres + [(p, c) for c, (p, _, _) in ocupados.items()]:
+            proceso.join()
+            conexion.close()
+    for concepto in cola:
+        ultimo(concepto, "tiempo")
+    for _, concepto, _ in ocupados.values():
+        ultimo(concepto, "tiempo")
+    return resultado
@@ -0,0 +1,241 @@
+"""Importación por lotes de extractos bancarios (CSV, OFX y CAMT.053) y exportaciones propias.
+
+Cada formato es un generador de registros {campo: texto}; normalizar() los
+convierte en filas de movimientos con su huella y Repositorio.importar_movimientos
+las inserta por lotes en una sola transacción, saltándose las ya importadas.
+"""
+import csv
+import hashlib
+import json
+import re
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+from .conversions import dt_to_ts, a_centimos
+
+CAMPOS = ("fecha", "concepto", "cantidad", "tipo", "periodicidad", "id_banco")
+
+# Cabeceras habituales de los extractos para cada campo, en minúsculas.
+ALIAS_COLUMNAS = {
+    "fecha": ("fecha", "fecha operación", "fecha operacion", "f. operación", "fecha valor",
+              "date", "booking date", "transaction date"),
+    "concepto": ("concepto", "descripción", "descripcion", "description", "memo",
+                 "detalle", "payee", "name"),
+    "cantidad": ("cantidad", "importe", "amount", "importe (€)", "importe eur"),
+    "tipo": ("tipo", "type", "cargo/abono"),
+    "periodicidad": ("periodicidad",),
+    "id_banco": ("referencia", "reference", "fitid", "id transacción", "transaction id"),
+}
+
+FORMATOS_FECHA = ("%d/%m/%Y %H:%M", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y", "%d-%m-%Y",
+                  "%d.%m.%Y", "%d/%m/%y", "%Y%m%d%H%M%S", "%Y%m%d")
+
+
+def formato_por_extension(ruta: str) -> str:
+    ruta = ruta.lower()
+    if ruta.endswith((".ofx", ".qfx")):
+        return "ofx"
+    if ruta.endswith(".xml"):
+        return "camt"
+    if ruta.endswith(".json"):
+        return "json"
+    return "csv"
+
+
+def abrir(ruta, formato, encoding="utf-8-sig"):
+    """Abre el fichero como lo espera su lector: CAMT en binario (el XML declara su codificación)."""
+    if formato == "camt":
+        return open(ruta, "rb")
+    return open(ruta, encoding=encoding, newline="")
+
+
+@lru_cache(maxsize=4096)
+def leer_fecha(texto: str) -> int:
+    # Un extracto repite pocas fechas distintas; probar formatos con strptime es lo caro.
+    texto = texto.strip()
+    try:
+        return dt_to_ts(datetime.fromisoformat(texto))
+    except ValueError:
+        pass
+    for formato in FORMATOS_FECHA:
+        try:
+            return dt_to_ts(datetime.strptime(texto, formato))
+        except ValueError:
+            continue
+    raise ValueError(f"Fecha no reconocida: {texto!r}")
+
+def leer_importe(texto) -> Decimal:
+    """Importe con signo; admite "1.234,56", "1,234.56", "-12,3" y símbolos de moneda."""
+    s = re.sub(r"[^\d,.\-+]", "", str(texto))
+    if "," in s and "." in s:
+        miles = "." if s.rfind(",") > s.rfind(".") else ","
+        s = s.replace(miles, "")
+    s = s.replace(",", ".")
+    try:
+        return Decimal(s)
+    except InvalidOperation:
+        raise ValueError(f"Importe no válido: {texto!r}") from None
+
+
+def leer_csv(fichero, mapeo=None, delimitador=None):
+    """Registros de un CSV; mapeo = {campo: cabecera} completa o corrige la detección."""
+    muestra = fichero.read(4096)
+    fichero.seek(0)
+    if delimitador is None:
+        try:
+            delimitador = csv.Sniffer().sniff(muestra, delimiters=",;\t|").delimiter
+        except csv.Error:
+            delimitador = ","
+    lector = csv.reader(fichero, delimiter=delimitador)
+    cabecera = [c.strip() for c in next(lector, [])]
+    columnas = columnas_por_campo(cabecera, mapeo or {})
+    for fila in lector:
+        if not any(fila):
+            continue
+        yield {campo: fila[i] for campo, i in columnas.items() if i < len(fila)}
+
+def columnas_por_campo(cabecera, mapeo):
+    minusculas = [c.lower() for c in cabecera]
+    columnas = {}
+    for campo in CAMPOS:
+        if campo in mapeo:
+            if mapeo[campo] not in cabecera:
+                raise ValueError(f"La columna {mapeo[campo]!r} no está en la cabecera")
+            columnas[campo] = cabecera.index(mapeo[campo])
+            continue
+        for alias in ALIAS_COLUMNAS[campo]:
+            if alias in minusculas:
+                columnas[campo] = minusculas.index(alias)
+                break
+    faltan = [c for c in ("fecha", "concepto", "cantidad") if c not in columnas]
+    if faltan:
+        raise ValueError(f"No se encuentran las columnas {', '.join(faltan)}; usa el mapeo de columnas")
+    return columnas
+
+
+def leer_json(fichero, mapeo=None):
+    for registro in json.load(fichero):
+        yield {campo: registro.get((mapeo or {}).get(campo, campo)) for campo in CAMPOS}
+
+
+_ETIQUETA_OFX = re.compile(r"<(/?)([A-Z0-9.]+)>([^<\r\n]*)")
+
+def leer_ofx(fichero):
+    """Transacciones <STMTTRN> de un OFX, tanto SGML (1.x) como XML (2.x), línea a línea."""
+    actual = None
+    for linea in fichero:
+        for cierre, etiqueta, valor in _ETIQUETA_OFX.findall(linea):
+            if etiqueta == "STMTTRN":
+                if cierre:
+                    if actual is not None:
+                        yield actual
+                    actual = None
+                else:
+                    actual = {}
+            elif actual is not None and not cierre and valor.strip():
+                actual[etiqueta] = valor.strip()
+    # algunos SGML no cierran la última transacción
+    if actual:
+        yield actual
+
+def _registro_ofx(t):
+    return {
+        "fecha": t.get("DTPOSTED", "")[:14].split(".")[0].split("[")[0],
+        "concepto": " ".join(filter(None, (t.get("NAME"), t.get("MEMO")))) or t.get("TRNTYPE", ""),
+        "cantidad": t.get("TRNAMT", ""),
+        "id_banco": t.get("FITID"),
+    }
+
+
+def _sin_espacio(etiqueta):
+    return etiqueta.rsplit("}", 1)[-1]
+
+def leer_camt(fichero):
+    """Apuntes <Ntry> de un extracto ISO 20022 camt.052/053/054, sin cargar el XML entero."""
+    for _evento, elem in ET.iterparse(fichero, events=("end",)):
+        if _sin_espacio(elem.tag) != "Ntry":
+            continue
+        campos = {}
+        textos = []
+        for hijo in elem.iter():
+            nombre = _sin_espacio(hijo.tag)
+            texto = (hijo.text or "").strip()
+            if not texto:
+                continue
+            if nombre == "Amt" and "cantidad" not in campos:
+                campos["cantidad"] = texto
+            elif nombre == "CdtDbtInd" and "signo" not in campos:
+                campos["signo"] = texto
+            elif nombre in ("Dt", "DtTm") and "fecha" not in campos:
+                campos["fecha"] = texto
+            elif nombre in ("AcctSvcrRef", "NtryRef") and "id_banco" not in campos:
+                campos["id_banco"] = texto
+            elif nombre in ("Ustrd", "AddtlNtryInf", "Nm"):
+                textos.append(texto)
+        elem.clear()
+        signo = "-" if campos.pop("signo", "CRDT") == "DBIT" else ""
+        campos["cantidad"] = signo + campos.get("cantidad", "")
+        campos["concepto"] = " ".join(dict.fromkeys(textos))
+        yield campos
+
+
+def leer_registros(fichero, formato, mapeo=None, delimitador=None):
+    if formato == "csv":
+        return leer_csv(fichero, mapeo, delimitador)
+    if formato == "json":
+        return leer_json(fichero, mapeo)
+    if formato == "ofx":
+        return map(_registro_ofx, leer_ofx(fichero))
+    if formato == "camt":
+        return leer_camt(fichero)
+    raise ValueError(f"Formato desconocido: {formato}")
+
+
+def huella(creado_en, tipo, cantidad, concepto, clave) -> int:
+    datos = f"{creado_en}|{tipo}|{cantidad}|{concepto.casefold()}|{clave}"
+    return int.from_bytes(hashlib.sha1(datos.encode("utf-8")).digest()[:8], "big", signed=True)
+
+def normalizar(registros):
+    """Filas (concepto, periodicidad, tipo, céntimos, creado_en, huella) de los registros.
+
+    Sin columna de tipo, el signo del importe decide entre Entrada y Gasto. La
+    huella usa la referencia del banco si la hay; si no, el número de veces que
+    el mismo apunte se ha repetido en el fichero, para que dos cafés iguales el
+    mismo día no se tomen por duplicados.
+    """
+    repeticiones = {}
+    for n, r in enumerate(registros, 1):
+        try:
+            importe = leer_importe(r["cantidad"])
+            tipo = (r.get("tipo") or "").strip().capitalize()
+            if tipo in ("Entrada", "Abono", "Credit", "Crdt"):
+                tipo = "Entrada"
+            elif tipo in ("Gasto", "Cargo", "Debit", "Dbit"):
+                tipo = "Gasto"
+            elif tipo:
+                raise ValueError(f"tipo no válido: {tipo!r}")
+            else:
+                tipo = "Gasto" if importe < 0 else "Entrada"
+            periodicidad = (r.get("periodicidad") or "Variable").strip()
+            if periodicidad not in ("Fijo", "Variable"):
+                raise ValueError(f"periodicidad no válida: {periodicidad!r}")
+            concepto = " ".join((r.get("concepto") or "").split()) or "(sin concepto)"
+            cantidad = a_centimos(abs(importe))
+            creado_en = leer_fecha(r["fecha"] or "")
+        except (KeyError, ValueError, ArithmeticError, AttributeError, TypeError) as e:
+            raise ValueError(f"Registro {n}: {e}") from None
+
+        clave = r.get("id_banco")
+        if not clave:
+            base = (creado_en, tipo, cantidad, concepto.casefold())
+            clave = repeticiones[base] = repeticiones.get(base, 0) + 1
+        yield (concepto, periodicidad, tipo, cantidad, creado_en,
+               huella(creado_en, tipo, cantidad, concepto, clave))
+
+
+def importar(repo, fichero, formato, mapeo=None, delimitador=None, lote=5000, progreso=None):
+    """Importa un fichero abierto; devuelve (leídos, insertados)."""
+    filas = normalizar(leer_registros(fichero, formato, mapeo, delimitador))
+    return repo.importar_movimientos(filas, lote=lote, progreso=progreso)
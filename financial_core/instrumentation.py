@@ -0,0 +1,314 @@
+"""Medición opcional de tiempos: histogramas por función y registro de consultas lentas.
+
+Desactivada no cuesta más que comprobar un booleano. Se activa con la
+variable de entorno FINANCIAL_METRICAS=1 (o FINANCIAL_METRICAS=<ms> para fijar
+también el umbral de consulta lenta), con --metricas en la aplicación o con
+--stats en la línea de órdenes, siempre antes de abrir Storage: las conexiones
+que se abren con la medición activa cronometran cada sentencia SQL (ejecución
+y lectura de filas) y guardan su EXPLAIN QUERY PLAN.
+"""
+import bisect
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# Límites superiores (ms) de las cubetas de los histogramas; la última no tiene límite.
+LIMITES_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 16, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+PRESUPUESTO_FRAME_MS = 16
+
+_LISTA_PARAMETROS = re.compile(r"\?(\s*,\s*\?)+")
+_ESPACIOS = re.compile(r"\s+")
+_PARAMETRO = re.compile(r"'[^']*'|\?(\d*)")
+
+
+def normalizar_sql(sql):
+    """Una sola línea y las listas IN (?, ?, ...) de cualquier longitud como (?,…)."""
+    return _LISTA_PARAMETROS.sub("?,…", _ESPACIOS.sub(" ", sql).strip())
+
+
+class Histograma:
+    __slots__ = ("n", "total", "maximo", "cubetas")
+
+    def __init__(self):
+        self.n = 0
+        self.total = 0.0
+        self.maximo = 0.0
+        self.cubetas = [0] * (len(LIMITES_MS) + 1)
+
+    def anotar(self, ms):
+        self.n += 1
+        self.total += ms
+        self.maximo = max(self.maximo, ms)
+        self.cubetas[bisect.bisect_left(LIMITES_MS, ms)] += 1
+
+    def percentil(self, p):
+        """Límite superior de la cubeta donde cae el percentil p (0-100)."""
+        objetivo = p / 100 * self.n
+        acumulado = 0
+        for i, cuenta in enumerate(self.cubetas):
+            acumulado += cuenta
+            if cuenta and acumulado >= objetivo:
+                return min(LIMITES_MS[i], self.maximo) if i < len(LIMITES_MS) else self.maximo
+        return self.maximo
+
+    def resumen(self):
+        return {
+            "n": self.n,
+            "total_ms": round(self.total, 3),
+            "media_ms": round(self.total / self.n, 3) if self.n else 0.0,
+            "p50_ms": round(self.percentil(50), 3),
+            "p95_ms": round(self.percentil(95), 3),
+            "p99_ms": round(self.percentil(99), 3),
+            "max_ms": round(self.maximo, 3),
+            "cubetas": {("<=%g" % l if i < len(LIMITES_MS) else ">%g" % LIMITES_MS[-1]): c
+                        for i, (l, c) in enumerate(zip(LIMITES_MS + (None,), self.cubetas)) if c},
+        }
+
+
+class Metricas:
+    """Histogramas de latencia por nombre y las últimas operaciones lentas.
+
+    Las sentencias SQL se agrupan por su texto normalizado; el resto por el
+    nombre que se da a medir()/medido(). Una consulta va al registro de lentas
+    si supera umbral_ms; una función, si se midió con su propio umbral (por
+    ejemplo el presupuesto de un frame) y lo supera.
+    """
+
+    def __init__(self, activo=False, umbral_ms=50.0, max_lentos=200):
+        self.activo = activo
+        self.umbral_ms = umbral_ms
+        self.funciones = {}
+        self.consultas = {}
+        self.planes = {}
+        self.lentos = deque(maxlen=max_lentos)
+        self.desde = datetime.now()
+        self._lock = threading.Lock()
+
+    def activar(self, umbral_ms=None):
+        if umbral_ms is not None:
+            self.umbral_ms = umbral_ms
+        self.activo = True
+
+    def reiniciar(self):
+        with self._lock:
+            self.funciones.clear()
+            self.consultas.clear()
+            self.lentos.clear()
+            self.desde = datetime.now()
+
+    def anotar(self, nombre, ms, umbral_ms=None):
+        with self._lock:
+            h = self.funciones.get(nombre)
+            if h is None:
+                h = self.funciones[nombre] = Histograma()
+            h.anotar(ms)
+            if umbral_ms is not None and ms > umbral_ms:
+                self._lento(nombre, ms)
+
+    def anotar_sql(self, sql, ms, con=None):
+        clave = normalizar_sql(sql)
+        plan = self.planes.get(clave)
+        if plan is None and con is not None:
+            plan = self.planes[clave] = explicar(con, sql)
+        with self._lock:
+            h = self.consultas.get(clave)
+            if h is None:
+                h = self.consultas[clave] = Histograma()
+            h.anotar(ms)
+            if ms > self.umbral_ms:
+                self._lento("sql", ms, sql=clave, plan=plan)
+
+    def _lento(self, nombre, ms, **extra):
+        self.lentos.append(dict(fecha=datetime.now().isoformat(timespec="milliseconds"),
+                                nombre=nombre, ms=round(ms, 3),
+                                hilo=threading.current_thread().name, **extra))
+
+    @contextmanager
+    def medir(self, nombre, umbral_ms=None):
+        if not self.activo:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.anotar(nombre, (time.perf_counter() - t0) * 1000, umbral_ms)
+
+    def medido(self, nombre, umbral_ms=None):
+        """Decorador equivalente a envolver la función en medir(nombre)."""
+        def decorador(funcion):
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                if not self.activo:
+                    return funcion(*args, **kwargs)
+                t0 = time.perf_counter()
+                try:
+                    return funcion(*args, **kwargs)
+                finally:
+                    self.anotar(nombre, (time.perf_counter() - t0) * 1000, umbral_ms)
+            return envoltura
+        return decorador
+
+    def volcado(self):
+        """Estadísticas en un dict serializable a JSON, lo más costoso primero."""
+        with self._lock:
+            funciones = [dict(nombre=k, **h.resumen()) for k, h in self.funciones.items()]
+            consultas = [dict(sql=k, plan=self.planes.get(k), **h.resumen())
+                         for k, h in self.consultas.items()]
+            lentos = list(self.lentos)
+        total = lambda d: -d["total_ms"]
+        return {
+            "desde": self.desde.isoformat(timespec="seconds"),
+            "umbral_ms": self.umbral_ms,
+            "funciones": sorted(funciones, key=total),
+            "consultas": sorted(consultas, key=total),
+            "lentos": lentos,
+        }
+
+    def texto(self, max_consultas=20):
+        """Resumen legible del volcado (para la línea de órdenes y el diagnóstico)."""
+        v = self.volcado()
+        lineas = [f"Desde {v['desde']}; consulta lenta > {v['umbral_ms']:g} ms", ""]
+        cabecera = f"{'n':>7} {'total':>10} {'media':>8} {'p95':>8} {'máx':>9}  "
+        lineas.append(cabecera + "función")
+        for d in v["funciones"]:
+            lineas.append(_fila(d) + d["nombre"])
+        lineas += ["", cabecera + "consulta"]
+        for d in v["consultas"][:max_consultas]:
+            lineas.append(_fila(d) + _recortar(d["sql"]))
+            if d["plan"]:
+                lineas += [" " * len(cabecera) + "  " + p for p in d["plan"].splitlines()]
+        if v["lentos"]:
+            lineas += ["", "Lentas (más recientes al final):"]
+            for d in v["lentos"]:
+                lineas.append(f"{d['fecha']} {d['ms']:>9.1f} ms  {d['hilo']}  {_recortar(d.get('sql') or d['nombre'])}")
+        return "\n".join(lineas)
+
+
+def _recortar(texto, ancho=160):
+    return texto if len(texto) <= ancho else texto[:ancho - 1] + "…"
+
+
+def _fila(d):
+    return (f"{d['n']:>7} {d['total_ms']:>8.1f}ms {d['media_ms']:>6.2f}ms "
+            f"{d['p95_ms']:>6.2f}ms {d['max_ms']:>7.1f}ms  ")
+
+
+def explicar(con, sql):
+    """EXPLAIN QUERY PLAN de sql, con los parámetros a NULL, como texto indentado.
+
+    Devuelve '' para las sentencias que no son consultas ni DML.
+    """
+    if not sql.lstrip().upper().startswith(("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")):
+        return ""
+    # ?NNN cuenta hasta el mayor número; ? sueltos, uno cada uno (sin mirar dentro de '...').
+    marcas = [m.group(1) for m in _PARAMETRO.finditer(sql) if m.group(0).startswith("?")]
+    n = max([int(m) for m in marcas if m] or [0]) or len(marcas)
+    try:
+        filas = sqlite3.Connection.execute(con, "EXPLAIN QUERY PLAN " + sql, [None] * n).fetchall()
+    except sqlite3.Error:
+        return ""
+    nivel = {0: -1}
+    lineas = []
+    for id_, padre, _, detalle in filas:
+        nivel[id_] = nivel.get(padre, -1) + 1
+        lineas.append("  " * nivel[id_] + detalle)
+    return "\n".join(lineas)
+
+
+class CursorMedido(sqlite3.Cursor):
+    """Cursor que suma el tiempo de ejecutar y de leer las filas de cada sentencia.
+
+    La sentencia se anota al ejecutar la siguiente, al cerrar el cursor o al
+    liberarlo, que con CPython ocurre en cuanto deja de usarse.
+    """
+    _sql = None
+    _ms = 0.0
+
+    def _terminar(self):
+        if self._sql is not None:
+            sql, self._sql = self._sql, None
+            METRICAS.anotar_sql(sql, self._ms, self.connection)
+
+    def _cronometrar(self, metodo, *args):
+        t0 = time.perf_counter()
+        try:
+            return metodo(self, *args)
+        finally:
+            self._ms += (time.perf_counter() - t0) * 1000
+
+    def execute(self, sql, parametros=()):
+        self._terminar()
+        self._sql, self._ms = sql, 0.0
+        self._cronometrar(sqlite3.Cursor.execute, sql, parametros)
+        return self
+
+    def executemany(self, sql, parametros):
+        self._terminar()
+        self._sql, self._ms = sql, 0.0
+        self._cronometrar(sqlite3.Cursor.executemany, sql, parametros)
+        return self
+
+    def fetchone(self):
+        return self._cronometrar(sqlite3.Cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self.arraysize
+        return self._cronometrar(sqlite3.Cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self._cronometrar(sqlite3.Cursor.fetchall)
+
+    def __next__(self):
+        return self._cronometrar(sqlite3.Cursor.__next__)
+
+    def close(self):
+        try:
+            self._terminar()
+        finally:
+            super().close()
+
+    def __del__(self):
+        try:
+            self._terminar()
+        except Exception:
+            pass
+
+
+class ConexionMedida(sqlite3.Connection):
+    """Fábrica de conexiones para sqlite3.connect cuyas sentencias se cronometran."""
+
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+
+def _desde_entorno():
+    valor = os.environ.get("FINANCIAL_METRICAS", "")
+    if valor in ("", "0"):
+        return Metricas()
+    try:
+        umbral = float(valor) if valor != "1" else None
+    except ValueError:
+        umbral = None
+    metricas = Metricas(activo=True)
+    if umbral is not None:
+        metricas.umbral_ms = umbral
+    return metricas
+
+
+METRICAS = _desde_entorno()
+medir = METRICAS.medir
+medido = METRICAS.medido
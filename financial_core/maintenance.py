@@ -0,0 +1,339 @@
+"""Mantenimiento de la base de datos: copias en caliente, compactación y estadísticas.
+
+Las copias usan la API de backup de sqlite3 a pasos de unas pocas páginas,
+con una pausa entre pasos y desde una conexión propia: quien escribe no
+espera y lo copiado es siempre una base de datos consistente. Cada copia es
+una generación (un directorio con la fecha) y se conservan las últimas; las
+particiones de años archivados que no han cambiado desde la generación
+anterior se enlazan en vez de volver a copiarse.
+
+compactar() devuelve al sistema las páginas libres con incremental_vacuum y
+analizar() rehace las estadísticas del planificador. Mantenimiento programa
+las tres tareas en un hilo propio para cuando la aplicación está ociosa.
+"""
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from .conversions import ts_now, ts_to_dt
+from .instrumentation import medido
+
+TAREAS = ("copia", "compactar", "analizar")
+# Cada cuánto (segundos) vence cada tarea.
+PERIODOS_S = {"copia": 86400, "compactar": 7 * 86400, "analizar": 86400}
+GENERACIONES = 7
+
+_GENERACION = re.compile(r"\d{8}-\d{6}")
+_MANIFIESTO = "manifiesto.json"
+
+
+class Cancelado(Exception):
+    """La tarea se abandonó porque volvió a haber actividad."""
+
+
+def directorio_copias(ruta_bd):
+    """Directorio por defecto de las copias: copias/ junto a la base de datos."""
+    return os.path.join(os.path.dirname(os.path.abspath(ruta_bd)), "copias")
+
+
+def _ruta_principal(con):
+    return next(f for _, nombre, f in con.execute("PRAGMA database_list") if nombre == "main")
+
+
+def _tamano(ruta):
+    try:
+        return os.path.getsize(ruta)
+    except OSError:
+        return 0
+
+
+def generaciones(directorio):
+    """Nombres de las generaciones de copias del directorio, de la más antigua a la más nueva."""
+    try:
+        return sorted(n for n in os.listdir(directorio) if _GENERACION.fullmatch(n))
+    except FileNotFoundError:
+        return []
+
+
+def _copiar(con, destino, paginas, pausa_s, cancelado):
+    """Copia la base de datos de con en destino con la API de backup, paso a paso."""
+    def progreso(_estado, _quedan, _total):
+        if cancelado is not None and cancelado.is_set():
+            raise Cancelado()
+
+    copia = sqlite3.connect(destino)
+    try:
+        con.backup(copia, pages=paginas, progress=progreso, sleep=pausa_s)
+        (resultado,) = copia.execute("PRAGMA quick_check").fetchone()
+        if resultado != "ok":
+            raise sqlite3.DatabaseError(f"La copia de {destino} no es válida: {resultado}")
+        copia.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        copia.close()
+
+
+@medido("copia_seguridad")
+def copia_seguridad(repo, directorio, conservar=GENERACIONES, paginas=256, pausa_s=0.005, cancelado=None):
+    """Hace una generación nueva de copias en directorio y devuelve su ruta.
+
+    Se copia la base de datos de repo y las particiones de sus años
+    archivados; después se borran las generaciones más antiguas hasta dejar
+    `conservar`. La generación se prepara en un directorio temporal y se
+    renombra al terminar, así que nunca queda una a medias.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    nombre = datetime.now().strftime("%Y%m%d-%H%M%S")
+    destino = os.path.join(directorio, nombre)
+    tmp = os.path.join(directorio, f".{nombre}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    anteriores = generaciones(directorio)
+    previa = os.path.join(directorio, anteriores[-1]) if anteriores else None
+    try:
+        with open(os.path.join(previa, _MANIFIESTO), encoding="utf-8") as f:
+            manifiesto_previo = json.load(f)
+    except (TypeError, OSError, ValueError):
+        manifiesto_previo = {}
+    try:
+        _copiar(repo.con, os.path.join(tmp, os.path.basename(_ruta_principal(repo.con))),
+                paginas, pausa_s, cancelado)
+        manifiesto = {}
+        for anio in repo.particiones():
+            origen = repo.ruta_particion(anio)
+            fichero = os.path.basename(origen)
+            info = os.stat(origen)
+            manifiesto[fichero] = firma = [info.st_size, info.st_mtime_ns]
+            if manifiesto_previo.get(fichero) == firma:
+                # Las particiones solo cambian al archivar: se reaprovecha la copia anterior.
+                try:
+                    os.link(os.path.join(previa, fichero), os.path.join(tmp, fichero))
+                    continue
+                except OSError:
+                    pass
+            con = sqlite3.connect(origen)
+            try:
+                _copiar(con, os.path.join(tmp, fichero), paginas, pausa_s, cancelado)
+            finally:
+                con.close()
+        with open(os.path.join(tmp, _MANIFIESTO), "w", encoding="utf-8") as f:
+            json.dump(manifiesto, f)
+        if os.path.exists(destino):
+            # Dos copias en el mismo segundo: la nueva sustituye a la anterior.
+            shutil.rmtree(destino)
+        os.replace(tmp, destino)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    for viejo in generaciones(directorio)[:-conservar or None] if conservar > 0 else ():
+        shutil.rmtree(os.path.join(directorio, viejo), ignore_errors=True)
+    return destino
+
+
+@medido("compactar")
+def compactar(con, paginas=512, pausa_s=0.005, cancelado=None):
+    """Devuelve al sistema las páginas libres de la base de datos; devuelve cuántas.
+
+    Se liberan a trozos de `paginas` con incremental_vacuum, así que entre
+    trozos pueden pasar otras escrituras. Una base de datos creada antes de
+    auto_vacuum=INCREMENTAL necesita una vez un VACUUM completo para
+    cambiar de modo; solo se puede interrumpir con con.interrupt().
+    """
+    (modo,) = con.execute("PRAGMA auto_vacuum").fetchone()
+    (libres,) = con.execute("PRAGMA freelist_count").fetchone()
+    if modo != 2:
+        con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        con.execute("VACUUM")
+        liberadas = libres
+    else:
+        liberadas = 0
+        while libres:
+            if cancelado is not None and cancelado.is_set():
+                raise Cancelado()
+            con.execute(f"PRAGMA incremental_vacuum({int(paginas)})").fetchall()
+            (quedan,) = con.execute("PRAGMA freelist_count").fetchone()
+            if quedan >= libres:
+                break
+            liberadas += libres - quedan
+            libres = quedan
+            time.sleep(pausa_s)
+    # En WAL el fichero solo encoge al pasar el registro a la base de datos.
+    con.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    return liberadas
+
+
+@medido("analizar")
+def analizar(con, limite=1000):
+    """ANALYZE aproximado (analysis_limit filas por índice) para que el planificador vea las tablas como están."""
+    con.execute(f"PRAGMA analysis_limit={int(limite)}")
+    con.execute("ANALYZE")
+
+
+def fragmentacion(con):
+    """Porcentaje de hojas de los árboles de la base de datos que no siguen a la anterior en el fichero.
+
+    Cuanto más alto, más saltos hacen los recorridos por orden. None si
+    SQLite no trae la tabla dbstat.
+    """
+    saltos = hojas = 0
+    anterior = {}
+    try:
+        for nombre, pagina in con.execute("SELECT name, pageno FROM dbstat WHERE pagetype='leaf'"):
+            previa = anterior.get(nombre)
+            if previa is not None:
+                hojas += 1
+                saltos += pagina != previa + 1
+            anterior[nombre] = pagina
+    except sqlite3.OperationalError:
+        return None
+    return round(100 * saltos / hojas, 1) if hojas else 0.0
+
+
+def estado(repo, directorio=None, detallado=False):
+    """Tamaño y espacio libre de la base de datos y cuándo se hizo cada tarea, como dict.
+
+    Con detallado se mide también la fragmentación, que recorre todas las
+    páginas; sin él solo se leen pragmas y tamaños de ficheros.
+    """
+    con = repo.con
+    ruta = _ruta_principal(con)
+    (pagina,) = con.execute("PRAGMA page_size").fetchone()
+    (paginas,) = con.execute("PRAGMA page_count").fetchone()
+    (libres,) = con.execute("PRAGMA freelist_count").fetchone()
+    (modo,) = con.execute("PRAGMA auto_vacuum").fetchone()
+    datos = {
+        "fichero_bytes": _tamano(ruta),
+        "wal_bytes": _tamano(ruta + "-wal"),
+        "particiones_bytes": sum(_tamano(repo.ruta_particion(a)) for a in repo.particiones()),
+        "paginas": paginas,
+        "pagina_bytes": pagina,
+        "paginas_libres": libres,
+        "libres_pct": round(100 * libres / paginas, 1) if paginas else 0.0,
+        "auto_vacuum": ("NONE", "FULL", "INCREMENTAL")[modo],
+    }
+    if detallado:
+        datos["fragmentacion_pct"] = fragmentacion(con)
+    for tarea, hecho_en, resultado in con.execute("SELECT tarea, hecho_en, resultado FROM mantenimiento"):
+        datos[f"{tarea}_en"] = ts_to_dt(hecho_en).isoformat(timespec="seconds")
+        datos[tarea] = resultado
+    if directorio is not None:
+        hechas = generaciones(directorio)
+        datos["copias"] = len(hechas)
+        datos["ultima_copia"] = os.path.join(directorio, hechas[-1]) if hechas else ""
+    return datos
+
+
+def texto_estado(datos):
+    """Las líneas «clave: valor» de estado() para mostrarlas."""
+    ancho = max(map(len, datos), default=0)
+    return "\n".join(f"{clave:<{ancho}}  {valor}" for clave, valor in datos.items())
+
+
+class Mantenimiento:
+    """Lanza las tareas de mantenimiento vencidas cuando la aplicación está ociosa.
+
+    Ociosa quiere decir que Storage.version no ha cambiado ni se ha llamado
+    a actividad() en los últimos inactividad_s segundos. Las tareas corren
+    en un hilo propio con una conexión de escritura aparte; si vuelve a
+    haber actividad a mitad de una, se abandona (la copia en curso se
+    descarta) y se repite en la siguiente ocasión.
+    """
+
+    def __init__(self, db, directorio=None, conservar=GENERACIONES, periodos=None,
+                 inactividad_s=120, revision_s=15):
+        self.db = db
+        self.directorio = directorio or directorio_copias(db.path)
+        self.conservar = conservar
+        self.periodos = dict(PERIODOS_S if periodos is None else periodos)
+        self.inactividad_s = inactividad_s
+        self.revision_s = revision_s
+        self.ultimo_error = None
+        self._cancelado = threading.Event()
+        self._parar = threading.Event()
+        self._ultima_actividad = time.monotonic()
+        self._version = db.version
+        self._con = None            # conexión de la tarea en curso, para interrumpirla
+        self._hilo = None
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._bucle, name="mantenimiento", daemon=True)
+        self._hilo.start()
+
+    def detener(self, espera_s=5):
+        self._parar.set()
+        self.actividad()
+        if self._hilo is not None:
+            self._hilo.join(espera_s)
+
+    def actividad(self):
+        """Avisa de que el usuario está usando la aplicación: aplaza e interrumpe el mantenimiento."""
+        self._ultima_actividad = time.monotonic()
+        con = self._con
+        if con is not None and not self._cancelado.is_set():
+            self._cancelado.set()
+            con.interrupt()
+
+    def vencidas(self, repo):
+        hechas = dict(repo.con.execute("SELECT tarea, hecho_en FROM mantenimiento"))
+        ahora = ts_now()
+        return [t for t in TAREAS if t in self.periodos and ahora - hechas.get(t, 0) >= self.periodos[t]]
+
+    def ejecutar(self, tareas=None, cancelado=None):
+        """Ejecuta ya las tareas indicadas (por defecto, las vencidas); devuelve {tarea: resultado}.
+
+        Si cancelado se activa a mitad, la tarea en curso y las siguientes
+        se dejan para otra vez.
+        """
+        hechas = {}
+        with self.db.escritor() as repo:
+            self._con = repo.con
+            try:
+                for tarea in self.vencidas(repo) if tareas is None else tareas:
+                    if cancelado is not None and cancelado.is_set():
+                        break
+                    inicio = time.perf_counter()
+                    try:
+                        resultado = self._tarea(tarea, repo, cancelado)
+                    except Cancelado:
+                        break
+                    except sqlite3.OperationalError:
+                        if cancelado is not None and cancelado.is_set():
+                            break       # con.interrupt() desde actividad()
+                        raise
+                    with repo.con:
+                        repo.con.execute("INSERT OR REPLACE INTO mantenimiento VALUES (?, ?, ?, ?)",
+                                         (tarea, ts_now(), round((time.perf_counter() - inicio) * 1000, 1),
+                                          resultado))
+                    hechas[tarea] = resultado
+            finally:
+                self._con = None
+        return hechas
+
+    def _tarea(self, tarea, repo, cancelado):
+        if tarea == "copia":
+            return copia_seguridad(repo, self.directorio, self.conservar, cancelado=cancelado)
+        if tarea == "compactar":
+            return f"{compactar(repo.con, cancelado=cancelado)} páginas liberadas"
+        if tarea == "analizar":
+            analizar(repo.con)
+            fragmentada = fragmentacion(repo.con)
+            return "hecho" if fragmentada is None else f"fragmentación {fragmentada}%"
+        raise ValueError(f"Tarea de mantenimiento desconocida: {tarea!r}")
+
+    def _bucle(self):
+        while not self._parar.wait(self.revision_s):
+            if self.db.version != self._version:
+                self._version = self.db.version
+                self._ultima_actividad = time.monotonic()
+            if time.monotonic() - self._ultima_actividad < self.inactividad_s:
+                continue
+            self._cancelado.clear()
+            try:
+                self.ejecutar(cancelado=self._cancelado)
+                self.ultimo_error = None
+            except Exception as e:
+                self.ultimo_error = e
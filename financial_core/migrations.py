@@ -0,0 +1,592 @@
+"""Migraciones del esquema, aplicadas en orden según PRAGMA user_version."""
+import sqlite3
+
+def _migracion_esquema_inicial(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS movimientos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            concepto TEXT NOT NULL,
+            periodicidad TEXT NOT NULL,
+            tipo TEXT NOT NULL,              -- 'Gasto' o 'Entrada'
+            cantidad REAL NOT NULL,
+            creado_en TEXT NOT NULL          -- 'YYYY-MM-DD HH:MM:SS'
+        )
+    """)
+
+def _migracion_indices(con):
+    # Listado y rangos de fechas (ORDER BY creado_en, id).
+    con.execute("CREATE INDEX IF NOT EXISTS idx_mov_creado ON movimientos (creado_en, id)")
+    # Filtro por tipo y serie de gastos; incluye periodicidad y cantidad para no tocar la tabla.
+    con.execute("""CREATE INDEX IF NOT EXISTS idx_mov_tipo_creado
+                   ON movimientos (tipo, creado_en, periodicidad, cantidad)""")
+    # Fijos: materialización y proyección anual.
+    con.execute("""CREATE INDEX IF NOT EXISTS idx_mov_fijos
+                   ON movimientos (periodicidad, concepto, tipo, cantidad, creado_en)""")
+    con.execute("ANALYZE")
+
+def _migracion_reglas_fijas(con):
+    # Cada movimiento fijo genera una regla con su plantilla y hasta qué mes
+    # se han creado ya sus copias; las copias apuntan a la regla (regla_id).
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS reglas_fijas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            origen_id INTEGER NOT NULL UNIQUE,   -- movimiento que define la regla
+            concepto TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            cantidad REAL NOT NULL,
+            inicio TEXT NOT NULL,                -- creado_en del origen
+            materializado_hasta TEXT NOT NULL    -- 'YYYY-MM' del último mes generado
+        )
+    """)
+    con.execute("ALTER TABLE movimientos ADD COLUMN regla_id INTEGER")
+    con.execute("CREATE INDEX IF NOT EXISTS idx_mov_regla ON movimientos (regla_id, creado_en)")
+    # Los fijos existentes se agrupan igual que los deduplicaba materializar_fijos.
+    con.execute("""
+        INSERT INTO reglas_fijas (origen_id, concepto, tipo, cantidad, inicio, materializado_hasta)
+        SELECT (SELECT o.id FROM movimientos o
+                WHERE o.periodicidad='Fijo' AND o.concepto=g.concepto
+                  AND o.tipo=g.tipo AND o.cantidad=g.cantidad
+                ORDER BY o.creado_en, o.id LIMIT 1),
+               concepto, tipo, cantidad, MIN(creado_en), substr(MAX(creado_en), 1, 7)
+        FROM movimientos g WHERE periodicidad='Fijo'
+        GROUP BY concepto, tipo, cantidad
+    """)
+    con.execute("""
+        UPDATE movimientos SET regla_id = (
+            SELECT r.id FROM reglas_fijas r
+            WHERE r.concepto=movimientos.concepto AND r.tipo=movimientos.tipo
+              AND r.cantidad=movimientos.cantidad)
+        WHERE periodicidad='Fijo'
+    """)
+
+def _triggers_totales(expr_anio, expr_mes, expr_dia):
+    """Triggers que mantienen monthly_totals/daily_totals al día.
+
+    Las expresiones reciben la fila ('NEW' u 'OLD') en el hueco {f}.
+    """
+    def sumar(f, signo):
+        anio, mes, dia = expr_anio.format(f=f), expr_mes.format(f=f), expr_dia.format(f=f)
+        sql = f"""
+            INSERT INTO monthly_totals (anio, mes, tipo, periodicidad, total, n)
+            VALUES ({anio}, {mes}, {f}.tipo, {f}.periodicidad, {signo}{f}.cantidad, {signo}1)
+            ON CONFLICT (anio, mes, tipo, periodicidad)
+            DO UPDATE SET total = total + excluded.total, n = n + excluded.n;
+            INSERT INTO daily_totals (dia, tipo, periodicidad, total, n)
+            VALUES ({dia}, {f}.tipo, {f}.periodicidad, {signo}{f}.cantidad, {signo}1)
+            ON CONFLICT (dia, tipo, periodicidad)
+            DO UPDATE SET total = total + excluded.total, n = n + excluded.n;
+        """
+        if signo == "-":
+            sql += f"""
+            DELETE FROM monthly_totals WHERE anio={anio} AND mes={mes}
+              AND tipo={f}.tipo AND periodicidad={f}.periodicidad AND n=0;
+            DELETE FROM daily_totals WHERE dia={dia}
+              AND tipo={f}.tipo AND periodicidad={f}.periodicidad AND n=0;
+            """
+        return sql
+
+    return [
+        f"CREATE TRIGGER trg_totales_ins AFTER INSERT ON movimientos BEGIN {sumar('NEW', '')} END",
+        f"CREATE TRIGGER trg_totales_del AFTER DELETE ON movimientos BEGIN {sumar('OLD', '-')} END",
+        f"""CREATE TRIGGER trg_totales_upd AFTER UPDATE OF tipo, periodicidad, cantidad, creado_en
+            ON movimientos BEGIN {sumar('OLD', '-')} {sumar('NEW', '')} END""",
+    ]
+
+def _migracion_totales(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS monthly_totals (
+            anio INTEGER NOT NULL,
+            mes INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            periodicidad TEXT NOT NULL,
+            total REAL NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (anio, mes, tipo, periodicidad)
+        ) WITHOUT ROWID
+    """)
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            dia TEXT NOT NULL,                   -- 'YYYY-MM-DD'
+            tipo TEXT NOT NULL,
+            periodicidad TEXT NOT NULL,
+            total REAL NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (dia, tipo, periodicidad)
+        ) WITHOUT ROWID
+    """)
+    con.execute("""
+        INSERT INTO monthly_totals (anio, mes, tipo, periodicidad, total, n)
+        SELECT CAST(substr(creado_en, 1, 4) AS INTEGER), CAST(substr(creado_en, 6, 2) AS INTEGER),
+               tipo, periodicidad, SUM(cantidad), COUNT(*)
+        FROM movimientos GROUP BY 1, 2, 3, 4
+    """)
+    con.execute("""
+        INSERT INTO daily_totals (dia, tipo, periodicidad, total, n)
+        SELECT substr(creado_en, 1, 10), tipo, periodicidad, SUM(cantidad), COUNT(*)
+        FROM movimientos GROUP BY 1, 2, 3
+    """)
+    for sql in _triggers_totales("CAST(substr({f}.creado_en, 1, 4) AS INTEGER)",
+                                 "CAST(substr({f}.creado_en, 6, 2) AS INTEGER)",
+                                 "substr({f}.creado_en, 1, 10)"):
+        con.execute(sql)
+
+def _migracion_enteros(con):
+    # creado_en pasa de texto a segundos Unix y cantidad de REAL a céntimos.
+    # SQLite no cambia tipos de columna, así que se reconstruyen las tablas.
+    con.execute("""
+        CREATE TABLE movimientos_nueva (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            concepto TEXT NOT NULL,
+            periodicidad TEXT NOT NULL,
+            tipo TEXT NOT NULL,              -- 'Gasto' o 'Entrada'
+            cantidad INTEGER NOT NULL,       -- céntimos
+            creado_en INTEGER NOT NULL,      -- segundos Unix, hora local
+            regla_id INTEGER
+        )
+    """)
+    con.execute("""
+        INSERT INTO movimientos_nueva (id, concepto, periodicidad, tipo, cantidad, creado_en, regla_id)
+        SELECT id, concepto, periodicidad, tipo, CAST(round(cantidad * 100) AS INTEGER),
+               COALESCE(CAST(strftime('%s', creado_en) AS INTEGER),
+                        CAST(strftime('%s', substr(creado_en, 1, 10)) AS INTEGER), 0),
+               regla_id
+        FROM movimientos
+    """)
+    con.execute("DROP TABLE movimientos")
+    con.execute("ALTER TABLE movimientos_nueva RENAME TO movimientos")
+    _migracion_indices(con)
+    con.execute("CREATE INDEX IF NOT EXISTS idx_mov_regla ON movimientos (regla_id, creado_en)")
+
+    con.execute("""
+        CREATE TABLE reglas_nueva (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            origen_id INTEGER NOT NULL UNIQUE,   -- movimiento que define la regla
+            concepto TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            cantidad INTEGER NOT NULL,           -- céntimos
+            inicio INTEGER NOT NULL,             -- creado_en del origen
+            materializado_hasta TEXT NOT NULL    -- 'YYYY-MM' del último mes generado
+        )
+    """)
+    con.execute("""
+        INSERT INTO reglas_nueva
+        SELECT r.id, r.origen_id, r.concepto, r.tipo, CAST(round(r.cantidad * 100) AS INTEGER),
+               COALESCE(m.creado_en, CAST(strftime('%s', r.inicio) AS INTEGER), 0),
+               r.materializado_hasta
+        FROM reglas_fijas r LEFT JOIN movimientos m ON m.id = r.origen_id
+    """)
+    con.execute("DROP TABLE reglas_fijas")
+    con.execute("ALTER TABLE reglas_nueva RENAME TO reglas_fijas")
+
+    # Totales en céntimos; los diarios se indexan por día desde 1970.
+    con.execute("DROP TABLE monthly_totals")
+    con.execute("DROP TABLE daily_totals")
+    con.execute("""
+        CREATE TABLE monthly_totals (
+            anio INTEGER NOT NULL,
+            mes INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            periodicidad TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (anio, mes, tipo, periodicidad)
+        ) WITHOUT ROWID
+    """)
+    con.execute("""
+        CREATE TABLE daily_totals (
+            dia INTEGER NOT NULL,                -- creado_en / 86400
+            tipo TEXT NOT NULL,
+            periodicidad TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (dia, tipo, periodicidad)
+        ) WITHOUT ROWID
+    """)
+    con.execute("""
+        INSERT INTO monthly_totals (anio, mes, tipo, periodicidad, total, n)
+        SELECT CAST(strftime('%Y', creado_en, 'unixepoch') AS INTEGER),
+               CAST(strftime('%m', creado_en, 'unixepoch') AS INTEGER),
+               tipo, periodicidad, SUM(cantidad), COUNT(*)
+        FROM movimientos GROUP BY 1, 2, 3, 4
+    """)
+    con.execute("""
+        INSERT INTO daily_totals (dia, tipo, periodicidad, total, n)
+        SELECT creado_en / 86400, tipo, periodicidad, SUM(cantidad), COUNT(*)
+        FROM movimientos GROUP BY 1, 2, 3
+    """)
+    for sql in _triggers_totales("CAST(strftime('%Y', {f}.creado_en, 'unixepoch') AS INTEGER)",
+                                 "CAST(strftime('%m', {f}.creado_en, 'unixepoch') AS INTEGER)",
+                                 "{f}.creado_en / 86400"):
+        con.execute(sql)
+    con.execute("ANALYZE")
+
+def _migracion_busqueda(con):
+    # Índice de texto completo sobre concepto, sin tildes y con prefijos.
+    # Si el SQLite del sistema no trae FTS5 la búsqueda sigue usando LIKE.
+    try:
+        con.execute("""
+            CREATE VIRTUAL TABLE movimientos_fts USING fts5(
+                concepto, content='movimientos', content_rowid='id',
+                tokenize="unicode61 remove_diacritics 2"
+            )
+        """)
+    except sqlite3.OperationalError:
+        return
+    con.execute("INSERT INTO movimientos_fts (movimientos_fts) VALUES ('rebuild')")
+    con.execute("""
+        CREATE TRIGGER trg_fts_ins AFTER INSERT ON movimientos BEGIN
+            INSERT INTO movimientos_fts (rowid, concepto) VALUES (NEW.id, NEW.concepto);
+        END
+    """)
+    con.execute("""
+        CREATE TRIGGER trg_fts_del AFTER DELETE ON movimientos BEGIN
+            INSERT INTO movimientos_fts (movimientos_fts, rowid, concepto)
+            VALUES ('delete', OLD.id, OLD.concepto);
+        END
+    """)
+    con.execute("""
+        CREATE TRIGGER trg_fts_upd AFTER UPDATE OF concepto ON movimientos BEGIN
+            INSERT INTO movimientos_fts (movimientos_fts, rowid, concepto)
+            VALUES ('delete', OLD.id, OLD.concepto);
+            INSERT INTO movimientos_fts (rowid, concepto) VALUES (NEW.id, NEW.concepto);
+        END
+    """)
+
+def _migracion_huellas(con):
+    # Huella (hash de 64 bits) de los movimientos importados de ficheros, para
+    # no duplicarlos al reimportar. Los introducidos a mano la dejan a NULL.
+    con.execute("ALTER TABLE movimientos ADD COLUMN huella INTEGER")
+    con.execute("CREATE INDEX idx_mov_huella ON movimientos(huella) WHERE huella IS NOT NULL")
+
+# Saldo al cierre de cada mes con movimientos (mes = año*12 + mes - 1) desde el
+# mes ?1, partiendo del saldo ?2 del cierre anterior.
+SQL_SALDOS_DESDE = """
+    INSERT INTO saldos_mensuales (mes, saldo)
+    SELECT m, ?2 + SUM(neto) OVER (ORDER BY m) FROM (
+        SELECT anio * 12 + mes - 1 AS m,
+               SUM(CASE WHEN tipo='Entrada' THEN total
+                        WHEN tipo='Gasto'   THEN -total
+                        ELSE 0 END) AS neto
+        FROM monthly_totals WHERE (anio, mes) >= (?1 / 12, ?1 % 12 + 1)
+        GROUP BY anio, mes
+    )
+"""
+
+def _migracion_saldos(con):
+    # saldo guarda el balance actual y el primer mes cuyo cierre en
+    # saldos_mensuales ha quedado desfasado por una escritura; Repositorio
+    # rehace los cierres desde ahí al confirmar cada transacción.
+    con.execute("""
+        CREATE TABLE saldo (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total INTEGER NOT NULL,
+            pendiente_desde INTEGER
+        )
+    """)
+    con.execute("CREATE TABLE saldos_mensuales (mes INTEGER PRIMARY KEY, saldo INTEGER NOT NULL)")
+    con.execute("""
+        INSERT INTO saldo (id, total)
+        SELECT 1, COALESCE(SUM(CASE WHEN tipo='Entrada' THEN total
+                                    WHEN tipo='Gasto'   THEN -total
+                                    ELSE 0 END), 0)
+        FROM monthly_totals
+    """)
+    con.execute(SQL_SALDOS_DESDE, (0, 0))
+
+    mes = ("(CAST(strftime('%Y', {f}.creado_en, 'unixepoch') AS INTEGER) * 12"
+           " + CAST(strftime('%m', {f}.creado_en, 'unixepoch') AS INTEGER) - 1)")
+    neto = ("CASE WHEN {f}.tipo='Entrada' THEN {f}.cantidad"
+            " WHEN {f}.tipo='Gasto' THEN -{f}.cantidad ELSE 0 END")
+    n, o = mes.format(f="NEW"), mes.format(f="OLD")
+    con.execute(f"""
+        CREATE TRIGGER trg_saldo_ins AFTER INSERT ON movimientos BEGIN
+            UPDATE saldo SET total = total + {neto.format(f="NEW")},
+                             pendiente_desde = MIN(COALESCE(pendiente_desde, {n}), {n});
+        END
+    """)
+    con.execute(f"""
+        CREATE TRIGGER trg_saldo_del AFTER DELETE ON movimientos BEGIN
+            UPDATE saldo SET total = total - ({neto.format(f="OLD")}),
+                             pendiente_desde = MIN(COALESCE(pendiente_desde, {o}), {o});
+        END
+    """)
+    con.execute(f"""
+        CREATE TRIGGER trg_saldo_upd AFTER UPDATE OF tipo, cantidad, creado_en ON movimientos BEGIN
+            UPDATE saldo SET total = total - ({neto.format(f="OLD")}) + {neto.format(f="NEW")},
+                             pendiente_desde = MIN(COALESCE(pendiente_desde, {o}), {o}, {n});
+        END
+    """)
+
+def _migracion_recurrencia(con):
+    # Reglas virtuales: no se materializan copias; sus meses se calculan al
+    # consultar. fin cierra la regla (NULL, sin fin); reglas_importes guarda
+    # los cambios de cantidad desde un mes y reglas_excepciones los meses que
+    # se saltan (cantidad NULL) o cambian de cantidad o fecha. Los meses son
+    # año*12 + mes - 1. recurrencia.version sube con cualquier cambio de las
+    # reglas (para invalidar su expansión) y recurrencia.virtual es el modo de
+    # las reglas nuevas.
+    con.execute("ALTER TABLE reglas_fijas ADD COLUMN fin INTEGER")
+    con.execute("ALTER TABLE reglas_fijas ADD COLUMN virtual INTEGER NOT NULL DEFAULT 0")
+    con.execute("""
+        CREATE TABLE reglas_importes (
+            regla_id INTEGER NOT NULL,
+            desde INTEGER NOT NULL,
+            cantidad INTEGER NOT NULL,
+            PRIMARY KEY (regla_id, desde)
+        ) WITHOUT ROWID
+    """)
+    con.execute("""
+        CREATE TABLE reglas_excepciones (
+            regla_id INTEGER NOT NULL,
+            mes INTEGER NOT NULL,
+            cantidad INTEGER,
+            creado_en INTEGER,
+            PRIMARY KEY (regla_id, mes)
+        ) WITHOUT ROWID
+    """)
+    con.execute("""
+        CREATE TABLE recurrencia (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL,
+            virtual INTEGER NOT NULL
+        )
+    """)
+    con.execute("INSERT INTO recurrencia (id, version, virtual) VALUES (1, 0, 0)")
+    for tabla, columnas in (("reglas_fijas", " OF concepto, tipo, cantidad, inicio, fin, virtual"),
+                            ("reglas_importes", ""), ("reglas_excepciones", "")):
+        for evento in ("INSERT", f"UPDATE{columnas}", "DELETE"):
+            nombre = f"trg_version_{tabla}_{evento.split()[0].lower()}"
+            con.execute(f"""
+                CREATE TRIGGER {nombre} AFTER {evento} ON {tabla} BEGIN
+                    UPDATE recurrencia SET version = version + 1;
+                END
+            """)
+
+def _migracion_particiones(con):
+    # Años cerrados archivados en ficheros aparte (ver Repositorio.archivar).
+    # Sus totales siguen en monthly_totals, daily_totals y los saldos; aquí
+    # quedan cuántas filas tiene cada partición y las huellas de sus
+    # movimientos importados, para no volver a importarlos.
+    con.execute("CREATE TABLE particiones (anio INTEGER PRIMARY KEY, filas INTEGER NOT NULL)")
+    con.execute("CREATE TABLE huellas_archivadas (huella INTEGER PRIMARY KEY) WITHOUT ROWID")
+
+
+def _migracion_mantenimiento(con):
+    # Última vez que se hizo cada tarea de mantenimiento (maintenance.Mantenimiento).
+    con.execute("""CREATE TABLE mantenimiento (
+        tarea TEXT PRIMARY KEY,
+        hecho_en INTEGER NOT NULL,
+        duracion_ms REAL,
+        resultado TEXT
+    )""")
+
+FACTOR_UID = 2654435761
+
+def sql_uid(base, n):
+    """Expresión SQL de un uid derivado: base XOR (n * 2654435761).
+
+    Lo usan las filas que ya existían al añadir los uid (id y creado_en) y
+    las copias de los fijos (uid del origen y mes), para que dos copias de
+    la misma base de datos les den el mismo uid cada una por su lado.
+    SQLite no tiene XOR; (a | b) - (a & b) da lo mismo sin desbordar.
+    """
+    k = f"(({n}) * {FACTOR_UID})"
+    return f"((({base}) | {k}) - (({base}) & {k}))"
+
+def sql_mes(ts):
+    """Expresión SQL del mes (año*12 + mes - 1) del instante ts, como recurrence.mes_de."""
+    return (f"(CAST(strftime('%Y', {ts}, 'unixepoch') AS INTEGER) * 12"
+            f" + CAST(strftime('%m', {ts}, 'unixepoch') AS INTEGER) - 1)")
+
+def sql_fijado(r):
+    """Expresión SQL del último mes con copias de la regla r (-1 si es virtual).
+
+    Los meses posteriores siguen a la regla: sus excepciones e importes
+    cuentan; los anteriores son las copias ya creadas.
+    """
+    return (f"(CASE WHEN {r}.virtual THEN -1"
+            f" ELSE CAST(substr({r}.materializado_hasta, 1, 4) AS INTEGER) * 12"
+            f" + CAST(substr({r}.materializado_hasta, 6, 2) AS INTEGER) - 1 END)")
+
+# Instante UTC en milisegundos para ordenar cambios de distintos equipos.
+SQL_AHORA_MS = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+
+# Partes de una regla que viajan como cambios propios, con uid
+# sql_uid(uid del origen, parte * PARTE_UID + mes): nunca coincide con el
+# de una copia, cuyo mes es menor que PARTE_UID.
+PARTE_FIN, PARTE_IMPORTE = 1, 2
+PARTE_UID = 1 << 20
+
+def _migracion_sincronizacion(con):
+    # Cada movimiento tiene un uid que es el mismo en todas las copias del
+    # libro y cambios guarda, por uid, el último cambio: cuándo, en qué
+    # equipo (nodo) y si fue un borrado. seq crece con cada cambio, así que
+    # lo que falta por enviar a otro equipo es seq > lo que ya vio (pares).
+    # Los triggers no registran nada con sincronizacion.registrar = 0
+    # (archivar, restaurar o aplicar cambios recibidos).
+    con.execute("ALTER TABLE movimientos ADD COLUMN uid INTEGER")
+    con.execute(f"UPDATE movimientos SET uid = {sql_uid('id', 'creado_en')}")
+    # Las copias de los fijos, como las materializa ahora materializar_fijos
+    # (la primera de cada mes si hubiera varias).
+    con.execute("CREATE TEMP TABLE uid_copias (id INTEGER PRIMARY KEY, uid INTEGER NOT NULL)")
+    con.execute(f"""
+        INSERT INTO uid_copias (id, uid)
+        SELECT id, {sql_uid('base', 'mes')} FROM (
+            SELECT m.id, o.uid AS base, {sql_mes('m.creado_en')} AS mes,
+                   ROW_NUMBER() OVER (PARTITION BY m.regla_id, {sql_mes('m.creado_en')}
+                                      ORDER BY m.creado_en, m.id) AS n
+            FROM movimientos m
+            JOIN reglas_fijas r ON r.id = m.regla_id
+            JOIN movimientos o ON o.id = r.origen_id
+            WHERE m.id != r.origen_id
+        ) WHERE n = 1
+    """)
+    con.execute("""UPDATE movimientos SET uid = (SELECT uid FROM uid_copias c WHERE c.id = movimientos.id)
+                   WHERE id IN (SELECT id FROM uid_copias)""")
+    con.execute("DROP TABLE uid_copias")
+    con.execute("CREATE UNIQUE INDEX idx_mov_uid ON movimientos (uid)")
+    con.execute("""
+        CREATE TABLE sincronizacion (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            nodo INTEGER NOT NULL,
+            registrar INTEGER NOT NULL
+        )
+    """)
+    con.execute("INSERT INTO sincronizacion (id, nodo, registrar) VALUES (1, random() | 1, 1)")
+    con.execute("""
+        CREATE TABLE cambios (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            uid INTEGER NOT NULL UNIQUE,
+            hecho_ms INTEGER NOT NULL,
+            nodo INTEGER NOT NULL,
+            borrado INTEGER NOT NULL
+        )
+    """)
+    con.execute("""
+        CREATE TABLE pares (
+            nodo INTEGER PRIMARY KEY,
+            recibido INTEGER NOT NULL,       -- seq del otro nodo hasta el que se aplicó
+            sincronizado_en INTEGER NOT NULL
+        )
+    """)
+    # Lo que ya había cuenta como hecho aquí antes de cualquier otro cambio.
+    con.execute("""INSERT INTO cambios (uid, hecho_ms, nodo, borrado)
+                   SELECT uid, 0, (SELECT nodo FROM sincronizacion), 0 FROM movimientos ORDER BY id""")
+    cambio = """INSERT OR REPLACE INTO cambios (uid, hecho_ms, nodo, borrado)
+                VALUES ({f}.uid, {ahora}, (SELECT nodo FROM sincronizacion), {borrado});"""
+    for nombre, evento, fila, borrado in (
+            ("trg_cambios_ins", "INSERT", "NEW", 0),
+            ("trg_cambios_upd", "UPDATE OF concepto, periodicidad, tipo, cantidad, creado_en", "NEW", 0),
+            ("trg_cambios_del", "DELETE", "OLD", 1)):
+        con.execute(f"""
+            CREATE TRIGGER {nombre} AFTER {evento} ON movimientos
+            WHEN (SELECT registrar FROM sincronizacion) BEGIN
+                {cambio.format(f=fila, ahora=SQL_AHORA_MS, borrado=borrado)}
+            END
+        """)
+
+# Esquema de una partición; {} es el nombre con que está adjuntada.
+SQL_ESQUEMA_PARTICION = (
+    """CREATE TABLE IF NOT EXISTS {}.movimientos (
+        id INTEGER PRIMARY KEY,
+        concepto TEXT NOT NULL,
+        periodicidad TEXT NOT NULL,
+        tipo TEXT NOT NULL,
+        cantidad INTEGER NOT NULL,
+        creado_en INTEGER NOT NULL,
+        regla_id INTEGER,
+        huella INTEGER,
+        uid INTEGER
+    )""",
+    "CREATE INDEX IF NOT EXISTS {}.idx_mov_creado ON movimientos (creado_en, id)",
+    "CREATE INDEX IF NOT EXISTS {}.idx_mov_uid ON movimientos (uid)",
+    """CREATE INDEX IF NOT EXISTS {}.idx_mov_tipo_creado
+       ON movimientos (tipo, creado_en, periodicidad, cantidad)""",
+)
+SQL_FTS_PARTICION = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS {}.movimientos_fts USING fts5(
+        concepto, content='movimientos', content_rowid='id',
+        tokenize="unicode61 remove_diacritics 2"
+    )
+"""
+
+def _migracion_sincronizacion_reglas(con):
+    # Los cambios de las reglas también se registran. Una excepción es un
+    # cambio del mes, con el uid de la copia de ese mes (sql_uid del origen y
+    # el mes): haya copia o no, un mes es un solo movimiento para los demás
+    # equipos y gana su último cambio. Solo se registran las de los meses
+    # sin copia, que son las que cuentan. El fin y los importes son cambios
+    # de la regla (PARTE_FIN, PARTE_IMPORTE); sus valores quedan en
+    # cambios_reglas para reenviarlos o aplicarlos cuando llegue la regla.
+    con.execute("""
+        CREATE TABLE cambios_reglas (
+            uid INTEGER PRIMARY KEY,        -- el de cambios
+            regla INTEGER NOT NULL,         -- uid del origen de la regla
+            parte INTEGER NOT NULL,
+            mes INTEGER NOT NULL,           -- desde (importes); 0 en el fin
+            cantidad INTEGER,
+            fin INTEGER,
+            fijado INTEGER NOT NULL         -- sql_fijado en el equipo que lo cambió
+        )
+    """)
+    nodo = "(SELECT nodo FROM sincronizacion)"
+    origen = "FROM reglas_fijas r JOIN movimientos m ON m.id = r.origen_id WHERE r.id = {}"
+    for evento, f, borrado in (("INSERT", "NEW", "NEW.cantidad IS NULL"),
+                               ("UPDATE", "NEW", "NEW.cantidad IS NULL"),
+                               ("DELETE", "OLD", "0")):
+        con.execute(f"""
+            CREATE TRIGGER trg_cambios_excepcion_{evento.lower()} AFTER {evento} ON reglas_excepciones
+            WHEN (SELECT registrar FROM sincronizacion) BEGIN
+                INSERT OR REPLACE INTO cambios (uid, hecho_ms, nodo, borrado)
+                SELECT {sql_uid('m.uid', f'{f}.mes')}, {SQL_AHORA_MS}, {nodo}, {borrado}
+                {origen.format(f'{f}.regla_id')} AND {f}.mes > {sql_fijado('r')};
+            END
+        """)
+    partes = [(f"importe_{evento.lower()}", f"{evento} ON reglas_importes", f"{f}.regla_id", PARTE_IMPORTE,
+               f"{f}.desde", "NULL" if f == "OLD" else "NEW.cantidad", "NULL", int(f == "OLD"))
+              for evento, f in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD"))]
+    partes.append(("fin", "UPDATE OF fin ON reglas_fijas", "NEW.id", PARTE_FIN, "0", "NULL", "NEW.fin", 0))
+    for nombre, evento, regla, parte, mes, cantidad, fin, borrado in partes:
+        uid = sql_uid("m.uid", f"{parte} * {PARTE_UID} + {mes}")
+        con.execute(f"""
+            CREATE TRIGGER trg_cambios_{nombre} AFTER {evento}
+            WHEN (SELECT registrar FROM sincronizacion) BEGIN
+                INSERT OR REPLACE INTO cambios (uid, hecho_ms, nodo, borrado)
+                SELECT {uid}, {SQL_AHORA_MS}, {nodo}, {borrado} {origen.format(regla)};
+                INSERT OR REPLACE INTO cambios_reglas (uid, regla, parte, mes, cantidad, fin, fijado)
+                SELECT {uid}, m.uid, {parte}, {mes}, {cantidad}, {fin}, {sql_fijado('r')} {origen.format(regla)};
+            END
+        """)
+    # Lo que ya había, como en _migracion_sincronizacion: hecho aquí antes que nada.
+    con.execute(f"""
+        INSERT OR IGNORE INTO cambios (uid, hecho_ms, nodo, borrado)
+        SELECT {sql_uid('m.uid', 'e.mes')}, 0, {nodo}, e.cantidad IS NULL
+        FROM reglas_excepciones e JOIN reglas_fijas r ON r.id = e.regla_id
+        JOIN movimientos m ON m.id = r.origen_id WHERE e.mes > {sql_fijado('r')}
+    """)
+    for parte, mes, cantidad, fin, tabla in (
+            (PARTE_IMPORTE, "i.desde", "i.cantidad", "NULL", "reglas_importes i JOIN reglas_fijas r ON r.id = i.regla_id"),
+            (PARTE_FIN, "0", "NULL", "r.fin", "reglas_fijas r")):
+        uid = sql_uid("m.uid", f"{parte} * {PARTE_UID} + {mes}")
+        filas = f"FROM {tabla} JOIN movimientos m ON m.id = r.origen_id"
+        if parte == PARTE_FIN:
+            filas += " WHERE r.fin IS NOT NULL"
+        con.execute(f"INSERT OR IGNORE INTO cambios (uid, hecho_ms, nodo, borrado) SELECT {uid}, 0, {nodo}, 0 {filas}")
+        con.execute(f"""INSERT OR IGNORE INTO cambios_reglas (uid, regla, parte, mes, cantidad, fin, fijado)
+                        SELECT {uid}, m.uid, {parte}, {mes}, {cantidad}, {fin}, {sql_fijado('r')} {filas}""")
+
+MIGRACIONES = [
+    _migracion_esquema_inicial,
+    _migracion_indices,
+    _migracion_reglas_fijas,
+    _migracion_totales,
+    _migracion_enteros,
+    _migracion_busqueda,
+    _migracion_huellas,
+    _migracion_saldos,
+    _migracion_recurrencia,
+    _migracion_particiones,
+    _migracion_mantenimiento,
+    _migracion_sincronizacion,
+    _migracion_sincronizacion_reglas,
+]
@@ -0,0 +1,163 @@
+"""Expansión mensual de los movimientos fijos (reglas_fijas)."""
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from itertools import accumulate
+
+from .conversions import ts_to_dt, dt_to_ts, _mes_siguiente, _month_clamp_day
+
+# importes: [(desde_mes, cantidad)] ordenados; excepciones: {mes: (cantidad, creado_en)}.
+# Los meses son año*12 + mes - 1.
+Regla = namedtuple("Regla", "id origen_id concepto tipo cantidad inicio fin virtual importes excepciones")
+
+# Los movimientos virtuales llevan un id negativo que codifica regla y mes.
+_MESES_ID = 1 << 16
+
+
+def mes_de(ts: int) -> int:
+    dt = ts_to_dt(ts)
+    return dt.year * 12 + dt.month - 1
+
+def id_virtual(regla_id: int, mes: int) -> int:
+    return -(regla_id * _MESES_ID + mes)
+
+def regla_y_mes(mid: int):
+    """(regla_id, mes) de un id virtual."""
+    return divmod(-mid, _MESES_ID)
+
+
+def ocurrencias_mensuales(inicio: int, desde, hasta):
+    """Fechas (ts) de la regla que empezó en `inicio` para los meses (y, m) de desde a hasta.
+
+    Cada copia conserva el día y la hora del original; si el mes es más corto
+    cae en su último día.
+    """
+    dt0 = ts_to_dt(inicio)
+    y, m = desde
+    while (y, m) <= hasta:
+        dia = _month_clamp_day(y, m, dt0.day)
+        yield dt_to_ts(datetime(y, m, dia, dt0.hour, dt0.minute, dt0.second))
+        y, m = _mes_siguiente(y, m)
+
+
+def ocurrencias_regla(regla, desde: int, hasta: int):
+    """(mes, ts, cantidad) de la regla en los meses desde..hasta, sin el de su origen.
+
+    Respeta el fin de la regla, sus cambios de cantidad y los meses saltados
+    o cambiados en reglas_excepciones.
+    """
+    primero = mes_de(regla.inicio) + 1
+    desde = max(desde, primero)
+    if desde > hasta:
+        return
+    cantidad = regla.cantidad
+    importes = iter(regla.importes)
+    cambio = next(importes, None)
+    (y0, m0), (y1, m1) = divmod(desde, 12), divmod(hasta, 12)
+    for mes, ts in enumerate(ocurrencias_mensuales(regla.inicio, (y0, m0 + 1), (y1, m1 + 1)), desde):
+        if regla.fin is not None and ts > regla.fin:
+            return
+        while cambio is not None and cambio[0] <= mes:
+            cantidad = cambio[1]
+            cambio = next(importes, None)
+        excepcion = regla.excepciones.get(mes)
+        if excepcion is None:
+            yield mes, ts, cantidad
+        elif excepcion[0] is not None:
+            yield mes, excepcion[1] or ts, excepcion[0]
+
+
+def proyeccion_fijos_anual(reglas, target_year: int):
+    """Suma por mes de `target_year` de las reglas (cantidad, inicio) vigentes ese mes."""
+    fixed = [0]*12
+    for cantidad, ts in reglas:
+        dt0 = ts_to_dt(ts)
+        if dt0.year > target_year:
+            continue
+
+        start_month = dt0.month if dt0.year == target_year else 1
+        for m in range(start_month, 13):
+            fixed[m-1] += cantidad
+    return fixed
+
+
+def proyeccion_reglas_anual(reglas, target_year: int):
+    """Como proyeccion_fijos_anual, pero con fin, cambios de cantidad y excepciones.
+
+    El mes de origen de cada regla cuenta con su cantidad inicial.
+    """
+    fixed = [0]*12
+    enero = target_year * 12
+    for regla in reglas:
+        origen = mes_de(regla.inicio)
+        if regla.fin is None and not regla.importes and not regla.excepciones:
+            # Lo habitual: la misma cantidad todos los meses desde el de origen.
+            for mes in range(max(origen, enero), enero + 12):
+                fixed[mes - enero] += regla.cantidad
+            continue
+        if enero <= origen < enero + 12:
+            fixed[origen - enero] += regla.cantidad
+        for mes, _, cantidad in ocurrencias_regla(regla, enero, enero + 11):
+            fixed[mes - enero] += cantidad
+    return fixed
+
+
+class ExpansionVirtual:
+    """Movimientos de las reglas virtuales hasta un mes, calculados en memoria.
+
+    filas tiene el formato de Repositorio.SQL_COLUMNAS (id, concepto,
+    periodicidad, tipo, cantidad, creado_en), ordenado por (creado_en, id),
+    con ids negativos (id_virtual). Los totales por día, mes y año y el saldo
+    acumulado se calculan una vez al crearla.
+    """
+
+    def __init__(self, reglas, hasta_mes: int):
+        self.reglas = {r.id: r for r in reglas if r.virtual}
+        filas = []
+        for regla in self.reglas.values():
+            for mes, ts, cantidad in ocurrencias_regla(regla, 0, hasta_mes):
+                filas.append((id_virtual(regla.id, mes), regla.concepto, "Fijo", regla.tipo, cantidad, ts))
+        filas.sort(key=lambda f: (f[5], f[0]))
+        self.filas = filas
+        self.por_id = {f[0]: f for f in filas}
+        self.claves = [(f[5], f[0]) for f in filas]
+        self.tss = [f[5] for f in filas]
+        self.acumulado = list(accumulate(f[4] if f[3] == "Entrada" else -f[4] for f in filas))
+        self.por_dia = defaultdict(int)
+        self.por_mes = defaultdict(int)
+        for _, _, _, tipo, cantidad, ts in filas:
+            dt = ts_to_dt(ts)
+            self.por_dia[ts // 86400, tipo] += cantidad
+            self.por_mes[dt.year, dt.month, tipo] += cantidad
+        self.dias = sorted({dia for dia, _ in self.por_dia})
+
+    def __bool__(self):
+        return bool(self.filas)
+
+    @property
+    def neto(self):
+        """Entradas menos gastos de todos los movimientos virtuales."""
+        return self.acumulado[-1] if self.acumulado else 0
+
+    def neto_hasta(self, ts: int):
+        """Entradas menos gastos virtuales hasta ts, inclusive."""
+        i = bisect_right(self.tss, ts)
+        return self.acumulado[i - 1] if i else 0
+
+    def totales_diarios(self, desde: int, hasta: int):
+        i, j = bisect_left(self.dias, desde), bisect_right(self.dias, hasta)
+        return [(dia, tipo, self.por_dia[dia, tipo]) for dia in self.dias[i:j]
+                for tipo in ("Entrada", "Gasto") if (dia, tipo) in self.por_dia]
+
+    def totales_mensuales_rango(self, desde, hasta):
+        return sorted((y, m, tipo, total) for (y, m, tipo), total in self.por_mes.items()
+                      if desde <= (y, m) <= hasta)
+
+    def totales_anuales(self):
+        por_anio = defaultdict(int)
+        for (y, _, tipo), total in self.por_mes.items():
+            por_anio[y, tipo] += total
+        return [(y, tipo, total) for (y, tipo), total in por_anio.items()]
+
+    def fila(self, mid: int):
+        return self.por_id.get(mid)
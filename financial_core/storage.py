@@ -0,0 +1,1556 @@
+"""Acceso a la base de datos de movimientos."""
+import heapq
+import os
+import queue
+import re
+import sqlite3
+import threading
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import chain, islice
+from operator import itemgetter
+from datetime import datetime
+
+from .conversions import ts_to_dt, dt_to_ts, ts_now, parse_date_only
+from .instrumentation import METRICAS, ConexionMedida, medido
+from .migrations import (FACTOR_UID, MIGRACIONES, PARTE_FIN, SQL_ESQUEMA_PARTICION,
+                         SQL_FTS_PARTICION, SQL_SALDOS_DESDE, sql_uid)
+from .recurrence import (ExpansionVirtual, Regla, mes_de, ocurrencias_regla,
+                         proyeccion_reglas_anual, regla_y_mes)
+
+DB_PATH = "movimientos.db"
+
+def consulta_fts(texto: str) -> str:
+    """Convierte lo escrito en el buscador en una consulta FTS5 por prefijos.
+
+    Cada palabra debe aparecer (AND) como inicio de alguna palabra del concepto.
+    """
+    palabras = re.findall(r"\w+", texto)
+    return " ".join('"' + p.replace('"', '""') + '"*' for p in palabras)
+
+def _fijado(virtual, materializado_hasta):
+    """Último mes con copias de una regla (-1 si es virtual), como migrations.sql_fijado."""
+    if virtual:
+        return -1
+    return int(materializado_hasta[:4]) * 12 + int(materializado_hasta[5:7]) - 1
+
+def _clave_listado(fila):
+    return (fila[5], fila[0])
+
+def _con_virtuales(filas, virtuales):
+    """Suma a las filas (clave..., total) de un agregado las de los movimientos virtuales."""
+    if not virtuales:
+        return filas
+    suma = defaultdict(int)
+    for *clave, total in chain(filas, virtuales):
+        suma[tuple(clave)] += total
+    return [(*clave, total) for clave, total in sorted(suma.items())]
+
+
+class Repositorio:
+    """Operaciones sobre movimientos usando una conexión concreta.
+
+    Storage es el repositorio del hilo de Tk; los hilos en segundo plano
+    reciben uno ligado a una conexión prestada por Storage.
+    """
+
+    SQL_COLUMNAS = "SELECT id, concepto, periodicidad, tipo, cantidad, creado_en FROM movimientos"
+    SQL_COLUMNAS_DE = "SELECT id, concepto, periodicidad, tipo, cantidad, creado_en FROM {}.movimientos"
+    SQL_INSERT = """
+        INSERT INTO movimientos (concepto, periodicidad, tipo, cantidad, creado_en, uid)
+        VALUES (?, ?, ?, ?, ?, random())
+    """
+    SQL_UPDATE = """
+        UPDATE movimientos
+        SET concepto=?, periodicidad=?, tipo=?, cantidad=?, creado_en=?
+        WHERE id=?
+    """
+    SQL_DELETE = "DELETE FROM movimientos WHERE id=?"
+    # La copia de cada mes (?6) tiene un uid derivado del de su origen y del
+    # mes: si dos equipos la materializan por separado, es el mismo movimiento.
+    # No se vuelve a crear si ya existe o si se borró (también en otro equipo).
+    SQL_INSERT_FIJO = f"""
+        INSERT OR IGNORE INTO movimientos (concepto, periodicidad, tipo, cantidad, creado_en, regla_id, uid)
+        SELECT ?1, 'Fijo', ?2, ?3, ?4, ?5, n.uid
+        FROM (SELECT COALESCE({sql_uid('o', '?6')}, random()) AS uid
+              FROM (SELECT (SELECT m.uid FROM reglas_fijas r JOIN movimientos m ON m.id = r.origen_id
+                            WHERE r.id = ?5) AS o)) n
+        WHERE NOT EXISTS (SELECT 1 FROM cambios WHERE uid = n.uid AND borrado)
+    """
+    SQL_INSERT_IMPORTADO = """
+        INSERT INTO movimientos (concepto, periodicidad, tipo, cantidad, creado_en, huella, uid)
+        SELECT ?1, ?2, ?3, ?4, ?5, ?6, random()
+        WHERE ?6 IS NULL OR (NOT EXISTS (SELECT 1 FROM movimientos WHERE huella = ?6)
+                             AND NOT EXISTS (SELECT 1 FROM huellas_archivadas WHERE huella = ?6))
+    """
+    SQL_REGLAS_PENDIENTES = "virtual=0 AND materializado_hasta < ?"
+    # Último cambio de cada movimiento con sus datos actuales y el uid del
+    # origen de su regla, o de cada parte de una regla con sus valores (ver
+    # _migracion_sincronizacion_reglas). Los cambios sin fila en main son
+    # borrados, meses sin copia o archivados; cambios_desde los resuelve.
+    # Los movimientos archivados antes de registrar cambios entran al volver
+    # como si fueran de antes de cualquier cambio (como en la migración).
+    SQL_CAMBIOS_PREVIOS = """
+        INSERT OR IGNORE INTO cambios (uid, hecho_ms, nodo, borrado)
+        SELECT uid, 0, (SELECT nodo FROM sincronizacion), 0 FROM {}.movimientos
+    """
+    SQL_CAMBIOS = """
+        SELECT c.uid, c.hecho_ms, c.nodo, c.borrado,
+               m.concepto, m.periodicidad, m.tipo, COALESCE(m.cantidad, p.cantidad),
+               COALESCE(m.creado_en, p.fin), COALESCE(o.uid, p.regla), p.parte, p.mes, p.fijado
+        FROM cambios c
+        LEFT JOIN movimientos m ON m.uid = c.uid
+        LEFT JOIN reglas_fijas r ON r.id = m.regla_id
+        LEFT JOIN movimientos o ON o.id = r.origen_id
+        LEFT JOIN cambios_reglas p ON p.uid = c.uid
+        WHERE c.seq > ? AND c.seq <= ? AND {}
+        ORDER BY c.seq
+    """
+    SQL_BALANCE = "SELECT total FROM saldo"
+    SQL_NETO_MESES = """
+        SELECT COALESCE(SUM(
+            CASE WHEN tipo='Entrada' THEN total
+                 WHEN tipo='Gasto'   THEN -total
+                 ELSE 0 END
+        ), 0)
+        FROM monthly_totals WHERE (anio, mes) BETWEEN (?1 / 12, ?1 % 12 + 1) AND (?2 / 12, ?2 % 12 + 1)
+    """
+
+    def __init__(self, con, fts=False, avisar=None, virtuales=None):
+        self.con = con
+        self.fts = fts
+        self.avisar = avisar
+        # Caché de la expansión de las reglas virtuales; Storage comparte la suya.
+        self._virtuales = {} if virtuales is None else virtuales
+
+    @contextmanager
+    def _escritura(self, cambiados=(), eliminados=()):
+        """Transacción de escritura; al confirmarse avisa de que los datos cambiaron.
+
+        avisar recibe los ids modificados y borrados; las filas nuevas no se
+        listan porque siempre tienen un id mayor que las anteriores.
+        """
+        with self.con:
+            yield
+            self._reparar_saldos()
+        if self.avisar is not None:
+            self.avisar(cambiados, eliminados)
+
+    def save_movement(self, concepto, periodicidad, tipo, cantidad, creado_en=None):
+        """Guarda un movimiento; cantidad en céntimos y creado_en en segundos Unix."""
+        if not creado_en:
+            creado_en = ts_now()
+        with self._escritura():
+            cur = self.con.execute(self.SQL_INSERT,
+                                   (concepto, periodicidad, tipo, int(cantidad), int(creado_en)))
+            rowid = cur.lastrowid
+            if periodicidad == "Fijo":
+                self._crear_regla(rowid, concepto, tipo, cantidad, creado_en)
+        return rowid, creado_en
+
+    @medido("importar_movimientos")
+    def importar_movimientos(self, filas, lote=5000, progreso=None):
+        """Inserta (concepto, periodicidad, tipo, cantidad, creado_en, huella) en una transacción.
+
+        Las filas cuya huella ya está en la tabla se saltan. Se insertan por
+        lotes de `lote` filas con executemany y, tras cada lote, se llama a
+        progreso(leídas, insertadas). Las filas se guardan tal cual: los fijos
+        importados no crean reglas, porque un histórico ya trae sus copias.
+        Devuelve (leídas, insertadas).
+        """
+        leidas = insertadas = 0
+        filas = iter(filas)
+        with self._escritura():
+            while True:
+                bloque = list(islice(filas, lote))
+                if not bloque:
+                    break
+                # En orden de fecha los índices por creado_en se tocan de forma secuencial.
+                bloque.sort(key=itemgetter(4))
+                cur = self.con.executemany(self.SQL_INSERT_IMPORTADO, bloque)
+                leidas += len(bloque)
+                insertadas += cur.rowcount
+                if progreso is not None:
+                    progreso(leidas, insertadas)
+        return leidas, insertadas
+
+    def cargar_movimientos(self):
+        filtros = ("Todos", "", "", "")
+        filas = list(self._filas(filtros, descendente=False))
+        virtuales = self._virtuales_de(filtros)
+        if virtuales:
+            filas = list(heapq.merge(filas, virtuales, key=_clave_listado))
+        return filas
+
+    @staticmethod
+    def _limites_fecha(desde: str, hasta: str):
+        """(primer ts, último ts) de los filtros dd/mm/aaaa; None si falta o no se entiende."""
+        limites = []
+        for texto, extra in ((desde, 0), (hasta, 86399)):
+            try:
+                limites.append(parse_date_only(texto.strip()) + extra if texto.strip() else None)
+            except ValueError:
+                limites.append(None)
+        return limites
+
+    def _filtros_sql(self, tipo: str, concepto: str, desde: str, hasta: str, esquema="main"):
+        where = []
+        params = []
+
+        if tipo != "Todos":
+            where.append("tipo = ?")
+            params.append(tipo)
+
+        if concepto.strip():
+            consulta = consulta_fts(concepto) if self.fts else ""
+            if consulta:
+                where.append(f"id IN (SELECT rowid FROM {esquema}.movimientos_fts WHERE movimientos_fts MATCH ?)")
+                params.append(consulta)
+            else:
+                where.append("LOWER(concepto) LIKE ?")
+                params.append(f"%{concepto.strip().lower()}%")
+
+        d, h = self._limites_fecha(desde, hasta)
+        if d is not None:
+            where.append("creado_en >= ?")
+            params.append(d)
+        if h is not None:
+            where.append("creado_en <= ?")
+            params.append(h)
+
+        return where, params
+
+    def _virtuales_de(self, filtros):
+        """Movimientos virtuales que cumplen los filtros, en orden (creado_en, id) ascendente.
+
+        Tipo y concepto se comprueban con la misma consulta sobre el
+        movimiento de origen de cada regla, así la búsqueda se comporta igual.
+        """
+        expansion = self.expansion_virtual()
+        if not expansion:
+            return []
+        anterior = self._virtuales.get("filtradas")
+        if anterior is not None and anterior[0] is expansion and anterior[1] == filtros:
+            return anterior[2]
+        tipo, concepto, desde, hasta = filtros
+        reglas = set(expansion.reglas)
+        if tipo != "Todos" or concepto.strip():
+            where, params = self._filtros_sql(tipo, concepto, "", "")
+            origenes = {r.origen_id: r.id for r in expansion.reglas.values()}
+            sql = "SELECT id FROM movimientos WHERE id IN ({}) AND " + " AND ".join(where)
+            reglas = {origenes[o] for (o,) in self._en_trozos(sql, list(origenes), params)}
+        d, h = self._limites_fecha(desde, hasta)
+        i = 0 if d is None else bisect_left(expansion.tss, d)
+        j = len(expansion.tss) if h is None else bisect_right(expansion.tss, h)
+        filas = [f for f in expansion.filas[i:j] if regla_y_mes(f[0])[0] in reglas]
+        self._virtuales["filtradas"] = (expansion, filtros, filas)
+        return filas
+
+    def _filas(self, filtros, descendente=True, where=(), params=(), limite=None, offset=0):
+        """Movimientos filtrados de la tabla y de las particiones, en orden (creado_en, id).
+
+        where y params se añaden a los filtros. Solo se consultan las
+        particiones de los años que se solapan con las fechas del filtro, y
+        cada una cuando el recorrido llega a ella. Sin particiones devuelve el
+        cursor de la consulta.
+        """
+        orden = "DESC" if descendente else "ASC"
+
+        def consulta(esquema, limite, offset=0, con=self.con):
+            w, p = self._filtros_sql(*filtros, esquema=esquema)
+            w += where
+            p += params
+            sql = self.SQL_COLUMNAS_DE.format(esquema)
+            if w:
+                sql += " WHERE " + " AND ".join(w)
+            sql += f" ORDER BY creado_en {orden}, id {orden}"
+            if limite is not None:
+                sql += " LIMIT ? OFFSET ?"
+                p += [limite, offset]
+            return con.execute(sql, p)
+
+        def archivadas(anio, tope):
+            with self.particion(anio) as (con, esquema):
+                yield from consulta(esquema, tope, con=con)
+
+        offset = max(offset, 0)
+        anios = self.particiones(*self._limites_fecha(*filtros[2:]))
+        if anios and offset and descendente:
+            anios, where, params, offset = self._saltar_anios(filtros, anios, where, params, offset)
+        if not anios:
+            return consulta("main", limite, offset)
+        tope = None if limite is None else limite + offset
+        # La tabla principal se lee entera (es la pequeña): con su cursor
+        # abierto las particiones ya recorridas no se podrían soltar.
+        principal = consulta("main", tope).fetchall()
+        recientes = []
+        if descendente and limite is not None and offset > len(principal):
+            # offset cae en la partición más reciente que queda: se lee desde
+            # ahí con OFFSET, dejando sitio a las filas de la tabla principal
+            # que puedan ir delante, y se cuentan las que van antes.
+            base = offset - len(principal)
+            with self.particion(anios[-1]) as (con, esquema):
+                recientes = consulta(esquema, limite + len(principal), base, con=con).fetchall()
+            if recientes:
+                clave = _clave_listado(recientes[0])
+                delante = sum(1 for f in principal if _clave_listado(f) > clave)
+                principal = principal[delante:]
+                offset -= base + delante
+                anios = anios[:-1]
+        otras = chain(recientes, chain.from_iterable(archivadas(anio, tope) for anio in
+                                                     (anios[::-1] if descendente else anios)))
+        filas = heapq.merge(principal, otras, key=_clave_listado, reverse=descendente)
+        return islice(filas, offset, None if limite is None else offset + limite)
+
+    def _saltar_anios(self, filtros, anios, where, params, offset):
+        """Quita del principio de un listado descendente los años archivados que offset salta enteros.
+
+        Se cuentan en vez de recorrerlos. Devuelve los años, where, params y
+        offset que quedan.
+        """
+        corte, delante, archivados = None, 0, 0
+        for i in range(len(anios) - 1, -1, -1):
+            inicio = dt_to_ts(datetime(anios[i], 1, 1))
+            with self.particion(anios[i]) as (con, esquema):
+                archivados += self._contar(con, esquema, filtros, where, params)
+            total = archivados + self._contar(self.con, "main", filtros, [*where, "creado_en >= ?"],
+                                              [*params, inicio])
+            if total > offset:
+                break
+            corte, delante, anios = inicio, total, anios[:i]
+        if corte is None:
+            return anios, where, params, offset
+        return anios, [*where, "creado_en < ?"], [*params, corte], offset - delante
+
+    def _contar(self, con, esquema, filtros, where=(), params=()):
+        w, p = self._filtros_sql(*filtros, esquema=esquema)
+        sql = f"SELECT COUNT(*) FROM {esquema}.movimientos"
+        if w or where:
+            sql += " WHERE " + " AND ".join([*w, *where])
+        return con.execute(sql, [*p, *params]).fetchone()[0]
+
+    def cargar_movimientos_filtrados(self, tipo: str, concepto: str, desde: str, hasta: str):
+        filas = list(self._filas((tipo, concepto, desde, hasta)))
+        virtuales = self._virtuales_de((tipo, concepto, desde, hasta))
+        if virtuales:
+            filas = list(heapq.merge(filas, virtuales[::-1], key=_clave_listado, reverse=True))
+        return filas
+
+    def iterar_movimientos(self, filtros, descendente=False, limite=None, tam=5000):
+        """Movimientos filtrados en lotes de `tam` filas, sin cargar el resultado entero.
+
+        Recorre un único cursor con fetchmany; si se quiere que un recuento
+        previo cuadre con lo recorrido, hay que hacerlo dentro de instantanea().
+        Los movimientos virtuales se intercalan en su sitio.
+        """
+        virtuales = self._virtuales_de(filtros)
+        filas = self._filas(filtros, descendente, limite=limite)
+        if virtuales:
+            if isinstance(filas, sqlite3.Cursor):
+                cur = filas
+                filas = chain.from_iterable(iter(lambda: cur.fetchmany(tam), []))
+            filas = heapq.merge(filas, virtuales[::-1] if descendente else virtuales,
+                                key=_clave_listado, reverse=descendente)
+            filas = islice(filas, limite)
+        if isinstance(filas, sqlite3.Cursor):
+            siguiente = lambda: filas.fetchmany(tam)
+        else:
+            siguiente = lambda: list(islice(filas, tam))
+        while True:
+            lote = siguiente()
+            if not lote:
+                return
+            yield lote
+
+    @contextmanager
+    def instantanea(self):
+        """Transacción de lectura: todas las consultas dentro ven los mismos datos."""
+        self.con.execute("BEGIN")
+        try:
+            yield
+        finally:
+            self.con.execute("COMMIT")
+
+    def contar_movimientos(self, filtros):
+        n = self._contar(self.con, "main", filtros) + len(self._virtuales_de(filtros))
+        for anio in self.particiones(*self._limites_fecha(*filtros[2:])):
+            with self.particion(anio) as (con, esquema):
+                n += self._contar(con, esquema, filtros)
+        return n
+
+    def pagina_movimientos(self, filtros, limite, despues=None, antes=None, offset=0):
+        """Ventana del listado (creado_en DESC, id DESC) con paginación keyset.
+
+        despues/antes son claves (creado_en, id): se devuelven las filas que
+        siguen o preceden a esa clave en el orden del listado. Sin clave se
+        usa offset, que solo hace falta al saltar con la barra de desplazamiento.
+        """
+        virtuales = self._virtuales_de(filtros)
+        if not virtuales:
+            return self._pagina_sql(filtros, limite, despues, antes, offset)
+        claves = [_clave_listado(f) for f in virtuales]
+        if despues is None and antes is None:
+            despues = self._clave_en(filtros, claves, offset)
+            if despues is None:
+                antes = (-2**63, -2**63)
+        if antes is not None:
+            i = bisect_right(claves, tuple(antes))
+            otras = virtuales[i:i + limite][::-1]
+            filas = list(heapq.merge(self._pagina_sql(filtros, limite, antes=antes), otras,
+                                     key=_clave_listado, reverse=True))
+            return filas[-limite:]
+        i = bisect_left(claves, tuple(despues))
+        otras = virtuales[max(0, i - limite):i][::-1]
+        filas = heapq.merge(self._pagina_sql(filtros, limite, despues=despues), otras,
+                            key=_clave_listado, reverse=True)
+        return list(islice(filas, limite))
+
+    def _clave_en(self, filtros, claves, offset):
+        """Clave justo por encima de la fila `offset` del listado con virtuales (None: pasado el final).
+
+        Una fila j de la tabla cae en la posición j más los virtuales más
+        recientes que ella, que crece con j: se busca por bisección la última
+        que no pasa de offset. Si no cae justo ahí, la fila es virtual y su
+        sitio sale de cuántas filas de la tabla tiene delante.
+        """
+        if offset <= 0:
+            return (2**63 - 1, 2**63 - 1)
+        n = len(claves)
+
+        def fila_sql(j):
+            pagina = self._pagina_sql(filtros, 1, offset=j)
+            return pagina[0] if pagina else None
+
+        def posicion(j, fila):
+            return j + n - bisect_right(claves, _clave_listado(fila))
+
+        # Con más de n filas de la tabla delante, la fila offset - n - 1 seguro que no pasa.
+        bajo, fila_bajo, alto = -1, None, offset + 1
+        if offset - n - 1 >= 0:
+            bajo = offset - n - 1
+            fila_bajo = fila_sql(bajo)
+            if fila_bajo is None:
+                return None
+        while alto - bajo > 1:
+            medio = (bajo + alto) // 2
+            fila = fila_sql(medio)
+            if fila is not None and posicion(medio, fila) <= offset:
+                bajo, fila_bajo = medio, fila
+            else:
+                alto = medio
+        if fila_bajo is not None and posicion(bajo, fila_bajo) == offset:
+            clave = _clave_listado(fila_bajo)
+        else:
+            virtual = offset - bajo - 1     # entre los virtuales, contando desde el más reciente
+            if virtual >= n:
+                return None
+            clave = claves[n - 1 - virtual]
+        return (clave[0], clave[1] + 1)
+
+    def _pagina_sql(self, filtros, limite, despues=None, antes=None, offset=0):
+        where, params = [], []
+        descendente = True
+        if despues is not None:
+            where.append("(creado_en, id) < (?, ?)")
+            params.extend(despues)
+        elif antes is not None:
+            where.append("(creado_en, id) > (?, ?)")
+            params.extend(antes)
+            descendente = False
+
+        filas = list(self._filas(filtros, descendente, where, params, limite, offset))
+        return filas if descendente else filas[::-1]
+
+    def cumple_filtros(self, mid: int, filtros):
+        if mid < 0:
+            return any(f[0] == mid for f in self._virtuales_de(filtros))
+        where, params = self._filtros_sql(*filtros)
+        sql = "SELECT 1 FROM movimientos WHERE " + " AND ".join(["id = ?"] + where)
+        if self.con.execute(sql, [mid] + params).fetchone() is not None:
+            return True
+        if self.con.execute("SELECT 1 FROM movimientos WHERE id=?", (mid,)).fetchone():
+            return False
+        return self._archivado(mid, filtros) is not None
+
+    def obtener_movimiento_por_id(self, mid: int):
+        if mid < 0:
+            return self.expansion_virtual().fila(mid)
+        fila = self.con.execute(self.SQL_COLUMNAS + " WHERE id=?", (mid,)).fetchone()
+        if fila is None:
+            archivado = self._archivado(mid)
+            if archivado is not None:
+                fila = archivado[1]
+        return fila
+
+    def actualizar_movimiento(self, mid: int, concepto: str, periodicidad: str, tipo: str, cantidad: int, creado_en: int):
+        if mid < 0:
+            with self._escritura(cambiados=(mid,)):
+                self._cambiar_virtual(mid, concepto, periodicidad, tipo, int(cantidad), int(creado_en))
+            return
+        with self._escritura(cambiados=(mid,)):
+            self._comprobar_no_archivados([mid])
+            self.con.execute(self.SQL_UPDATE,
+                             (concepto, periodicidad, tipo, int(cantidad), int(creado_en), mid))
+            regla = self.con.execute("SELECT id FROM reglas_fijas WHERE origen_id=?", (mid,)).fetchone()
+            if regla and periodicidad == "Fijo":
+                # Los meses futuros usarán la plantilla editada.
+                self.con.execute("""UPDATE reglas_fijas SET concepto=?, tipo=?, cantidad=?, inicio=?
+                                    WHERE id=?""",
+                                 (concepto, tipo, int(cantidad), int(creado_en), regla[0]))
+            elif regla:
+                self.con.execute("DELETE FROM reglas_fijas WHERE id=?", regla)
+                self.con.execute("UPDATE movimientos SET regla_id=NULL WHERE regla_id=?", regla)
+            if periodicidad != "Fijo":
+                self.con.execute("UPDATE movimientos SET regla_id=NULL WHERE id=?", (mid,))
+            elif regla is None:
+                (regla_id,) = self.con.execute("SELECT regla_id FROM movimientos WHERE id=?", (mid,)).fetchone()
+                if regla_id is None:
+                    self._crear_regla(mid, concepto, tipo, cantidad, creado_en)
+
+    def actualizar_movimientos(self, ids, concepto=None, periodicidad=None, tipo=None, desplazar=0):
+        """Cambia a la vez los movimientos ids en una sola transacción.
+
+        concepto, periodicidad y tipo sustituyen el valor de cada fila (None
+        lo deja como está) y desplazar suma esos segundos a su fecha. Las
+        reglas de los fijos siguen a sus movimientos de origen igual que en
+        actualizar_movimiento. De los movimientos virtuales solo se puede
+        desplazar la fecha. Devuelve cuántas filas se cambiaron.
+        """
+        ids = [int(i) for i in ids]
+        virtuales = [i for i in ids if i < 0]
+        ids = [i for i in ids if i >= 0]
+        cambios, valores = [], []
+        for columna, valor in (("concepto", concepto), ("periodicidad", periodicidad), ("tipo", tipo)):
+            if valor is not None:
+                cambios.append(f"{columna}=?")
+                valores.append(valor)
+        if desplazar:
+            cambios.append("creado_en=creado_en+?")
+            valores.append(int(desplazar))
+        if not cambios:
+            return 0
+        # Solo se nombran las columnas que cambian: los triggers de totales,
+        # saldos y FTS no se disparan por las demás.
+        sql = f"UPDATE movimientos SET {', '.join(cambios)} WHERE id=?"
+        n = 0
+        with self._escritura(cambiados=ids + virtuales):
+            self._comprobar_no_archivados(ids)
+            expansion = self.expansion_virtual() if virtuales else None
+            for mid in virtuales:
+                fila = expansion.fila(mid)
+                if fila is not None:
+                    self._cambiar_virtual(mid, concepto, periodicidad, tipo, fila[4], fila[5] + int(desplazar))
+                    n += 1
+            if ids:
+                n += self.con.executemany(sql, [(*valores, i) for i in ids]).rowcount
+                reglas = self._en_trozos("SELECT id FROM reglas_fijas WHERE origen_id IN ({})", ids)
+                if periodicidad is not None and periodicidad != "Fijo":
+                    self.con.executemany("DELETE FROM reglas_fijas WHERE id=?", reglas)
+                    self.con.executemany("UPDATE movimientos SET regla_id=NULL WHERE regla_id=?", reglas)
+                    self.con.executemany("UPDATE movimientos SET regla_id=NULL WHERE id=?", [(i,) for i in ids])
+                else:
+                    # Los meses futuros usarán las plantillas editadas.
+                    self.con.executemany("""
+                        UPDATE reglas_fijas SET (concepto, tipo, cantidad, inicio) =
+                            (SELECT concepto, tipo, cantidad, creado_en FROM movimientos WHERE id = origen_id)
+                        WHERE id=?
+                    """, reglas)
+                if periodicidad == "Fijo":
+                    for fila in self._en_trozos("""SELECT id, concepto, tipo, cantidad, creado_en FROM movimientos
+                                                   WHERE regla_id IS NULL AND id IN ({})""", ids):
+                        self._crear_regla(*fila)
+        return n
+
+    def _cambiar_virtual(self, mid, concepto, periodicidad, tipo, cantidad, creado_en):
+        """Guarda como excepción de su mes la nueva cantidad o fecha de un movimiento virtual."""
+        regla_id, mes = regla_y_mes(mid)
+        regla = self.expansion_virtual().reglas.get(regla_id)
+        if regla is None:
+            raise ValueError("El fijo virtual ya no existe")
+        if (concepto not in (None, regla.concepto) or periodicidad not in (None, "Fijo")
+                or tipo not in (None, regla.tipo)):
+            raise ValueError("Los meses de un fijo virtual solo pueden cambiar de cantidad o de fecha;"
+                             " para lo demás edita su movimiento de origen")
+        self.con.execute("INSERT OR REPLACE INTO reglas_excepciones VALUES (?, ?, ?, ?)",
+                         (regla_id, mes, cantidad, creado_en))
+
+    def eliminar_movimiento(self, mid: int):
+        self.eliminar_movimientos((mid,))
+
+    def eliminar_movimientos(self, ids):
+        """Borra los movimientos ids en una sola transacción y devuelve cuántos había.
+
+        Borrar un movimiento virtual salta ese mes de su regla.
+        """
+        ids = [int(i) for i in ids]
+        if not ids:
+            return 0
+        with self._escritura(eliminados=ids):
+            self._comprobar_no_archivados([i for i in ids if i >= 0])
+            cur = self.con.executemany(self.SQL_DELETE, [(i,) for i in ids if i >= 0])
+            saltos = [regla_y_mes(i) for i in ids if i < 0]
+            self.con.executemany("INSERT OR REPLACE INTO reglas_excepciones VALUES (?, ?, NULL, NULL)", saltos)
+            self._reglas_sin_origen()
+        return cur.rowcount + len(saltos)
+
+    def _reglas_sin_origen(self):
+        """Tras borrar movimientos: la regla de un origen borrado sigue viva mientras quede alguna de sus copias."""
+        huerfanas = self.con.execute("""
+            SELECT id FROM reglas_fijas r
+            WHERE NOT EXISTS (SELECT 1 FROM movimientos WHERE id = r.origen_id)
+        """).fetchall()
+        for regla in huerfanas:
+            sucesor = self.con.execute("""SELECT id FROM movimientos WHERE regla_id=?
+                                          ORDER BY creado_en, id LIMIT 1""", regla).fetchone()
+            if sucesor:
+                self.con.execute("UPDATE reglas_fijas SET origen_id=? WHERE id=?", (sucesor[0], regla[0]))
+            else:
+                self.con.execute("DELETE FROM reglas_fijas WHERE id=?", regla)
+
+    def _en_trozos(self, sql, ids, params=(), tam=500):
+        """Filas de sql con su «IN ({})» rellenado por trozos de ids (límite de parámetros).
+
+        params van detrás de los ids de cada trozo.
+        """
+        filas = []
+        for i in range(0, len(ids), tam):
+            trozo = ids[i:i + tam]
+            filas += self.con.execute(sql.format(",".join("?" * len(trozo))), [*trozo, *params]).fetchall()
+        return filas
+
+    def _crear_regla(self, mid, concepto, tipo, cantidad, creado_en):
+        cur = self.con.execute("""
+            INSERT INTO reglas_fijas (origen_id, concepto, tipo, cantidad, inicio, materializado_hasta, virtual)
+            VALUES (?, ?, ?, ?, ?, ?, (SELECT virtual FROM recurrencia))
+        """, (mid, concepto, tipo, int(cantidad), int(creado_en), ts_to_dt(creado_en).strftime("%Y-%m")))
+        self.con.execute("UPDATE movimientos SET regla_id=? WHERE id=?", (cur.lastrowid, mid))
+
+    def calcular_balance(self):
+        (balance,) = self.con.execute(self.SQL_BALANCE).fetchone()
+        return balance + self.expansion_virtual().neto
+
+    def monthly_fixed_projection_for_year(self, target_year: int):
+        reglas, _ = self.recurrencia()
+        return proyeccion_reglas_anual([r for r in reglas if r.tipo == "Gasto"], target_year)
+
+    # -- reglas de los fijos -------------------------------------------------
+
+    def reglas(self, where="1", params=()):
+        """Reglas (recurrence.Regla) de reglas_fijas que cumplen where, con importes y excepciones."""
+        filas = self.con.execute(f"""
+            SELECT id, origen_id, concepto, tipo, cantidad, inicio, fin, virtual
+            FROM reglas_fijas WHERE {where} ORDER BY id
+        """, params).fetchall()
+        if not filas:
+            return []
+        importes = defaultdict(list)
+        for regla_id, desde, cantidad in self.con.execute(
+                "SELECT regla_id, desde, cantidad FROM reglas_importes ORDER BY regla_id, desde"):
+            importes[regla_id].append((desde, cantidad))
+        excepciones = defaultdict(dict)
+        for regla_id, mes, cantidad, creado_en in self.con.execute(
+                "SELECT regla_id, mes, cantidad, creado_en FROM reglas_excepciones"):
+            excepciones[regla_id][mes] = (cantidad, creado_en)
+        return [Regla(*f, importes.get(f[0], []), excepciones.get(f[0], {})) for f in filas]
+
+    def expansion_virtual(self):
+        """ExpansionVirtual de las reglas virtuales hasta el mes actual."""
+        return self.recurrencia()[1]
+
+    def recurrencia(self):
+        """(todas las reglas, ExpansionVirtual); se recalculan solo si cambian las reglas o el mes."""
+        (version,) = self.con.execute("SELECT version FROM recurrencia").fetchone()
+        clave = (version, mes_de(ts_now()))
+        actual = self._virtuales.get("expansion")
+        if actual is None or actual[0] != clave:
+            reglas = self.reglas()
+            actual = self._virtuales["expansion"] = (clave, reglas, ExpansionVirtual(reglas, clave[1]))
+        return actual[1:]
+
+    def modo_fijos(self, virtual: bool):
+        """Pasa todas las reglas, y las que se creen después, a virtuales o a copias.
+
+        A virtuales se borran las copias ya creadas: si una faltaba o se había
+        cambiado de cantidad o fecha queda como excepción de su mes, y si ya no
+        corresponde a ningún mes de la regla se conserva como movimiento
+        suelto. A copias se vuelven a materializar desde el mes de origen.
+        Devuelve cuántas reglas cambiaron de modo.
+        """
+        borradas = []
+        # Las copias que se borran al pasar a virtuales no son borrados para
+        # los otros equipos: allí siguen siendo los meses de la regla.
+        with self._escritura(eliminados=borradas), self._sin_registro():
+            self.con.execute("UPDATE recurrencia SET virtual=?", (int(virtual),))
+            reglas = self.reglas("virtual=?", (int(not virtual),))
+            if not virtual:
+                self.con.execute("""UPDATE reglas_fijas SET virtual=0,
+                                    materializado_hasta=strftime('%Y-%m', inicio, 'unixepoch')
+                                    WHERE virtual=1""")
+            else:
+                marcas = dict(self.con.execute("SELECT id, materializado_hasta FROM reglas_fijas WHERE virtual=0"))
+                excepciones, sueltas = [], []
+                for regla in reglas:
+                    por_mes = {}
+                    for mid, concepto, tipo, cantidad, ts in self.con.execute("""
+                        SELECT id, concepto, tipo, cantidad, creado_en FROM movimientos
+                        WHERE regla_id=? AND id!=? ORDER BY creado_en, id
+                    """, (regla.id, regla.origen_id)):
+                        if (concepto, tipo) != (regla.concepto, regla.tipo) or mes_de(ts) in por_mes:
+                            sueltas.append((mid,))
+                        else:
+                            por_mes[mes_de(ts)] = (mid, cantidad, ts)
+                    hasta = marcas[regla.id]
+                    for mes, ts, cantidad in ocurrencias_regla(regla, 0, int(hasta[:4]) * 12 + int(hasta[5:7]) - 1):
+                        copia = por_mes.pop(mes, None)
+                        if copia is None:
+                            excepciones.append((regla.id, mes, None, None))
+                        else:
+                            borradas.append(copia[0])
+                            if copia[1:] != (cantidad, ts):
+                                excepciones.append((regla.id, mes, copia[1], copia[2]))
+                    sueltas += [(copia[0],) for copia in por_mes.values()]
+                self.con.executemany(self.SQL_DELETE, [(mid,) for mid in borradas])
+                self.con.executemany("UPDATE movimientos SET regla_id=NULL WHERE id=?", sueltas)
+                self.con.executemany("INSERT OR REPLACE INTO reglas_excepciones VALUES (?, ?, ?, ?)",
+                                     excepciones)
+                self.con.execute("UPDATE reglas_fijas SET virtual=1 WHERE virtual=0")
+        if not virtual:
+            self.materializar_fijos()
+        return len(reglas)
+
+    def _comprobar_regla(self, regla_id):
+        if not self.con.execute("SELECT 1 FROM reglas_fijas WHERE id=?", (regla_id,)).fetchone():
+            raise ValueError(f"No existe la regla {regla_id}")
+
+    def terminar_regla(self, regla_id: int, fin):
+        """Último instante (ts) en que la regla tiene movimientos; None la deja sin fin.
+
+        Las copias ya materializadas después de fin no se borran.
+        """
+        with self._escritura():
+            self._comprobar_regla(regla_id)
+            self.con.execute("UPDATE reglas_fijas SET fin=? WHERE id=?", (fin, regla_id))
+
+    def cambiar_cantidad_regla(self, regla_id: int, mes, cantidad):
+        """Cantidad (céntimos) de la regla desde el mes (y, m); None quita ese cambio."""
+        clave = (regla_id, mes[0] * 12 + mes[1] - 1)
+        with self._escritura():
+            self._comprobar_regla(regla_id)
+            if cantidad is None:
+                self.con.execute("DELETE FROM reglas_importes WHERE regla_id=? AND desde=?", clave)
+            else:
+                self.con.execute("INSERT OR REPLACE INTO reglas_importes VALUES (?, ?, ?)",
+                                 (*clave, int(cantidad)))
+
+    def excepcion_regla(self, regla_id: int, mes, cantidad=None, creado_en=None, saltar=False):
+        """Cambia solo el mes (y, m) de una regla: otra cantidad o fecha, o saltarlo.
+
+        Sin cantidad ni fecha (y sin saltar) quita la excepción del mes. En los
+        fijos con copias solo afecta a los meses que aún no se han materializado.
+        """
+        clave = (regla_id, mes[0] * 12 + mes[1] - 1)
+        with self._escritura():
+            self._comprobar_regla(regla_id)
+            if saltar:
+                self.con.execute("INSERT OR REPLACE INTO reglas_excepciones VALUES (?, ?, NULL, NULL)", clave)
+            elif cantidad is None and creado_en is None:
+                self.con.execute("DELETE FROM reglas_excepciones WHERE regla_id=? AND mes=?", clave)
+            else:
+                if cantidad is None:
+                    regla = self.reglas("id=?", (regla_id,))
+                    cantidad = next((c for d, c in reversed(regla[0].importes) if d <= clave[1]),
+                                    regla[0].cantidad)
+                self.con.execute("INSERT OR REPLACE INTO reglas_excepciones VALUES (?, ?, ?, ?)",
+                                 (*clave, int(cantidad), creado_en))
+
+    def monthly_variable_expense_series(self):
+        rows = self.con.execute("""
+            SELECT anio, mes, SUM(total) FROM monthly_totals
+            WHERE tipo='Gasto' AND periodicidad!='Fijo'
+            GROUP BY anio, mes ORDER BY anio, mes
+        """).fetchall()
+
+        keys = [(y, m) for y, m, _ in rows]
+        values = [v for _, _, v in rows]
+        return keys, values
+
+    def series_gasto_variable_por_concepto(self):
+        """Meses de monthly_variable_expense_series y {concepto: gasto variable de cada mes}."""
+        keys, _ = self.monthly_variable_expense_series()
+        posicion = {k: i for i, k in enumerate(keys)}
+        series = {}
+        sql = """
+            SELECT concepto, CAST(strftime('%Y', creado_en, 'unixepoch') AS INTEGER),
+                   CAST(strftime('%m', creado_en, 'unixepoch') AS INTEGER), SUM(cantidad)
+            FROM {}.movimientos WHERE tipo='Gasto' AND periodicidad!='Fijo'
+            GROUP BY 1, 2, 3
+        """
+        filas = self.con.execute(sql.format("main")).fetchall()
+        for anio in self.particiones():
+            with self.particion(anio) as (con, esquema):
+                filas += con.execute(sql.format(esquema)).fetchall()
+        for concepto, y, m, total in filas:
+            serie = series.get(concepto)
+            if serie is None:
+                serie = series[concepto] = [0] * len(keys)
+            serie[posicion[(y, m)]] += total
+        return keys, series
+
+    def totales_diarios(self, desde: int, hasta: int):
+        """Entradas y gastos por día (días desde 1970) entre desde y hasta, inclusive."""
+        filas = self.con.execute("""
+            SELECT dia, tipo, SUM(total) FROM daily_totals
+            WHERE dia BETWEEN ? AND ? GROUP BY dia, tipo
+        """, (desde, hasta)).fetchall()
+        return _con_virtuales(filas, self.expansion_virtual().totales_diarios(desde, hasta))
+
+    def _reparar_saldos(self):
+        """Rehace los cierres de saldos_mensuales desde el primer mes desfasado."""
+        (desde,) = self.con.execute("SELECT pendiente_desde FROM saldo").fetchone()
+        if desde is None:
+            return
+        base = self._cierre_guardado(desde - 1)
+        self.con.execute("DELETE FROM saldos_mensuales WHERE mes >= ?", (desde,))
+        self.con.execute(SQL_SALDOS_DESDE, (desde, base))
+        self.con.execute("UPDATE saldo SET pendiente_desde = NULL")
+
+    def saldo_cierre(self, mes: int):
+        """Balance al final del mes (año*12 + mes - 1), movimientos de ese mes incluidos."""
+        y, m = divmod(mes + 1, 12)
+        return self._cierre_guardado(mes) + self.expansion_virtual().neto_hasta(dt_to_ts(datetime(y, m + 1, 1)) - 1)
+
+    def _cierre_guardado(self, mes: int):
+        """Saldo al final del mes de los movimientos de la tabla, sin los virtuales.
+
+        Es el último cierre guardado hasta ese mes; si una escritura sin
+        confirmar o hecha por fuera de Repositorio los dejó desfasados, se
+        suman los meses afectados desde monthly_totals.
+        """
+        (pendiente,) = self.con.execute("SELECT pendiente_desde FROM saldo").fetchone()
+        tope = mes if pendiente is None else min(mes, pendiente - 1)
+        fila = self.con.execute("""
+            SELECT saldo FROM saldos_mensuales WHERE mes <= ? ORDER BY mes DESC LIMIT 1
+        """, (tope,)).fetchone()
+        saldo = fila[0] if fila else 0
+        if tope < mes:
+            (neto,) = self.con.execute(self.SQL_NETO_MESES, (tope + 1, mes)).fetchone()
+            saldo += neto
+        return saldo
+
+    def balance_en(self, ts: int):
+        """Balance en el instante ts (segundos Unix), con los movimientos de ese segundo.
+
+        Cierre del mes anterior más los días ya pasados del mes y los
+        movimientos del propio día hasta ts.
+        """
+        dia = ts // 86400
+        fecha = ts_to_dt(dia * 86400)
+        primer_dia = dia - fecha.day + 1
+        saldo = self._cierre_guardado(fecha.year * 12 + fecha.month - 2)
+        (dias, hoy) = self.con.execute("""
+            SELECT
+              (SELECT COALESCE(SUM(CASE WHEN tipo='Entrada' THEN total WHEN tipo='Gasto' THEN -total ELSE 0 END), 0)
+               FROM daily_totals WHERE dia >= ? AND dia < ?),
+              (SELECT COALESCE(SUM(CASE WHEN tipo='Entrada' THEN cantidad WHEN tipo='Gasto' THEN -cantidad ELSE 0 END), 0)
+               FROM movimientos WHERE creado_en BETWEEN ? AND ?)
+        """, (primer_dia, dia, dia * 86400, ts)).fetchone()
+        for anio in self.particiones(dia * 86400, ts):
+            with self.particion(anio) as (con, esquema):
+                (archivados,) = con.execute(f"""
+                    SELECT COALESCE(SUM(CASE WHEN tipo='Entrada' THEN cantidad WHEN tipo='Gasto' THEN -cantidad ELSE 0 END), 0)
+                    FROM {esquema}.movimientos WHERE creado_en BETWEEN ? AND ?
+                """, (dia * 86400, ts)).fetchone()
+            hoy += archivados
+        return saldo + dias + hoy + self.expansion_virtual().neto_hasta(ts)
+
+    def saldo_antes_de(self, dia: int):
+        """Balance de los movimientos anteriores al día dado (días desde 1970)."""
+        return self.balance_en(dia * 86400 - 1)
+
+    def rango_dias(self):
+        """(primer, último) día con movimientos, o None si no hay ninguno."""
+        primero, ultimo = self.con.execute("SELECT MIN(dia), MAX(dia) FROM daily_totals").fetchone()
+        dias = self.expansion_virtual().dias
+        if dias:
+            primero = dias[0] if primero is None else min(primero, dias[0])
+            ultimo = dias[-1] if ultimo is None else max(ultimo, dias[-1])
+        return None if primero is None else (primero, ultimo)
+
+    def totales_mensuales(self, anio: int):
+        filas = self.con.execute("""
+            SELECT mes, tipo, SUM(total) FROM monthly_totals
+            WHERE anio=? GROUP BY mes, tipo
+        """, (anio,)).fetchall()
+        virtuales = self.expansion_virtual().totales_mensuales_rango((anio, 1), (anio, 12))
+        return _con_virtuales(filas, [(m, tipo, total) for _, m, tipo, total in virtuales])
+
+    def totales_mensuales_rango(self, desde, hasta):
+        """(anio, mes, tipo, total) de los meses (y, m) entre desde y hasta, inclusive."""
+        filas = self.con.execute("""
+            SELECT anio, mes, tipo, SUM(total) FROM monthly_totals
+            WHERE (anio, mes) BETWEEN (?, ?) AND (?, ?)
+            GROUP BY anio, mes, tipo ORDER BY anio, mes
+        """, (*desde, *hasta)).fetchall()
+        return _con_virtuales(filas, self.expansion_virtual().totales_mensuales_rango(desde, hasta))
+
+    def totales_anuales(self):
+        filas = self.con.execute("""
+            SELECT anio, tipo, SUM(total) FROM monthly_totals GROUP BY anio, tipo
+        """).fetchall()
+        return _con_virtuales(filas, self.expansion_virtual().totales_anuales())
+
+    @medido("materializar_fijos")
+    def materializar_fijos(self):
+        """Crea las copias mensuales de los fijos desde su marca hasta el mes actual.
+
+        Las reglas virtuales no tienen copias: sus meses se calculan al consultar.
+        """
+        hoy = datetime.now()
+        mes_actual = f"{hoy.year:04d}-{hoy.month:02d}"
+        marcas = dict(self.con.execute("SELECT id, materializado_hasta FROM reglas_fijas WHERE "
+                                       + self.SQL_REGLAS_PENDIENTES, (mes_actual,)).fetchall())
+        if not marcas:
+            return 0
+
+        nuevos = []
+        for regla in self.reglas(self.SQL_REGLAS_PENDIENTES, (mes_actual,)):
+            hasta = marcas[regla.id]
+            desde = int(hasta[:4]) * 12 + int(hasta[5:7])
+            for mes, ts, cantidad in ocurrencias_regla(regla, desde, hoy.year * 12 + hoy.month - 1):
+                nuevos.append((regla.concepto, regla.tipo, cantidad, ts, regla.id, mes))
+        marcas = [(mes_actual, rid) for rid in marcas]
+
+        with self._escritura():
+            n = self.con.executemany(self.SQL_INSERT_FIJO, nuevos).rowcount
+            self.con.executemany("UPDATE reglas_fijas SET materializado_hasta=? WHERE id=?", marcas)
+        return n
+
+    # -- particiones por año -------------------------------------------------
+
+    def particiones(self, desde=None, hasta=None):
+        """Años archivados, en orden, que se solapan con los ts desde..hasta (None: sin límite)."""
+        return [anio for (anio,) in self.con.execute(
+            "SELECT anio FROM particiones WHERE anio BETWEEN ? AND ? ORDER BY anio",
+            (-1 if desde is None else ts_to_dt(desde).year,
+             9999 if hasta is None else ts_to_dt(hasta).year))]
+
+    def resumen_particiones(self):
+        """(año, filas) de cada año archivado."""
+        return self.con.execute("SELECT anio, filas FROM particiones ORDER BY anio").fetchall()
+
+    def ruta_particion(self, anio: int):
+        """movimientos.db -> movimientos.<anio>.db, junto a la base de datos."""
+        ruta = next(f for _, nombre, f in self.con.execute("PRAGMA database_list") if nombre == "main")
+        if not ruta:
+            raise ValueError("Una base de datos en memoria no se puede archivar por años")
+        base, extension = os.path.splitext(ruta)
+        return f"{base}.{anio}{extension or '.db'}"
+
+    @contextmanager
+    def particion(self, anio: int):
+        """(conexión, esquema) con que leer la partición del año.
+
+        Normalmente es esta conexión, con la partición adjunta. Si SQLite no
+        deja adjuntar más bases porque todas están en uso en una transacción
+        abierta (instantanea() recorriendo muchos años), se lee con una
+        conexión propia de solo lectura: las particiones no cambian, así que
+        se ve lo mismo.
+        """
+        esquema = self._adjuntar(anio)
+        if esquema is not None:
+            yield self.con, esquema
+            return
+        con = sqlite3.connect(self.ruta_particion(anio), check_same_thread=False)
+        try:
+            con.execute("PRAGMA query_only=1")
+            yield con, "main"
+        finally:
+            con.close()
+
+    def _adjuntar(self, anio: int):
+        """Adjunta a la conexión la partición del año si no lo estaba; devuelve su esquema.
+
+        SQLite limita cuántas bases hay adjuntas a la vez (10 por defecto): al
+        llegar al límite se sueltan primero las adjuntadas antes que no estén
+        en uso en una transacción abierta. Si no se puede soltar ninguna
+        devuelve None.
+        """
+        esquema = f"p{anio}"
+        adjuntas = [nombre for _, nombre, _ in self.con.execute("PRAGMA database_list")
+                    if nombre not in ("main", "temp")]
+        if esquema in adjuntas:
+            return esquema
+        try:
+            limite = self.con.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        except AttributeError:   # Python < 3.11
+            limite = 10
+        sobran = len(adjuntas) + 1 - limite
+        for otra in adjuntas:
+            if sobran <= 0:
+                break
+            try:
+                self.con.execute(f"DETACH DATABASE {otra}")
+                sobran -= 1
+            except sqlite3.OperationalError:
+                pass
+        if sobran > 0:
+            return None
+        self.con.execute(f"ATTACH DATABASE ? AS {esquema}", (self.ruta_particion(anio),))
+        return esquema
+
+    def _archivado(self, mid: int, filtros=("Todos", "", "", "")):
+        """(año, fila) del movimiento mid si está en una partición y cumple los filtros; si no, None."""
+        for anio in self.particiones(*self._limites_fecha(*filtros[2:])):
+            with self.particion(anio) as (con, esquema):
+                where, params = self._filtros_sql(*filtros, esquema=esquema)
+                sql = self.SQL_COLUMNAS_DE.format(esquema) + " WHERE " + " AND ".join(["id = ?"] + where)
+                fila = con.execute(sql, [mid] + params).fetchone()
+            if fila is not None:
+                return anio, fila
+        return None
+
+    def _comprobar_no_archivados(self, ids):
+        """ValueError si alguno de los ids está archivado: las particiones son de solo lectura."""
+        if not ids or not self.particiones():
+            return
+        vivos = {i for (i,) in self._en_trozos("SELECT id FROM movimientos WHERE id IN ({})", ids)}
+        for mid in ids:
+            archivado = None if mid in vivos else self._archivado(mid)
+            if archivado is not None:
+                raise ValueError(f"El movimiento {mid} está archivado en {archivado[0]};"
+                                 " restaura ese año para cambiarlo")
+
+    @contextmanager
+    def _totales_intactos(self, anio: int):
+        """Deja monthly_totals, daily_totals y el saldo del año como estaban antes del bloque.
+
+        Al archivar o restaurar, los triggers restan o suman las filas que
+        se mueven, pero los agregados deben seguir contándolas.
+        """
+        dias = (dt_to_ts(datetime(anio, 1, 1)) // 86400, dt_to_ts(datetime(anio + 1, 1, 1)) // 86400 - 1)
+        mensuales = self.con.execute("""SELECT anio, mes, tipo, periodicidad, total, n
+                                        FROM monthly_totals WHERE anio=?""", (anio,)).fetchall()
+        diarios = self.con.execute("""SELECT dia, tipo, periodicidad, total, n
+                                      FROM daily_totals WHERE dia BETWEEN ? AND ?""", dias).fetchall()
+        (total,) = self.con.execute("SELECT total FROM saldo").fetchone()
+        yield
+        self.con.execute("DELETE FROM monthly_totals WHERE anio=?", (anio,))
+        self.con.executemany("INSERT INTO monthly_totals VALUES (?, ?, ?, ?, ?, ?)", mensuales)
+        self.con.execute("DELETE FROM daily_totals WHERE dia BETWEEN ? AND ?", dias)
+        self.con.executemany("INSERT INTO daily_totals VALUES (?, ?, ?, ?, ?)", diarios)
+        self.con.execute("UPDATE saldo SET total=?", (total,))
+
+    def _columna_uid(self, esquema):
+        """Añade los uid a una partición creada antes de que los movimientos los tuvieran."""
+        columnas = {c[1] for c in self.con.execute(f"PRAGMA {esquema}.table_info(movimientos)")}
+        if columnas and "uid" not in columnas:
+            with self.con:
+                self.con.execute(f"ALTER TABLE {esquema}.movimientos ADD COLUMN uid INTEGER")
+                self.con.execute(f"UPDATE {esquema}.movimientos SET uid = {sql_uid('id', 'creado_en')}")
+                self.con.execute(f"CREATE INDEX {esquema}.idx_mov_uid ON movimientos (uid)")
+
+    @medido("archivar")
+    def archivar(self, anio: int):
+        """Mueve los movimientos de un año cerrado a su partición y devuelve cuántos.
+
+        La partición es otra base de datos (movimientos.<anio>.db) que se
+        adjunta cuando una consulta toca ese año; los totales, los saldos y
+        las huellas de importación se quedan en la principal. Los movimientos
+        de origen de las reglas de fijos no se mueven. Un año ya archivado
+        puede volver a archivarse para llevar los movimientos que se hayan
+        añadido después, y si se interrumpe basta con repetirlo.
+        """
+        if anio >= datetime.now().year:
+            raise ValueError(f"{anio} no es un año cerrado")
+        rango = (dt_to_ts(datetime(anio, 1, 1)), dt_to_ts(datetime(anio + 1, 1, 1)) - 1)
+        donde = "creado_en BETWEEN ? AND ? AND id NOT IN (SELECT origen_id FROM reglas_fijas)"
+        registrada = anio in self.particiones()
+        (n,) = self.con.execute(f"SELECT COUNT(*) FROM movimientos WHERE {donde}", rango).fetchone()
+        if n == 0 and not registrada:
+            return 0
+        esquema = self._adjuntar(anio)
+        if esquema is None:
+            raise ValueError("Hay demasiadas particiones adjuntas en uso; inténtalo de nuevo")
+        self._columna_uid(esquema)
+        # Primero se copian a la partición y después se borran de la
+        # principal: en WAL una transacción no es atómica entre dos ficheros.
+        with self.con:
+            for sql in SQL_ESQUEMA_PARTICION + ((SQL_FTS_PARTICION,) if self.fts else ()):
+                self.con.execute(sql.format(esquema))
+            if not registrada:
+                # Restos de una partición restaurada o de un intento a medias.
+                self.con.execute(f"DELETE FROM {esquema}.movimientos")
+            self.con.execute(f"""
+                INSERT OR REPLACE INTO {esquema}.movimientos
+                    (id, concepto, periodicidad, tipo, cantidad, creado_en, regla_id, huella, uid)
+                SELECT id, concepto, periodicidad, tipo, cantidad, creado_en, regla_id, huella, uid
+                FROM main.movimientos WHERE {donde}
+            """, rango)
+            if self.fts:
+                self.con.execute(f"INSERT INTO {esquema}.movimientos_fts (movimientos_fts) VALUES ('rebuild')")
+        with self._escritura(), self._totales_intactos(anio), self._sin_registro():
+            self.con.execute(f"""
+                INSERT OR IGNORE INTO huellas_archivadas
+                SELECT huella FROM {esquema}.movimientos WHERE huella IS NOT NULL
+            """)
+            self.con.execute(f"""
+                DELETE FROM movimientos WHERE {donde}
+                AND id IN (SELECT id FROM {esquema}.movimientos)
+            """, rango)
+            self.con.execute(f"""
+                INSERT OR REPLACE INTO particiones (anio, filas)
+                SELECT ?, COUNT(*) FROM {esquema}.movimientos
+            """, (anio,))
+        return n
+
+    @medido("restaurar_archivado")
+    def restaurar_archivado(self, anio: int):
+        """Devuelve a la base de datos principal los movimientos archivados del año.
+
+        La partición se vacía pero el fichero se queda, porque otras
+        conexiones pueden tenerlo adjunto. Devuelve cuántos movimientos volvieron.
+        """
+        if anio not in self.particiones():
+            raise ValueError(f"El año {anio} no está archivado")
+        esquema = self._adjuntar(anio)
+        if esquema is None:
+            raise ValueError("Hay demasiadas particiones adjuntas en uso; inténtalo de nuevo")
+        self._columna_uid(esquema)
+        with self._escritura(), self._totales_intactos(anio), self._sin_registro():
+            n = self.con.execute(f"""
+                INSERT INTO movimientos (id, concepto, periodicidad, tipo, cantidad, creado_en, regla_id, huella, uid)
+                SELECT id, concepto, periodicidad, tipo, cantidad, creado_en, regla_id, huella, uid
+                FROM {esquema}.movimientos
+            """).rowcount
+            self.con.execute(self.SQL_CAMBIOS_PREVIOS.format(esquema))
+            self.con.execute(f"""
+                DELETE FROM huellas_archivadas
+                WHERE huella IN (SELECT huella FROM {esquema}.movimientos WHERE huella IS NOT NULL)
+            """)
+            self.con.execute("DELETE FROM particiones WHERE anio=?", (anio,))
+        with self.con:
+            self.con.execute(f"DELETE FROM {esquema}.movimientos")
+            if self.fts:
+                self.con.execute(f"INSERT INTO {esquema}.movimientos_fts (movimientos_fts) VALUES ('rebuild')")
+        self.con.execute(f"VACUUM {esquema}")
+        return n
+
+    # -- sincronización entre equipos ----------------------------------------
+
+    def nodo(self):
+        """Identificador de esta base de datos entre las que se sincronizan."""
+        (nodo,) = self.con.execute("SELECT nodo FROM sincronizacion").fetchone()
+        return nodo
+
+    def renovar_nodo(self):
+        """Le da un nodo nuevo: para la copia de un fichero que ya se sincronizaba."""
+        with self.con:
+            self.con.execute("UPDATE sincronizacion SET nodo = random() | 1")
+        return self.nodo()
+
+    def pares(self):
+        """(nodo, recibido, sincronizado_en) de cada equipo del que se han recibido cambios."""
+        return self.con.execute("SELECT nodo, recibido, sincronizado_en FROM pares ORDER BY nodo").fetchall()
+
+    def recibido(self, nodo: int):
+        """seq del nodo hasta el que ya se aplicaron aquí sus cambios (0 si nunca)."""
+        fila = self.con.execute("SELECT recibido FROM pares WHERE nodo=?", (nodo,)).fetchone()
+        return fila[0] if fila else 0
+
+    def cambios_desde(self, desde: int, excluir=None, propios=False):
+        """(hasta, cambios) registrados aquí con seq mayor que desde.
+
+        hasta es el seq del último cambio y cada cambio es (uid, hecho_ms,
+        nodo, borrado, concepto, periodicidad, tipo, cantidad, creado_en,
+        regla, parte, mes, fijado). En un movimiento van sus datos actuales
+        (None si se borró), en regla el uid del origen de su regla de fijos
+        y parte, mes y fijado son None; un mes sin copia va con los datos que
+        le da su regla. En una parte de una regla (parte no None) van su
+        cantidad y en creado_en el fin de la regla. excluir quita los cambios
+        hechos en ese nodo y propios deja solo los hechos aquí.
+        """
+        (hasta,) = self.con.execute("SELECT COALESCE(MAX(seq), 0) FROM cambios").fetchone()
+        condiciones, params = ["1"], [desde, hasta]
+        if excluir is not None:
+            condiciones.append("c.nodo != ?")
+            params.append(excluir)
+        if propios:
+            condiciones.append("c.nodo = (SELECT nodo FROM sincronizacion)")
+        sql = self.SQL_CAMBIOS.format(" AND ".join(condiciones))
+        cambios = []
+        meses = None
+        for cambio in self.con.execute(sql, params):
+            if cambio[3] or cambio[4] is not None or cambio[10] is not None:
+                cambios.append(cambio)
+                continue
+            if meses is None:
+                meses = self._meses_sin_copia()
+            if cambio[0] not in meses:
+                continue        # archivado, o de una regla que ya no existe
+            regla, mes, base = meses[cambio[0]]
+            ocurrencia = next(ocurrencias_regla(regla, mes, mes), None)
+            if ocurrencia is None:
+                cambios.append((*cambio[:3], 1) + (None,) * 9)
+            else:
+                _, ts, cantidad = ocurrencia
+                cambios.append((*cambio[:4], regla.concepto, "Fijo", regla.tipo, cantidad, ts, base,
+                                None, None, None))
+        return hasta, cambios
+
+    @contextmanager
+    def _sin_registro(self):
+        """Los cambios del bloque no pasan a la tabla cambios (archivar, restaurar, lo recibido).
+
+        Siempre dentro de una transacción: otra conexión nunca ve el registro apagado.
+        """
+        self.con.execute("UPDATE sincronizacion SET registrar=0")
+        yield
+        self.con.execute("UPDATE sincronizacion SET registrar=1")
+
+    @medido("aplicar_cambios")
+    def aplicar_cambios(self, cambios, de=None, hasta=None):
+        """Aplica en una transacción cambios de otro equipo, como los da cambios_desde.
+
+        De cada movimiento o parte de una regla gana el cambio más reciente
+        (hecho_ms y, si empatan, el nodo mayor); los demás se ignoran. El
+        origen de un fijo crea aquí su regla. Un mes que aquí no tiene copia
+        (regla virtual o aún sin materializar) queda como excepción de ese
+        mes. Un movimiento archivado que cambia vuelve antes a la base de
+        datos principal. Con de y hasta se anota que ya se aplicó hasta ese
+        seq del nodo de. Devuelve (aplicados, ignorados).
+        """
+        # Primero los orígenes de los fijos, para que sus copias encuentren la
+        # regla, y al final las partes de las reglas, con sus meses ya al día.
+        cambios = sorted(cambios, key=lambda c: (c[10] is not None, c[9] != c[0]))
+        nuevos = [c for c in cambios if self._gana(*c[:3])]
+        archivados = self._desarchivar([c for c in nuevos if c[10] is None])
+        meses = None
+        cambiados, eliminados = [], []
+        with self._escritura(cambiados, eliminados), self._sin_registro():
+            for uid, hecho_ms, nodo, borrado, *datos, regla, parte, mes, fijado in nuevos:
+                if parte is not None:
+                    self._aplicar_parte(regla, parte, mes, None if borrado else datos[3:], fijado,
+                                        cambiados, eliminados)
+                    self.con.execute("INSERT OR REPLACE INTO cambios_reglas VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     (uid, regla, parte, mes, *datos[3:], fijado))
+                    self._registrar(uid, hecho_ms, nodo, borrado)
+                    continue
+                fila = self.con.execute(self.SQL_COLUMNAS + " WHERE uid=?", (uid,)).fetchone()
+                if fila is None and regla != uid:
+                    if meses is None:
+                        meses = self._meses_sin_copia(pasados=False)
+                    sin_copia = meses.get(uid)
+                else:
+                    sin_copia = None
+                if sin_copia is not None:
+                    self._excepcion_recibida(*sin_copia[:2], None if borrado else datos)
+                elif borrado:
+                    if fila is not None:
+                        self.con.execute(self.SQL_DELETE, (fila[0],))
+                        eliminados.append(fila[0])
+                elif uid not in archivados:     # los archivados sin cambios se quedan donde están
+                    self._aplicar_fila(fila, uid, datos, regla, cambiados)
+                self._registrar(uid, hecho_ms, nodo, borrado)
+            if eliminados:
+                self._reglas_sin_origen()
+            if de is not None:
+                self.con.execute("""
+                    INSERT INTO pares (nodo, recibido, sincronizado_en) VALUES (?, ?, ?)
+                    ON CONFLICT (nodo) DO UPDATE SET recibido = MAX(recibido, excluded.recibido),
+                                                     sincronizado_en = excluded.sincronizado_en
+                """, (de, hasta, ts_now()))
+        return len(nuevos), len(cambios) - len(nuevos)
+
+    def _registrar(self, uid, hecho_ms, nodo, borrado):
+        self.con.execute("INSERT OR REPLACE INTO cambios (uid, hecho_ms, nodo, borrado) VALUES (?, ?, ?, ?)",
+                         (uid, hecho_ms, nodo, borrado))
+
+    def _gana(self, uid, hecho_ms, nodo):
+        """True si el cambio (hecho_ms, nodo) de uid es posterior al último que se conoce aquí."""
+        actual = self.con.execute("SELECT hecho_ms, nodo FROM cambios WHERE uid=?", (uid,)).fetchone()
+        return actual is None or actual < (hecho_ms, nodo)
+
+    def _desarchivar(self, cambios):
+        """Devuelve a la principal los movimientos archivados que cambian en cambios.
+
+        Las particiones no se editan: el movimiento vuelve con los totales
+        intactos, como al restaurar, y el cambio se le aplica aquí; al volver
+        a archivar su año se mueve otra vez. Los archivados que llegan sin
+        cambios de contenido se quedan donde están; devuelve sus uid.
+        """
+        anios = self.particiones()
+        pendientes = {c[0]: c for c in cambios
+                      if anios and not self.con.execute("SELECT 1 FROM movimientos WHERE uid=?", (c[0],)).fetchone()}
+        iguales = set()
+        for anio in anios:
+            if not pendientes:
+                break
+            esquema = self._adjuntar(anio)
+            if esquema is None:
+                raise ValueError("Hay demasiadas particiones adjuntas en uso; inténtalo de nuevo")
+            self._columna_uid(esquema)
+            filas = []
+            for fila in self._en_trozos(f"""SELECT id, concepto, periodicidad, tipo, cantidad, creado_en,
+                                                   regla_id, huella, uid
+                                            FROM {esquema}.movimientos WHERE uid IN ({{}})""", list(pendientes)):
+                cambio = pendientes.pop(fila[8])
+                if not cambio[3] and tuple(cambio[4:9]) == tuple(fila[1:6]):
+                    iguales.add(fila[8])
+                else:
+                    filas.append(fila)
+            if not filas:
+                continue
+            with self._escritura(), self._totales_intactos(anio), self._sin_registro():
+                self.con.executemany("""
+                    INSERT INTO movimientos (id, concepto, periodicidad, tipo, cantidad, creado_en, regla_id, huella, uid)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, filas)
+                self.con.executemany("DELETE FROM huellas_archivadas WHERE huella=?",
+                                     [(f[7],) for f in filas if f[7] is not None])
+                self.con.executemany("""INSERT OR IGNORE INTO cambios (uid, hecho_ms, nodo, borrado)
+                                        VALUES (?, 0, (SELECT nodo FROM sincronizacion), 0)""",
+                                     [(f[8],) for f in filas])
+            with self.con:
+                self.con.executemany(f"DELETE FROM {esquema}.movimientos WHERE uid=?", [(f[8],) for f in filas])
+                if self.fts:
+                    self.con.execute(f"INSERT INTO {esquema}.movimientos_fts (movimientos_fts) VALUES ('rebuild')")
+                self.con.execute(f"UPDATE particiones SET filas = (SELECT COUNT(*) FROM {esquema}.movimientos)"
+                                 " WHERE anio=?", (anio,))
+        return iguales
+
+    def _reglas_con_origen(self):
+        """(Regla, uid de su origen, último mes con copias o -1) de cada regla."""
+        reglas = {r.id: r for r in self.reglas()}
+        return [(reglas[rid], base, _fijado(virtual, hasta)) for rid, base, virtual, hasta in self.con.execute("""
+            SELECT r.id, m.uid, r.virtual, r.materializado_hasta
+            FROM reglas_fijas r JOIN movimientos m ON m.id = r.origen_id
+        """)]
+
+    def _meses_sin_copia(self, pasados=True, adelante=120):
+        """{uid de la copia del mes: (Regla, mes, uid del origen)} de los meses que aquí no tienen copia.
+
+        Son los de las reglas virtuales y los aún sin materializar, hasta
+        `adelante` meses después del actual (ver SQL_INSERT_FIJO). Sin
+        pasados, de las reglas con copias solo los posteriores al mes actual:
+        los demás se pueden materializar ya.
+        """
+        actual = mes_de(ts_now())
+        meses = {}
+        for regla, base, fijado in self._reglas_con_origen():
+            if not pasados and fijado >= 0:
+                fijado = max(fijado, actual)
+            for mes in range(max(mes_de(regla.inicio), fijado) + 1, actual + adelante + 1):
+                meses[base ^ (mes * FACTOR_UID)] = regla, mes, base
+        return meses
+
+    def _excepcion_recibida(self, regla, mes, datos):
+        """Guarda como excepción del mes la copia recibida de un mes sin copia aquí (None: se borró)."""
+        if datos is None:
+            self.con.execute("INSERT OR REPLACE INTO reglas_excepciones VALUES (?, ?, NULL, NULL)", (regla.id, mes))
+            return
+        cantidad, creado_en = int(datos[3]), int(datos[4])
+        prevista = next(ocurrencias_regla(regla._replace(excepciones={}), mes, mes), None)
+        if prevista is not None and prevista[1:] == (creado_en, cantidad):
+            self.con.execute("DELETE FROM reglas_excepciones WHERE regla_id=? AND mes=?", (regla.id, mes))
+        else:
+            self.con.execute("INSERT OR REPLACE INTO reglas_excepciones VALUES (?, ?, ?, ?)",
+                             (regla.id, mes, cantidad, creado_en))
+
+    def _regla_de_origen(self, base):
+        fila = self.con.execute("""SELECT r.id, r.virtual, r.materializado_hasta FROM reglas_fijas r
+                                   JOIN movimientos m ON m.id = r.origen_id WHERE m.uid=?""", (base,)).fetchone()
+        return None if fila is None else (fila[0], _fijado(*fila[1:]))
+
+    def _guardar_parte(self, regla_id, parte, mes, valores):
+        """Pone en la regla el fin o el importe desde mes (valores (cantidad, fin); None lo quita)."""
+        if parte == PARTE_FIN:
+            self.con.execute("UPDATE reglas_fijas SET fin=? WHERE id=?", (valores and valores[1], regla_id))
+        elif valores is None:
+            self.con.execute("DELETE FROM reglas_importes WHERE regla_id=? AND desde=?", (regla_id, mes))
+        else:
+            self.con.execute("INSERT OR REPLACE INTO reglas_importes VALUES (?, ?, ?)",
+                             (regla_id, mes, int(valores[0])))
+
+    def _aplicar_parte(self, base, parte, mes, valores, fijado, cambiados, eliminados):
+        """Aplica el fin o un importe recibido de la regla cuyo origen tiene uid base.
+
+        Si la regla aún no ha llegado se queda en cambios_reglas y se aplica
+        al crearla (_aplicar_fila). Los meses que en un equipo son copias ya
+        creadas no cambian con la regla; cuando aquí y allí no coinciden
+        (fijado es el último mes con copias allí), se igualan: un mes que
+        allí es copia y aquí no queda como estaba con una excepción, y una
+        copia de aquí que allí sigue a la regla cambia con ella si nadie la
+        había tocado.
+        """
+        local = self._regla_de_origen(base)
+        if local is None:
+            return
+        regla_id, fijado_aqui = local
+        (antes,) = self.reglas("id=?", (regla_id,))
+        self._guardar_parte(regla_id, parte, mes, valores)
+        (despues,) = self.reglas("id=?", (regla_id,))
+        ahora = mes_de(ts_now())
+        previstos = {m: (c, ts) for m, ts, c in ocurrencias_regla(antes, 0, ahora)}
+        nuevos = {m: (c, ts) for m, ts, c in ocurrencias_regla(despues, 0, ahora)}
+        for m in sorted(previstos.keys() | nuevos.keys()):
+            previsto, nuevo = previstos.get(m), nuevos.get(m)
+            if previsto == nuevo:
+                continue
+            if fijado_aqui < m <= fijado:
+                if nuevo is None:
+                    # Pasado el fin no hay excepción que valga: la copia queda
+                    # suelta, como en modo_fijos, y con el uid de la de allí.
+                    self.con.execute("""
+                        INSERT OR IGNORE INTO movimientos (concepto, periodicidad, tipo, cantidad, creado_en, uid)
+                        VALUES (?, 'Fijo', ?, ?, ?, ?)
+                    """, (antes.concepto, antes.tipo, *previsto, base ^ (m * FACTOR_UID)))
+                else:
+                    self.con.execute("INSERT OR REPLACE INTO reglas_excepciones VALUES (?, ?, ?, ?)",
+                                     (regla_id, m, *(previsto or (None, None))))
+            elif fijado < m <= fijado_aqui:
+                copia = self.con.execute("SELECT id, cantidad, creado_en FROM movimientos WHERE uid=?",
+                                         (base ^ (m * FACTOR_UID),)).fetchone()
+                if (copia and copia[1:]) != previsto:
+                    continue        # editada o borrada aquí: manda la copia
+                if nuevo is None:
+                    self.con.execute(self.SQL_DELETE, (copia[0],))
+                    eliminados.append(copia[0])
+                elif copia is None:
+                    self.con.execute(self.SQL_INSERT_FIJO,
+                                     (despues.concepto, despues.tipo, nuevo[0], nuevo[1], regla_id, m))
+                else:
+                    self.con.execute("UPDATE movimientos SET cantidad=?, creado_en=? WHERE id=?", (*nuevo, copia[0]))
+                    cambiados.append(copia[0])
+
+    def _aplicar_fila(self, fila, uid, datos, regla, cambiados):
+        """Crea o actualiza el movimiento uid con los datos recibidos."""
+        concepto, periodicidad, tipo, cantidad, creado_en = datos
+        regla_id = None
+        if regla is not None and regla != uid:
+            local = self.con.execute("""SELECT r.id FROM reglas_fijas r
+                                        JOIN movimientos m ON m.id = r.origen_id WHERE m.uid=?""",
+                                     (regla,)).fetchone()
+            regla_id = local[0] if local else None
+        valores = (concepto, periodicidad, tipo, int(cantidad), int(creado_en))
+        if fila is None:
+            mid = self.con.execute("""
+                INSERT INTO movimientos (concepto, periodicidad, tipo, cantidad, creado_en, uid)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (*valores, uid)).lastrowid
+        else:
+            mid = fila[0]
+            if tuple(fila[1:]) != valores:
+                self.con.execute(self.SQL_UPDATE, (*valores, mid))
+                cambiados.append(mid)
+        propia = self.con.execute("SELECT id FROM reglas_fijas WHERE origen_id=?", (mid,)).fetchone()
+        if regla == uid:
+            if propia:
+                self.con.execute("UPDATE reglas_fijas SET concepto=?, tipo=?, cantidad=?, inicio=? WHERE id=?",
+                                 (concepto, tipo, int(cantidad), int(creado_en), propia[0]))
+            else:
+                self._crear_regla(mid, concepto, tipo, cantidad, creado_en)
+                # Las partes de la regla que llegaron antes que ella.
+                regla_id = self.con.execute("SELECT regla_id FROM movimientos WHERE id=?", (mid,)).fetchone()[0]
+                for borrado, parte, mes, *valores in self.con.execute("""
+                    SELECT c.borrado, p.parte, p.mes, p.cantidad, p.fin
+                    FROM cambios_reglas p JOIN cambios c ON c.uid = p.uid WHERE p.regla=?
+                """, (uid,)).fetchall():
+                    self._guardar_parte(regla_id, parte, mes, None if borrado else valores)
+            return
+        if propia:
+            # Aquí era el origen de una regla que en el otro equipo ya no existe.
+            self.con.execute("DELETE FROM reglas_fijas WHERE id=?", propia)
+            self.con.execute("UPDATE movimientos SET regla_id=NULL WHERE regla_id=?", propia)
+        self.con.execute("UPDATE movimientos SET regla_id=? WHERE id=?", (regla_id, mid))
+
+
+class Storage(Repositorio):
+    """Conexión persistente a la base de datos de movimientos.
+
+    Mantiene abierta una conexión de escritura durante toda la vida de la
+    aplicación (hilo de Tk) y un pequeño pool de conexiones de solo lectura
+    para hilos en segundo plano. Todas usan WAL y los mismos pragmas.
+    """
+
+    def __init__(self, path=DB_PATH, lectores=2):
+        self.path = path
+        self.max_lectores = lectores
+        self._lectores = queue.LifoQueue()
+        self._n_lectores = 0
+        self._lock = threading.Lock()
+        self.version = 0
+        self.oyentes = []        # oyente(cambiados, eliminados) tras cada escritura
+        super().__init__(self._conectar(), avisar=self._cambio)
+        # Solo cuenta en una base de datos nueva y antes de pasar a WAL; las
+        # existentes cambian de modo en su primera compactación (maintenance).
+        self.con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self.con.execute("PRAGMA journal_mode=WAL")
+
+    def _cambio(self, cambiados=(), eliminados=()):
+        # Contador barato para invalidar cachés: sube con cada escritura confirmada.
+        with self._lock:
+            self.version += 1
+        for oyente in list(self.oyentes):
+            oyente(cambiados, eliminados)
+
+    def _conectar(self, solo_lectura=False, otro_hilo=False):
+        con = sqlite3.connect(self.path, cached_statements=256,
+                              check_same_thread=not (solo_lectura or otro_hilo),
+                              factory=ConexionMedida if METRICAS.activo else sqlite3.Connection)
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute("PRAGMA temp_store=MEMORY")
+        con.execute("PRAGMA cache_size=-16000")
+        con.execute("PRAGMA mmap_size=268435456")
+        con.execute("PRAGMA busy_timeout=5000")
+        if solo_lectura:
+            con.execute("PRAGMA query_only=1")
+        return con
+
+    @contextmanager
+    def lector(self):
+        """Presta un Repositorio de solo lectura (para hilos en segundo plano)."""
+        try:
+            con = self._lectores.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                crear = self._n_lectores < self.max_lectores
+                if crear:
+                    self._n_lectores += 1
+            con = self._conectar(solo_lectura=True) if crear else self._lectores.get()
+        try:
+            yield Repositorio(con, self.fts, avisar=self._cambio, virtuales=self._virtuales)
+        finally:
+            self._lectores.put(con)
+
+    @contextmanager
+    def escritor(self):
+        """Repositorio con una conexión de escritura propia, para un hilo en segundo plano."""
+        con = self._conectar(otro_hilo=True)
+        try:
+            yield Repositorio(con, self.fts, avisar=self._cambio, virtuales=self._virtuales)
+        finally:
+            con.close()
+
+    def close(self):
+        while True:
+            try:
+                self._lectores.get_nowait().close()
+            except queue.Empty:
+                break
+        try:
+            self.con.execute("PRAGMA optimize")
+        except sqlite3.Error:
+            pass
+        self.con.close()
+
+    def init_schema(self):
+        """Aplica en orden las migraciones pendientes (PRAGMA user_version)."""
+        (version,) = self.con.execute("PRAGMA user_version").fetchone()
+        for numero in range(version + 1, len(MIGRACIONES) + 1):
+            with self.con:
+                self.con.execute("BEGIN")
+                MIGRACIONES[numero - 1](self.con)
+                self.con.execute(f"PRAGMA user_version={numero}")
+        self.fts = self.con.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='movimientos_fts'").fetchone() is not None
@@ -0,0 +1,136 @@
+"""Sincronización por cambios entre dos copias del libro (portátil y sobremesa).
+
+Cada base de datos registra en la tabla cambios el último cambio de cada
+movimiento, con un seq que solo crece, y en pares hasta qué seq de cada
+otro equipo ha aplicado ya. Sincronizar es pedir al otro los cambios con
+seq mayor y aplicarlos (Repositorio.aplicar_cambios, gana el más reciente):
+cuesta lo que los cambios, no lo que el libro.
+
+Las reglas de los fijos viajan igual: una excepción es el cambio del
+movimiento de ese mes (el uid de su copia, exista o no aquí) y el fin y
+las cantidades desde un mes son partes de la regla, con el uid del origen
+(tabla cambios_reglas). El modo virtual o con copias de cada equipo no se
+sincroniza: solo cambia cómo se guardan los mismos meses.
+
+Se puede sincronizar directamente con el otro fichero o a través de un
+directorio compartido (una carpeta que se copia entre los equipos). En el
+directorio cada equipo escribe, en la subcarpeta con su nodo en
+hexadecimal, paquetes <desde>-<hasta>.jsonl con sus propios cambios y lee
+los que han dejado los demás; nadie escribe en la carpeta de otro.
+"""
+import json
+import os
+import re
+
+from .instrumentation import medido
+from .storage import Storage
+
+COLUMNAS = ["nodo", "sentido", "cambios", "aplicados", "ignorados"]
+
+_CARPETA = re.compile(r"[0-9a-f]{16}")
+_PAQUETE = re.compile(r"(\d{12})-(\d{12})\.jsonl")
+
+
+def nombre_nodo(nodo: int) -> str:
+    """El nodo (entero con signo de 64 bits) en hexadecimal, como se ve en el directorio."""
+    return f"{nodo & 0xFFFFFFFFFFFFFFFF:016x}"
+
+
+def _nodo_de(nombre: str) -> int:
+    valor = int(nombre, 16)
+    return valor - (1 << 64) if valor >= 1 << 63 else valor
+
+
+@medido("sincronizar")
+def sincronizar(repo, otro):
+    """Intercambia con otro (Repositorio de la otra base de datos) los cambios que le faltan a cada uno.
+
+    Devuelve las filas de COLUMNAS: una con lo recibido y otra con lo enviado.
+    """
+    mio, suyo = repo.nodo(), otro.nodo()
+    if mio == suyo:
+        raise ValueError("Las dos bases de datos tienen el mismo nodo porque una es copia de la otra:"
+                         " dale uno nuevo a una de ellas con sync --nuevo-nodo")
+    # A cada lado no se le devuelve lo que hizo él mismo.
+    hasta_suyo, suyos = otro.cambios_desde(repo.recibido(suyo), excluir=mio)
+    hasta_mio, mios = repo.cambios_desde(otro.recibido(mio), excluir=suyo)
+    recibidos = repo.aplicar_cambios(suyos, de=suyo, hasta=hasta_suyo)
+    enviados = otro.aplicar_cambios(mios, de=mio, hasta=hasta_mio)
+    return [(nombre_nodo(suyo), "recibidos", len(suyos), *recibidos),
+            (nombre_nodo(suyo), "enviados", len(mios), *enviados)]
+
+
+def _paquetes(carpeta):
+    """(desde, hasta, ruta) de los paquetes de una carpeta de nodo, en orden."""
+    try:
+        nombres = os.listdir(carpeta)
+    except FileNotFoundError:
+        return []
+    paquetes = []
+    for nombre in nombres:
+        m = _PAQUETE.fullmatch(nombre)
+        if m:
+            paquetes.append((int(m.group(1)), int(m.group(2)), os.path.join(carpeta, nombre)))
+    return sorted(paquetes)
+
+
+def _escribir_paquete(carpeta, desde, hasta, cambios):
+    ruta = os.path.join(carpeta, f"{desde:012d}-{hasta:012d}.jsonl")
+    tmp = os.path.join(carpeta, f".{desde:012d}-{hasta:012d}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        for cambio in cambios:
+            f.write(json.dumps(cambio, ensure_ascii=False, separators=(",", ":")))
+            f.write("\n")
+    # Quien lea el directorio a la vez nunca ve un paquete a medias.
+    os.replace(tmp, ruta)
+
+
+def _leer_paquete(ruta):
+    with open(ruta, encoding="utf-8") as f:
+        return [json.loads(linea) for linea in f if linea.strip()]
+
+
+@medido("sincronizar_directorio")
+def sincronizar_directorio(repo, directorio):
+    """Deja en directorio los cambios hechos aquí y aplica los que han dejado los demás equipos.
+
+    Devuelve las filas de COLUMNAS: la de lo publicado y una por cada
+    equipo del que se recibió algo.
+    """
+    mio = nombre_nodo(repo.nodo())
+    propia = os.path.join(directorio, mio)
+    os.makedirs(propia, exist_ok=True)
+    publicado = max((hasta for _, hasta, _ in _paquetes(propia)), default=0)
+    hasta, cambios = repo.cambios_desde(publicado, propios=True)
+    if cambios:
+        _escribir_paquete(propia, publicado, hasta, cambios)
+    filas = [(mio, "publicados", len(cambios), None, None)]
+    for carpeta in sorted(os.listdir(directorio)):
+        if carpeta == mio or not _CARPETA.fullmatch(carpeta):
+            continue
+        nodo = _nodo_de(carpeta)
+        visto = repo.recibido(nodo)
+        total = [0, 0, 0]
+        for _, hasta, ruta in _paquetes(os.path.join(directorio, carpeta)):
+            if hasta <= visto:
+                continue
+            cambios = _leer_paquete(ruta)
+            for i, n in enumerate((len(cambios), *repo.aplicar_cambios(cambios, de=nodo, hasta=hasta))):
+                total[i] += n
+        if total[0]:
+            filas.append((carpeta, "recibidos", *total))
+    return filas
+
+
+def sincronizar_ruta(repo, ruta):
+    """sincronizar_directorio si ruta es un directorio; si no, sincronizar con la base de datos de ese fichero."""
+    if os.path.isdir(ruta):
+        return sincronizar_directorio(repo, ruta)
+    if not os.path.isfile(ruta):
+        raise ValueError(f"No existe {ruta}: indica otra base de datos o un directorio compartido")
+    otro = Storage(ruta)
+    try:
+        otro.init_schema()
+        return sincronizar(repo, otro)
+    finally:
+        otro.close()
@@ -0,0 +1,81 @@
+"""Generador determinista de libros de movimientos sintéticos para pruebas de rendimiento.
+
+Con la misma semilla y los mismos parámetros siempre sale la misma base de
+datos. Los fijos se crean como en la aplicación: un movimiento origen con su
+regla en reglas_fijas y una copia por mes ya materializada hasta el final del
+periodo; en modo virtual no hay copias y la regla acaba con el periodo. Los
+variables se reparten por días, con conceptos cuya frecuencia decae como
+1/rango (unos pocos muy repetidos y una cola larga).
+"""
+import random
+from datetime import datetime
+from itertools import accumulate
+
+from .conversions import dt_to_ts
+from .recurrence import mes_de, ocurrencias_mensuales
+
+CATEGORIAS = ("Supermercado", "Restaurante", "Gasolina", "Farmacia", "Ropa", "Ocio",
+              "Transporte", "Regalo", "Bizum", "Compra online", "Cafetería", "Libros")
+FIJOS = ("Alquiler", "Nómina", "Seguro", "Luz", "Agua", "Internet", "Gimnasio",
+         "Suscripción", "Préstamo", "Comunidad")
+
+
+def _conceptos(rng, n):
+    return [f"{rng.choice(CATEGORIAS)} {i}" for i in range(n)]
+
+
+def generar_libro(repo, anios=5, filas_dia=10.0, proporcion_fijos=0.1, n_conceptos=200,
+                  semilla=1, anio_inicio=2015):
+    """Llena repo con unos anios*365*filas_dia movimientos; devuelve cuántos creó.
+
+    proporcion_fijos es la parte aproximada de filas que son copias de fijos.
+    """
+    rng = random.Random(semilla)
+    inicio = datetime(anio_inicio, 1, 1)
+    fin = datetime(anio_inicio + anios, 1, 1)
+    dia0 = dt_to_ts(inicio) // 86400
+    n_dias = dt_to_ts(fin) // 86400 - dia0
+    ultimo_mes = (anio_inicio + anios - 1, 12)
+
+    total = filas_dia * n_dias
+    n_reglas = round(total * proporcion_fijos / (anios * 12)) if proporcion_fijos > 0 else 0
+    creados = 0
+    for i in range(n_reglas):
+        tipo = "Entrada" if rng.random() < 0.2 else "Gasto"
+        cantidad = rng.randint(1000, 200000) if tipo == "Entrada" else rng.randint(500, 90000)
+        primero = datetime(anio_inicio, rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23))
+        concepto = f"{FIJOS[i % len(FIJOS)]} {i}"
+        mid, ts = repo.save_movement(concepto, "Fijo", tipo, cantidad, dt_to_ts(primero))
+        rid, virtual = repo.con.execute("""SELECT r.id, r.virtual FROM movimientos m
+                                           JOIN reglas_fijas r ON r.id = m.regla_id WHERE m.id=?""",
+                                        (mid,)).fetchone()
+        if virtual:
+            # Sin copias: la regla acaba con el periodo y sus meses se calculan al consultar.
+            repo.terminar_regla(rid, dt_to_ts(fin) - 1)
+            creados += 1
+            continue
+        siguiente = (primero.year, primero.month + 1) if primero.month < 12 else (primero.year + 1, 1)
+        copias = [(concepto, tipo, cantidad, t, rid, mes_de(t))
+                  for t in ocurrencias_mensuales(ts, siguiente, ultimo_mes)]
+        with repo.con:
+            repo.con.executemany(repo.SQL_INSERT_FIJO, copias)
+            repo.con.execute("UPDATE reglas_fijas SET materializado_hasta=? WHERE id=?",
+                             (f"{ultimo_mes[0]:04d}-{ultimo_mes[1]:02d}", rid))
+        creados += 1 + len(copias)
+
+    conceptos = _conceptos(rng, max(1, n_conceptos))
+    pesos = list(accumulate(1 / (r + 1) for r in range(len(conceptos))))
+    por_dia = max(0.0, total - creados) / n_dias
+
+    def variables():
+        for d in range(n_dias):
+            k = int(por_dia) + (rng.random() < por_dia % 1)
+            for _ in range(k):
+                tipo = "Entrada" if rng.random() < 0.15 else "Gasto"
+                cantidad = max(1, int(rng.lognormvariate(7.5, 1.2)))
+                ts = (dia0 + d) * 86400 + rng.randrange(86400)
+                concepto = rng.choices(conceptos, cum_weights=pesos)[0]
+                yield (concepto, "Variable", tipo, cantidad, ts, None)
+
+    _, insertadas = repo.importar_movimientos(variables(), lote=20000)
+    return creados + insertadas
@@ -0,0 +1,26 @@
+"""Órdenes de la línea de órdenes que escriben en la base de datos."""
+from financial_core.cli import main
+from financial_core.storage import Storage
+
+
+def contar(ruta):
+    db = Storage(str(ruta))
+    try:
+        return db.contar_movimientos(("Todos", "", "", ""))
+    finally:
+        db.close()
+
+
+def test_generate_no_escribe_en_un_libro_con_movimientos(tmp_path, capsys):
+    ruta = tmp_path / "prueba.db"
+    generar = ["--db", str(ruta), "generate", "--anios", "1", "--filas-dia", "1"]
+    assert main(generar) == 0
+    n = contar(ruta)
+    assert n > 0
+
+    assert main(generar) == 1
+    assert "--force" in capsys.readouterr().err
+    assert contar(ruta) == n
+
+    assert main(generar + ["--force"]) == 0
+    assert contar(ruta) > n
@@ -0,0 +1,42 @@
+"""Exportación de movimientos: formato según el destino y columnas .npy."""
+import json
+
+import pytest
+
+from financial_core.exporter import exportar_movimientos, formato_por_extension
+from financial_core.storage import Storage
+
+TODOS = ("Todos", "", "", "")
+
+
+@pytest.mark.parametrize("ruta, formato", [
+    ("datos.csv", "csv"), ("datos.JSONL", "jsonl"), ("datos.json", "json"),
+    ("columnas.npy", "npy"), ("columnas", "npy"), ("salida/", "npy"),
+])
+def test_formato_por_extension(ruta, formato):
+    assert formato_por_extension(ruta) == formato
+
+
+def test_extension_desconocida(tmp_path):
+    with pytest.raises(ValueError, match=r"\.txt"):
+        formato_por_extension("datos.txt")
+    (tmp_path / "raro.txt").mkdir()
+    assert formato_por_extension(str(tmp_path / "raro.txt")) == "npy"
+
+
+def test_columnas_con_tipo_y_periodicidad_desconocidos(tmp_path):
+    np = pytest.importorskip("numpy")
+    db = Storage(str(tmp_path / "libro.db"))
+    db.init_schema()
+    db.save_movement("Café", "Variable", "Gasto", 120, 1420100000)
+    db.importar_movimientos([("Traspaso", "Mensual", "Transferencia", 5000, 1420200000, None)])
+    destino = tmp_path / "columnas.npy"
+    assert exportar_movimientos(db, TODOS, str(destino)) == 2
+    db.close()
+
+    meta = json.loads((destino / "meta.json").read_text(encoding="utf-8"))
+    tipos = [meta["tipo"][c] for c in np.load(destino / "tipo.npy")]
+    periodicidades = [meta["periodicidad"][c] for c in np.load(destino / "periodicidad.npy")]
+    assert tipos == ["Gasto", "Transferencia"]
+    assert periodicidades == ["Variable", "Mensual"]
+    assert meta["tipo"][:2] == ["Entrada", "Gasto"]
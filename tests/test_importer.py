@@ -0,0 +1,61 @@
+"""Importar dos veces el mismo extracto no duplica movimientos (huella de cada apunte)."""
+import pytest
+
+from financial_core.importer import abrir, formato_por_extension, importar
+from financial_core.storage import Storage
+
+CSV = """Fecha;Concepto;Importe;Referencia
+02/01/2015;Nómina enero;1.850,00;
+03/01/2015;Café;-1,20;
+03/01/2015;Café;-1,20;
+04/01/2015;Supermercado;-54,37;R-1
+04/01/2015;Supermercado;-54,37;R-2
+"""
+
+OFX = """OFXHEADER:100
+DATA:OFXSGML
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20150105120000<TRNAMT>-30.00<FITID>A1<NAME>Gasolina</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20150106<TRNAMT>12.50<FITID>A2<NAME>Bizum</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20150106<TRNAMT>-12.50<FITID>A3<NAME>Bizum</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Storage(str(tmp_path / "libro.db"))
+    db.init_schema()
+    yield db
+    db.close()
+
+
+def importar_fichero(db, ruta):
+    formato = formato_por_extension(str(ruta))
+    with abrir(str(ruta), formato) as f:
+        return importar(db, f, formato, lote=2)
+
+
+@pytest.mark.parametrize("nombre, contenido, filas, balance", [
+    ("extracto.csv", CSV, 5, 185000 - 240 - 10874),
+    ("extracto.ofx", OFX, 3, -3000),
+])
+def test_segunda_importacion_no_inserta_nada(db, tmp_path, nombre, contenido, filas, balance):
+    ruta = tmp_path / nombre
+    ruta.write_text(contenido, encoding="utf-8")
+    # Los dos cafés iguales del mismo día son dos apuntes, no un duplicado.
+    assert importar_fichero(db, ruta) == (filas, filas)
+    assert db.calcular_balance() == balance
+
+    assert importar_fichero(db, ruta) == (filas, 0)
+    assert db.contar_movimientos(("Todos", "", "", "")) == filas
+    assert db.calcular_balance() == balance
+
+
+def test_lo_archivado_tampoco_se_duplica(db, tmp_path):
+    ruta = tmp_path / "extracto.csv"
+    ruta.write_text(CSV, encoding="utf-8")
+    importar_fichero(db, ruta)
+    assert db.archivar(2015) == 5
+    assert importar_fichero(db, ruta) == (5, 0)
+    assert db.calcular_balance() == 185000 - 240 - 10874
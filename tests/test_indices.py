@@ -0,0 +1,58 @@
+"""Las consultas del listado, los filtros y las series usan los índices de _migracion_indices.
+
+Se capturan las sentencias que lanza el propio Repositorio (con sus valores
+ya sustituidos) y se comprueba su EXPLAIN QUERY PLAN.
+"""
+import pytest
+
+from financial_core.storage import Storage
+from financial_core.synthetic import generar_libro
+
+
+@pytest.fixture(scope="module")
+def db(tmp_path_factory):
+    db = Storage(str(tmp_path_factory.mktemp("indices") / "libro.db"))
+    db.init_schema()
+    generar_libro(db, anios=2, filas_dia=5)
+    db.con.execute("ANALYZE")
+    yield db
+    db.close()
+
+
+def planes(db, llamada, *args):
+    """{sentencia: plan} de las consultas sobre movimientos que hace llamada(*args)."""
+    sentencias = []
+    db.con.set_trace_callback(sentencias.append)
+    try:
+        llamada(*args)
+    finally:
+        db.con.set_trace_callback(None)
+    return {s: " | ".join(fila[3] for fila in db.con.execute("EXPLAIN QUERY PLAN " + s))
+            for s in sentencias if "movimientos" in s}
+
+
+def test_listado_usa_idx_mov_creado(db):
+    planes_listado = planes(db, db.pagina_movimientos, ("Todos", "", "", ""), 50)
+    assert planes_listado
+    for sql, plan in planes_listado.items():
+        assert "ORDER BY creado_en DESC, id DESC" in sql
+        assert "USING INDEX idx_mov_creado" in plan, plan
+        assert "TEMP B-TREE" not in plan, plan
+
+
+def test_tipo_y_rango_de_fechas_usan_idx_mov_tipo_creado(db):
+    planes_rango = planes(db, db.contar_movimientos, ("Gasto", "", "01/01/2015", "31/03/2015"))
+    assert planes_rango
+    for plan in planes_rango.values():
+        assert "idx_mov_tipo_creado (tipo=? AND creado_en>? AND creado_en<?)" in plan, plan
+
+
+def test_serie_de_gasto_variable_usa_indice_que_cubre(db):
+    planes_serie = planes(db, db.series_gasto_variable_por_concepto)
+    assert planes_serie
+    for plan in planes_serie.values():
+        assert "USING COVERING INDEX" in plan, plan
+    plan = " | ".join(fila[3] for fila in db.con.execute("""
+        EXPLAIN QUERY PLAN SELECT strftime('%Y-%m', creado_en, 'unixepoch'), SUM(cantidad)
+        FROM movimientos WHERE tipo='Gasto' AND periodicidad!='Fijo' GROUP BY 1"""))
+    assert "USING COVERING INDEX idx_mov_tipo_creado" in plan, plan
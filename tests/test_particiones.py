@@ -0,0 +1,61 @@
+"""Archivar un año en su partición y restaurarlo no cambia lo que se ve del libro."""
+from datetime import datetime
+
+import pytest
+
+from financial_core.aggregation import agrupar_entradas_gastos
+from financial_core.conversions import dt_to_ts
+from financial_core.storage import Storage
+from financial_core.synthetic import generar_libro
+
+FILTROS = [("Todos", "", "", ""), ("Gasto", "", "", ""), ("Todos", "", "01/11/2015", "28/02/2016")]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Storage(str(tmp_path / "libro.db"))
+    db.init_schema()
+    generar_libro(db, anios=3, filas_dia=3)
+    yield db
+    db.close()
+
+
+def foto(db):
+    (n,) = db.con.execute("SELECT COUNT(*) FROM movimientos").fetchone()
+    total = db.contar_movimientos(FILTROS[0])
+    vista = (
+        db.calcular_balance(),
+        [db.totales_mensuales(anio) for anio in (2015, 2016, 2017)],
+        db.totales_anuales(),
+        [db.balance_en(dt_to_ts(datetime(*f))) for f in ((2015, 7, 1), (2016, 12, 31, 23), (2017, 3, 1))],
+        [db.saldo_cierre(2015 * 12 + m) for m in (0, 11, 20)],
+        [agrupar_entradas_gastos(db, modo) for modo in ("Mes", "Año")],
+        [db.contar_movimientos(f) for f in FILTROS],
+        [db.cargar_movimientos_filtrados(*f) for f in FILTROS],
+        [db.pagina_movimientos(FILTROS[0], 20, offset=k) for k in (0, total // 2, total - 10)],
+    )
+    return n, vista
+
+
+def test_archivar_y_restaurar_conserva_totales_y_listado(db):
+    n, antes = foto(db)
+    assert db.archivar(2015) > 0
+    assert db.archivar(2016) > 0
+    assert db.particiones() == [2015, 2016]
+    n_archivado, archivado = foto(db)
+    assert n_archivado < n
+    assert archivado == antes
+
+    assert db.restaurar_archivado(2016) > 0
+    assert db.restaurar_archivado(2015) > 0
+    assert db.particiones() == []
+    assert foto(db) == (n, antes)
+
+
+def test_lo_archivado_no_se_puede_editar(db):
+    db.archivar(2015)
+    marzo = db.cargar_movimientos_filtrados("Todos", "", "01/03/2015", "31/03/2015")
+    mid = next(f[0] for f in marzo if f[2] == "Variable")
+    with pytest.raises(ValueError):
+        db.eliminar_movimiento(mid)
+    assert db.obtener_movimiento_por_id(mid) is not None
@@ -0,0 +1,58 @@
+"""Los cierres de saldos_mensuales siguen cuadrando con la suma de los movimientos tras cada escritura."""
+from datetime import datetime
+
+import pytest
+
+from financial_core.conversions import dt_to_ts
+from financial_core.storage import Storage
+from financial_core.synthetic import generar_libro
+
+NETO = "COALESCE(SUM(CASE WHEN tipo='Entrada' THEN cantidad WHEN tipo='Gasto' THEN -cantidad ELSE 0 END), 0)"
+INSTANTES = [dt_to_ts(datetime(*f)) for f in ((2015, 1, 1), (2015, 3, 14, 12), (2015, 12, 31, 23, 59, 59),
+                                              (2016, 6, 1), (2016, 6, 30, 18), (2030, 1, 1))]
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Storage(str(tmp_path / "libro.db"))
+    db.init_schema()
+    generar_libro(db, anios=2, filas_dia=3)
+    yield db
+    db.close()
+
+
+def comprobar(db):
+    (total,) = db.con.execute(f"SELECT {NETO} FROM movimientos").fetchone()
+    assert db.calcular_balance() == total
+    for ts in INSTANTES:
+        (hasta,) = db.con.execute(f"SELECT {NETO} FROM movimientos WHERE creado_en <= ?", (ts,)).fetchone()
+        assert db.balance_en(ts) == hasta, ts
+    for mes in (2015 * 12, 2015 * 12 + 5, 2016 * 12 + 11):
+        y, m = divmod(mes + 1, 12)
+        fin = dt_to_ts(datetime(y, m + 1, 1)) - 1
+        (hasta,) = db.con.execute(f"SELECT {NETO} FROM movimientos WHERE creado_en <= ?", (fin,)).fetchone()
+        assert db.saldo_cierre(mes) == hasta, mes
+
+
+def test_insertar_editar_y_borrar_en_el_pasado(db):
+    comprobar(db)
+    mid, _ = db.save_movement("Devolución", "Variable", "Entrada", 12345, dt_to_ts(datetime(2015, 2, 10, 9)))
+    comprobar(db)
+    # Cambia de tipo, de cantidad y de mes (y de año).
+    db.actualizar_movimiento(mid, "Devolución", "Variable", "Gasto", 999, dt_to_ts(datetime(2016, 6, 30, 8)))
+    comprobar(db)
+    (viejo,) = db.con.execute("SELECT id FROM movimientos WHERE creado_en < ? ORDER BY creado_en LIMIT 1",
+                              (dt_to_ts(datetime(2015, 1, 20)),)).fetchone()
+    db.eliminar_movimiento(viejo)
+    comprobar(db)
+    db.eliminar_movimiento(mid)
+    comprobar(db)
+
+
+def test_edicion_en_bloque(db):
+    ids = [i for (i,) in db.con.execute("""SELECT id FROM movimientos WHERE periodicidad='Variable'
+                                            ORDER BY creado_en LIMIT 40""")]
+    db.actualizar_movimientos(ids, tipo="Entrada", desplazar=40 * 86400)
+    comprobar(db)
+    db.eliminar_movimientos(ids[::2])
+    comprobar(db)
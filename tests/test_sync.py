@@ -0,0 +1,120 @@
+"""Dos copias del libro que cambian a la vez acaban iguales: gana el cambio (hecho_ms, nodo) mayor."""
+import shutil
+import time
+from datetime import datetime
+
+import pytest
+
+from financial_core.conversions import dt_to_ts
+from financial_core.storage import Storage
+from financial_core.sync import sincronizar
+from financial_core.synthetic import generar_libro
+
+
+def crear_pareja(tmp_path, virtual=False):
+    """Dos copias de un libro sintético con nodos distintos, como tras copiar el fichero a otro equipo."""
+    a = Storage(str(tmp_path / "a.db"))
+    a.init_schema()
+    a.modo_fijos(virtual)
+    generar_libro(a, anios=1, filas_dia=3)
+    a.close()
+    shutil.copy(tmp_path / "a.db", tmp_path / "b.db")
+    a, b = Storage(str(tmp_path / "a.db")), Storage(str(tmp_path / "b.db"))
+    a.init_schema()
+    b.init_schema()
+    b.renovar_nodo()
+    return a, b
+
+
+@pytest.fixture
+def pareja(tmp_path):
+    a, b = crear_pareja(tmp_path)
+    yield a, b
+    a.close()
+    b.close()
+
+
+def libro(db):
+    return sorted(db.con.execute("SELECT uid, concepto, periodicidad, tipo, cantidad, creado_en FROM movimientos"))
+
+
+def variables(db, n):
+    """(id, uid) de n movimientos variables; en el otro equipo el id puede cambiar, el uid no."""
+    return db.con.execute("SELECT id, uid FROM movimientos WHERE periodicidad='Variable' ORDER BY id LIMIT ?",
+                          (n,)).fetchall()
+
+
+def concepto(db, uid):
+    fila = db.con.execute("SELECT concepto FROM movimientos WHERE uid=?", (uid,)).fetchone()
+    return fila and fila[0]
+
+
+def test_gana_el_cambio_posterior(pareja):
+    a, b = pareja
+    (primero, u1), (segundo, u2), (tercero, u3) = variables(a, 3)
+    # En cada movimiento se cambia primero en un lado y después en el otro.
+    a.actualizar_movimientos([primero], concepto="A antes")
+    b.eliminar_movimiento(segundo)
+    b.actualizar_movimientos([tercero], concepto="B antes")
+    time.sleep(0.01)
+    b.actualizar_movimientos([primero], concepto="B después")
+    a.actualizar_movimientos([segundo], concepto="A después")
+    a.eliminar_movimiento(tercero)
+    nuevo, _ = a.save_movement("Solo en A", "Variable", "Gasto", 1234, 1430000000)
+
+    sincronizar(a, b)
+
+    assert libro(a) == libro(b)
+    assert a.calcular_balance() == b.calcular_balance()
+    for db in (a, b):
+        assert concepto(db, u1) == "B después"
+        assert concepto(db, u2) == "A después"
+        assert concepto(db, u3) is None
+    assert any(f[1] == "Solo en A" for f in b.cargar_movimientos())
+    # Lo ya aplicado no se vuelve a enviar.
+    assert [fila[2] for fila in sincronizar(a, b)] == [0, 0]
+
+
+def test_con_el_mismo_instante_gana_el_nodo_mayor(pareja):
+    a, b = pareja
+    [(mid, uid)] = variables(a, 1)
+    a.actualizar_movimientos([mid], concepto="de A")
+    b.actualizar_movimientos([mid], concepto="de B")
+    for db in (a, b):
+        with db.con:
+            db.con.execute("UPDATE cambios SET hecho_ms=1 WHERE uid=?", (uid,))
+
+    sincronizar(a, b)
+
+    ganador = "de A" if a.nodo() > b.nodo() else "de B"
+    assert libro(a) == libro(b)
+    assert concepto(a, uid) == ganador
+
+
+def test_reglas_editadas_en_los_dos_lados(tmp_path):
+    # En modo virtual las excepciones y los importes cambian meses ya pasados.
+    a, b = crear_pareja(tmp_path, virtual=True)
+    (regla,) = a.con.execute("SELECT id FROM reglas_fijas WHERE inicio < ? ORDER BY id",
+                              (dt_to_ts(datetime(2015, 6, 1)),)).fetchone()
+    a.excepcion_regla(regla, (2015, 10), saltar=True)
+    b.excepcion_regla(regla, (2015, 10), cantidad=5)
+    b.excepcion_regla(regla, (2015, 11), cantidad=6)
+    time.sleep(0.01)
+    a.excepcion_regla(regla, (2015, 11), cantidad=7)
+    b.cambiar_cantidad_regla(regla, (2015, 8), 777)
+    fin = dt_to_ts(datetime(2015, 11, 20))
+    a.terminar_regla(regla, fin)
+
+    sincronizar(a, b)
+
+    assert libro(a) == libro(b)
+    assert sorted(f[1:] for f in a.cargar_movimientos()) == sorted(f[1:] for f in b.cargar_movimientos())
+    assert a.calcular_balance() == b.calcular_balance()
+    ra, rb = a.reglas("id=?", (regla,))[0], b.reglas("id=?", (regla,))[0]
+    assert ra.importes == rb.importes
+    assert 777 in [cantidad for _, cantidad in ra.importes]
+    assert ra.fin == rb.fin == fin
+    assert {m: e[0] for m, e in ra.excepciones.items()} == {m: e[0] for m, e in rb.excepciones.items()}
+    assert rb.excepciones[2015 * 12 + 10][0] == 7
+    a.close()
+    b.close()
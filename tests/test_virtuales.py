@@ -0,0 +1,69 @@
+"""Con las reglas en modo virtual los listados cuentan sus meses como si fueran copias."""
+import pytest
+
+from financial_core.storage import Storage
+from financial_core.synthetic import generar_libro
+
+TODOS = ("Todos", "", "", "")
+
+
+@pytest.fixture(scope="module")
+def db(tmp_path_factory):
+    db = Storage(str(tmp_path_factory.mktemp("virtuales") / "libro.db"))
+    db.init_schema()
+    db.modo_fijos(True)
+    generar_libro(db, anios=2, filas_dia=4)
+    yield db
+    db.close()
+
+
+def test_cargar_movimientos_incluye_los_virtuales(db):
+    filas = db.cargar_movimientos()
+    assert any(f[0] < 0 for f in filas)
+    assert len(filas) == db.contar_movimientos(TODOS)
+    assert filas == sorted(filas, key=lambda f: (f[5], f[0]))
+    assert filas[::-1] == db.cargar_movimientos_filtrados(*TODOS)
+
+
+@pytest.mark.parametrize("filtros", [TODOS, ("Gasto", "", "", ""), ("Todos", "", "01/06/2015", "31/03/2016")])
+def test_pagina_por_offset_cae_en_la_fila_exacta(db, filtros):
+    todas = db.cargar_movimientos_filtrados(*filtros)
+    assert any(f[0] < 0 for f in todas)
+    for k in [0, 1, 7, len(todas) // 3, len(todas) // 2, len(todas) - 5, len(todas) - 1]:
+        assert db.pagina_movimientos(filtros, 5, offset=k) == todas[k:k + 5], k
+    for k in range(0, len(todas), 97):
+        assert db.pagina_movimientos(filtros, 1, offset=k)[0] == todas[k], k
+
+
+def multiconjunto(db):
+    return sorted(f[1:] for f in db.cargar_movimientos())
+
+
+def test_cambiar_de_modo_conserva_los_movimientos(tmp_path):
+    db = Storage(str(tmp_path / "modos.db"))
+    db.init_schema()
+    generar_libro(db, anios=2, filas_dia=2)
+    db.materializar_fijos()
+    # Una copia editada y otra borrada pasan a ser excepciones de su regla.
+    copias = [i for (i,) in db.con.execute("""
+        SELECT id FROM movimientos WHERE regla_id IS NOT NULL
+        AND id NOT IN (SELECT origen_id FROM reglas_fijas) ORDER BY id LIMIT 2""")]
+    db.actualizar_movimientos([copias[0]], concepto="Otro", desplazar=3600)
+    db.eliminar_movimiento(copias[1])
+    antes, balance = multiconjunto(db), db.calcular_balance()
+
+    db.modo_fijos(True)
+    assert db.con.execute("SELECT COUNT(*) FROM reglas_excepciones").fetchone()[0] > 0
+    assert any(f[0] < 0 for f in db.cargar_movimientos())
+    assert multiconjunto(db) == antes
+    assert db.calcular_balance() == balance
+
+    db.modo_fijos(False)
+    assert not any(f[0] < 0 for f in db.cargar_movimientos())
+    assert multiconjunto(db) == antes
+    assert db.calcular_balance() == balance
+
+    db.modo_fijos(True)
+    assert multiconjunto(db) == antes
+    assert db.calcular_balance() == balance
+    db.close()